@@ -3,14 +3,35 @@ import os
 import uuid
 import json
 import re
-import urllib.parse
-import httpx
 import time
+from contextlib import aclosing, asynccontextmanager
 from typing import List, Optional
 from fastapi import APIRouter, Request, Header, UploadFile, File
 from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from app.services.ollama_client import get_tags, stream_completion
+from app.services.streaming import with_heartbeats, once, HEARTBEAT
+from app.services.model_residency import ModelResidencyError
+from app.services.ollama_pool import ollama_pool
+from app.services.ollama_meta import ollama_meta
+from app.services.hedging import hedge_policy, hedged_chat
+from app.services.batch_planner import batch_planner
+from app.services.model_profiles import model_profiles
+from app.services.context_sizing import context_sizer, estimate_request_tokens
+from app.services.token_counter import token_counter
+from app.services.circuit_breaker import CircuitOpenError, circuit_breakers
+from app.services.cascade import cascade_stats, choice_schema, split, vote
+from app.services.model_router import AUTO_MODEL, model_router
+from app.services.prompt_compaction import SYSTEM_HINT as COMPACTION_HINT, compaction_stats, head_chars_for, prompt_line
+from app.services.single_flight import single_flight
+from app.services.early_stop import AnswerTracker, chat_limits, early_stop_stats
+from app.services.deadline import by_ambiguity, call_overhead_seconds, deadline_stats, parse_deadline_ms, split_for_deadline
+from app.services.style_audit import audit_stats, expected_styles, find_deviations
+from app.services.completion_request import CompletionRequestError, read_completion_request
+from app.services.text_features import compute_batch, clean_query as make_clean_query
+from app.services import metrics
 from app.services.rag_engine import rag_engine
+from app.services.rag_async import async_rag
+from app.services.loop_monitor import loop_monitor
 from app.services.llm_checker import get_safe_context, get_chars_per_token, SYSTEM_CPT
 from pydantic import BaseModel
 import subprocess
@@ -43,6 +64,13 @@ class CompletionRequest(BaseModel):
 class ContextRequest(BaseModel):
     text: str
 
+class ContextBatchRequest(BaseModel):
+    texts: List[str]
+
+# Progressive refinement: сколько предварительных стилей выдали и сколько LLM поправила
+_progressive_stats = {"batches": 0, "provisional": 0, "revised": 0, "confirmed": 0, "refinement_errors": 0}
+metrics.register("progressive", lambda: dict(_progressive_stats))
+
 TEMP_DIR = os.path.join(os.getcwd(), "data", "temp")
 os.makedirs(TEMP_DIR, exist_ok=True)
 
@@ -137,13 +165,36 @@ def _find_style_by_keyword(style_map: dict, keywords: list[str]) -> Optional[str
             return s_name
     return None
 
-def apply_heuristics(paragraphs: list[dict], style_map: dict) -> dict[int, str]:
+def _parse_llm_styles(buffer_text: str) -> dict[int, str]:
+    """Ответ LLM {"<id>": "<стиль>"} → {id: стиль}; json_repair вылечит обрывы (незакрытые скобки/кавычки)."""
+    styles: dict[int, str] = {}
+    if not buffer_text.strip():
+        return styles
+    try:
+        parsed_dict = json_repair.loads(buffer_text)
+    except Exception as e:
+        print(f"❌ JSON Repair failed for buffer: {e}")
+        return styles
+    if not isinstance(parsed_dict, dict):
+        print(f"⚠️ LLM returned non-dict JSON: {type(parsed_dict)}")
+        return styles
+    print(f"✅ LLM buffer repaired & parsed. Items: {len(parsed_dict)}", flush=True)
+    for k, llm_style_name in parsed_dict.items():
+        if str(k).isdigit() and isinstance(llm_style_name, str):
+            styles[int(k)] = llm_style_name
+    return styles
+
+
+def apply_heuristics(paragraphs: list[dict], style_map: dict, features: dict | None = None) -> dict[int, str]:
     """
     Шаг A: Применяет простые правила (эвристики) для назначения стилей.
     Ищет динамические стили из RAG (без хардкода).
+    features — {id: TextFeatures} батча (text_features.compute_batch), если уже посчитаны.
     Возвращает {id: style_name}.
     """
     results = {}
+    if features is None:
+        features = compute_batch(paragraphs)
     
     # Ищем подходящие стили из документа
     heading_style = _find_style_by_keyword(style_map, ["heading", "заголовок", "title", "глава"])
@@ -152,24 +203,24 @@ def apply_heuristics(paragraphs: list[dict], style_map: dict) -> dict[int, str]:
     
     for p in paragraphs:
         pid = p.get("id")
-        text = str(p.get("text", "")).strip()
-        if not text or pid is None:
+        f = features.get(pid) if pid is not None else None
+        if f is None or not f.length:
             continue
             
         # 1. Заголовок (Короткий + ALL CAPS)
-        if heading_style and len(text) <= 80 and text.isupper():
+        if heading_style and f.length <= 80 and f.is_upper:
             results[pid] = heading_style
             print(f"  🧠 Heuristic: Заголовок -> [ID: {pid}]")
             continue
             
         # 2. Нумерованный список
-        if list_num_style and re.match(r'^\d+[\.\)]\s+', text):
+        if list_num_style and f.list_prefix == "num":
             results[pid] = list_num_style
             print(f"  🧠 Heuristic: Список (Num) -> [ID: {pid}]")
             continue
             
         # 3. Маркированный список
-        if list_bul_style and re.match(r'^[-•\*]\s+', text):
+        if list_bul_style and f.list_prefix == "bullet":
             results[pid] = list_bul_style
             print(f"  🧠 Heuristic: Список (Bul) -> [ID: {pid}]")
             continue
@@ -179,57 +230,224 @@ def apply_heuristics(paragraphs: list[dict], style_map: dict) -> dict[int, str]:
 
 @router.get("/api/tags")
 async def proxy_tags():
-    """Проксирует запрос к Ollama /api/tags для проверки соединения и получения списка моделей клиентом."""
-    ollama_url = settings.OLLAMA_BASE_URL.rstrip('/')
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(f"{ollama_url}/api/tags", timeout=5.0)
-            resp.raise_for_status()
-            return JSONResponse(resp.json())
-        except Exception as e:
-            return JSONResponse({"error": str(e)}, status_code=500)
+    """
+    Проксирует запрос к Ollama /api/tags для проверки соединения и получения списка моделей клиентом.
+    При нескольких узлах в пуле — объединяет списки моделей живых узлов.
+    Когда у роутера есть leaderboard, первой в списке идёт модель "auto" (services/model_router.py).
+    """
+    nodes = [n for n in ollama_pool.nodes if n.healthy] or ollama_pool.nodes
+    # Из кэша ollama_meta (META_TTL_TAGS): CheckConn не ходит в Ollama на каждый клик
+    answers = await asyncio.gather(*(ollama_meta.tags(n.url) for n in nodes), return_exceptions=True)
+    ok = [a for a in answers if not isinstance(a, Exception)]
+    if not ok:
+        return JSONResponse({"error": str(answers[0])}, status_code=500)
+    auto = [{"name": AUTO_MODEL}] if model_router.leaderboard else []
+    if len(ok) == 1:
+        return JSONResponse({**ok[0], "models": auto + ok[0].get("models", [])})
+
+    merged, seen = auto, set()
+    for answer in ok:
+        for m in answer.get("models", []):
+            if m.get("name") not in seen:
+                seen.add(m.get("name"))
+                merged.append(m)
+    return JSONResponse({"models": merged})
+
+@router.get("/api/ollama/nodes")
+async def ollama_nodes():
+    """Состояние пула Ollama: здоровье, нагрузка, латентность и tokens/sec по моделям."""
+    return JSONResponse(ollama_pool.snapshot())
+
+@router.get("/api/batch_plan")
+async def get_batch_plan(model: str):
+    """
+    Совет клиенту по размеру батча для модели: бюджет символов, число абзацев и таймаут батча.
+    Тот же совет приходит в записи "meta" в начале каждого ответа /v1/completions.
+    model=auto — совет для модели, которую сейчас выбрал бы роутер (services/model_router.py).
+    """
+    model, _ = await model_router.resolve(model)
+    node = ollama_pool.pick(model)
+    safe_context_budget, _ = await get_safe_context(model, node.url)
+    return JSONResponse(batch_planner.plan(model, node.tps_for(model), safe_context_budget))
+
+@router.post("/api/count_tokens")
+async def count_tokens(request: Request):
+    """
+    Точное число токенов для списка текстов: {"model": "...", "texts": ["...", ...]}.
+    Один /api/tokenize на батч, кэш по хэшу текста; без Ollama — CPT-оценка.
+    """
+    data = await request.json()
+    model_name = data.get('model', '')
+    texts = [str(t) for t in data.get('texts', [])]
+    node = ollama_pool.pick(model_name)
+    counts = await token_counter.count_many(model_name, texts, node.url)
+    return JSONResponse({"model": model_name, "counts": counts, "total": sum(counts)})
+
+@router.get("/api/metrics")
+async def get_metrics():
+    """Метрики сервисов бэкенда (hedging, ...) одним JSON."""
+    return JSONResponse(metrics.collect())
+
+@router.get("/api/admin/loop_lag")
+async def admin_loop_lag():
+    """Гистограмма лагов event loop и стеки блокирующего кода (LOOP_MONITOR_ENABLED=true)."""
+    return JSONResponse(loop_monitor.report())
+
+@router.get("/api/models/residency")
+async def models_residency():
+    """Какие модели загружены на узлах Ollama, кто их сейчас использует и лог событий load/evict."""
+    report = {}
+    for node in ollama_pool.nodes:
+        await node.residency.refresh(force=True)
+        report[node.url] = node.residency.snapshot()
+    return JSONResponse(report)
+
+@router.get("/api/models/profiles")
+async def models_profiles():
+    """Профили моделей, обученные на ответах Ollama: EWMA decode/prefill tokens/sec и времени загрузки."""
+    return JSONResponse(model_profiles.snapshot())
+
+@router.post("/api/models/leaderboard")
+async def models_leaderboard(request: Request):
+    """Загружает leaderboard контеста (JSON test_formatting_quality.py) для алиаса модели "auto"."""
+    try:
+        accepted = model_router.ingest(await request.json())
+    except (ValueError, AttributeError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse({"accepted": accepted, "total": len(model_router.leaderboard)})
+
+@router.get("/api/models/router")
+async def models_router():
+    """Leaderboard роутера, порог точности и последние решения для "auto"."""
+    return JSONResponse(model_router.snapshot())
 
 @router.post("/v1/completions")
 async def proxy_completions(request: Request):
     """
     Гибридный конвейер: Client Batching + Heuristics + Vector Fast Track + LLM.
-    Принимает prompt в формате JSON-массива параграфов: [{"id": 1, "text": "..."}]
+    Абзацы [{"id": 1, "text": "..."}] — массивом "paragraphs", NDJSON-телом или (по-старому)
+    JSON-строкой внутри prompt; см. services/completion_request.py.
+
+    progressive=true: сразу после A+B отдаётся предварительный стиль ("provisional")
+    для каждого оставшегося абзаца, а ответ LLM приходит потом записями "revision" —
+    только там, где он расходится с предварительным.
+
+    Поток отдаётся сразу: стадии идут внутри генератора. Первая запись — {"meta": {...}}
+    (шаблон RAG, деградация, совет по батчу), дальше результаты каждой стадии по готовности.
+    Под давлением на память ответ ещё и с заголовком X-Degraded-Mode: true.
+
+    Ollama недоступна (circuit breaker открыт или вызов упал): вместо "error" абзацы
+    получают стиль без LLM ("fallback": "vector" | "default"), а в потоке —
+    {"meta": {"llm_unavailable": true}}.
+
+    X-Deadline-Ms (или "deadline_ms"): бюджет латентности запроса. В LLM уходят самые
+    неоднозначные абзацы — столько, сколько модель успеет; остальные — без LLM
+    ("fallback": "deadline"), см. services/deadline.py.
+
+    Одинаковые запросы (повтор клиента, двойной клик) не запускают конвейер заново,
+    а читают поток первого (services/single_flight.py).
     """
-    ollama_url = settings.OLLAMA_BASE_URL
-    data = await request.json()
+    received_at = time.monotonic()
+    try:
+        data = await read_completion_request(request)
+    except CompletionRequestError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    # Дедлайн отсчитывается от прихода запроса, а не от начала конвейера
+    deadline_ms = parse_deadline_ms(request, data)
+    if deadline_ms is not None:
+        data["deadline_ms"] = deadline_ms
+        data["deadline_at"] = received_at + deadline_ms / 1000
+    if not settings.SINGLE_FLIGHT:
+        return await _hybrid_completions(request, data, request.is_disconnected)
+
+    flight, leader = single_flight.join(single_flight.fingerprint(data))
+    if not leader:
+        headers = await flight.wait_published()
+        if headers is not None:
+            print(f"🔁 Single-flight {flight.key[:8]}: {'replay' if flight.done else 'attached to in-flight request'}")
+            return StreamingResponse(flight.stream(), headers=headers)
+        # Лидер упал до начала стрима — выполняем сами
+        return await _hybrid_completions(request, data, request.is_disconnected)
+
+    async def _all_readers_gone() -> bool:
+        return flight.abandoned()
+
+    try:
+        response = await _hybrid_completions(request, data, _all_readers_gone)
+    except BaseException:
+        single_flight.abort(flight)
+        raise
+    headers = dict(response.headers)
+    single_flight.publish(flight, headers, response.body_iterator)
+    return StreamingResponse(flight.stream(), headers=headers)
+
+
+async def _hybrid_completions(request: Request, data: dict, client_gone) -> StreamingResponse:
+    """Сам конвейер A → B → C; client_gone() — пора ли бросать генерацию LLM."""
     raw_prompt = data.get('prompt', '')
-    model_name = data.get('model', '')
+    # "auto" — самая быстрая модель с точностью не ниже порога (services/model_router.py)
+    model_name, route_reason = await model_router.resolve(data.get('model', ''))
+    progressive = bool(data.get('progressive', settings.PROGRESSIVE_DEFAULT))
+    cascade_model = data.get('cascade_model', settings.CASCADE_SMALL_MODEL)
+    compact = bool(data.get('prompt_compaction', settings.PROMPT_COMPACTION))
+    document_size = data.get('document_size')
+    deadline_at = data.get('deadline_at')
     
-    # 0. Извлекаем массив параграфов из промпта
-    paragraphs = []
-    marker = "=== USER CONTENT (CONTENT SOURCE) ==="
-    if marker in raw_prompt:
-        json_content = raw_prompt.split(marker)[-1].strip()
-        try:
-            # Клиент отправляет JSON: [{"id": N, "text": "..."}]
-            paragraphs = json.loads(json_content)
-        except json.JSONDecodeError:
-            pass
-            
-    if not isinstance(paragraphs, list):
-        print("⚠️ Warning: proxy_completions did not receive a JSON array of paragraphs.")
-        paragraphs = []
+    # Узел пула Ollama: sticky по сессии документа (KV-cache reuse), иначе наименее загруженный
+    node = ollama_pool.pick(model_name, session_id=data.get('session_id'))
+    ollama_url = node.url
+    
+    # 0. Массив параграфов уже разобран read_completion_request (любой из форматов)
+    paragraphs = data["paragraphs"]
 
-    # --- RAG SEARCH (по первому абзацу батча, чтобы найти шаблон документа) ---
-    search_query = paragraphs[0]["text"] if paragraphs else raw_prompt
-    clean_query = re.sub(r'[^\w\sа-яА-Яa-zA-Z0-9]', ' ', search_query).strip()
+    cascade_requested = bool(cascade_model) and cascade_model != model_name
 
-    style_map = {}
-    best_template_uuid = None
-    system_message = ""
-    
-    if len(clean_query) > 5:
-        style_data = rag_engine.search_style_reference(clean_query)
+    # =========================================================================
+    # THE HYBRID PIPELINE — целиком внутри генератора: поток отдаётся сразу,
+    # а результаты каждой стадии уходят клиенту, как только стадия закончилась
+    # =========================================================================
+    async def streaming_generator():
+        success_count = 0
+
+        # Немедленный Heartbeat, чтобы клиент (urllib) не отвалился по таймауту 30с
+        yield " \n"
+
+        # --- RAG SEARCH (по первому абзацу батча, чтобы найти шаблон документа) ---
+        # Признаки абзацев считаются один раз и общие для RAG-запроса и эвристик Шага A
+        features = compute_batch(paragraphs)
+        first = features.get(paragraphs[0].get("id")) if paragraphs else None
+        clean_query = first.clean if first is not None else make_clean_query(paragraphs[0]["text"] if paragraphs else raw_prompt)
+
+        async def _style_reference():
+            if len(clean_query) > 5:
+                return await async_rag.search_style_reference(clean_query)
+            return None
+
+        # RAG (в пуле потоков) и /api/show для бюджета контекста идут параллельно
+        stage = None
+        try:
+            async for tick in with_heartbeats(
+                once(asyncio.gather(_style_reference(), get_safe_context(model_name, ollama_url))),
+                settings.HEARTBEAT_INTERVAL,
+            ):
+                if tick is HEARTBEAT:
+                    yield " \n"
+                else:
+                    stage = tick
+        except Exception as e:
+            print(f"❌ RAG Stage Error: {e}")
+            yield f"{json.dumps({'error': str(e)}, ensure_ascii=False)}\n"
+            return
+        style_data, (safe_context_budget, is_degraded) = stage
+
+        style_map = {}
+        best_template_uuid = None
+        system_message = ""
         if style_data:
             best_template_uuid = style_data["source_id"]
             style_map = style_data.get("style_map", {})
             print(f"✅ RAG Template -> {best_template_uuid} (Styles: {len(style_map)})")
-            
+
             # Подготовка жесткого system-промпта
             available_styles = list(style_map.keys())
             styles_json = json.dumps(available_styles, ensure_ascii=False)
@@ -241,151 +459,456 @@ async def proxy_completions(request: Request):
                 "Example format: {\"1\": \"Normal\", \"2\": \"Heading 1\"}\n"
             )
 
-    response_headers = {}
-    if best_template_uuid:
-        response_headers["X-Best-Template-ID"] = urllib.parse.quote(best_template_uuid)
+        # Первая запись потока — то, что раньше ехало заголовками X-*: шаблон, деградация
+        # (контекст урезан по RAM или машина под давлением) и совет по следующему батчу
+        batch_plan = batch_planner.plan(model_name, node.tps_for(model_name), safe_context_budget)
+        # Breaker (узел, модель) открыт: Шаг C пропускается, абзацы — без LLM (services/circuit_breaker.py)
+        llm_unavailable = circuit_breakers.is_open(ollama_url, model_name)
+        meta = {
+            "template_id": best_template_uuid,
+            "degraded": bool(is_degraded or settings.memory_pressure),
+            "llm_unavailable": llm_unavailable,
+            "batch_plan": batch_plan,
+        }
+        if route_reason is not None:
+            meta.update(model=model_name, route_reason=route_reason)
+        yield f"{json.dumps({'meta': meta}, ensure_ascii=False)}\n"
 
-    safe_context_budget, is_degraded = await get_safe_context(model_name, ollama_url)
-    if is_degraded: response_headers["X-Degraded-Mode"] = "true"
+        final_merged_results: dict[int, str] = {}
 
-    # =========================================================================
-    # THE HYBRID PIPELINE
-    # =========================================================================
-    final_merged_results: dict[int, str] = {}
-    
-    # Шаг A: Эвристики
-    if paragraphs and style_map:
-        heuristic_hits = apply_heuristics(paragraphs, style_map)
-        final_merged_results.update(heuristic_hits)
-    
-    # Фильтруем оставшиеся для Шага B
-    remaining_for_vector = [p for p in paragraphs if p["id"] not in final_merged_results]
-    
-    # Шаг B: Vector Fast Track (Batch)
-    if remaining_for_vector and style_map:
-        texts_to_search = [p["text"] for p in remaining_for_vector]
-        # Дистанция 0.20 — очень высокая уверенность
-        vector_hits = rag_engine.search_batch_fast_track(texts_to_search, fast_track_distance=0.20)
-        
-        for batch_idx, style_name in vector_hits.items():
-            original_p = remaining_for_vector[batch_idx]
-            # Проверять наличие стиля в style_map для стабильности? (опционально)
-            final_merged_results[original_p["id"]] = style_name
-            
-    # Фильтруем оставшиеся для Шага C (LLM)
-    remaining_for_llm = [p for p in paragraphs if p["id"] not in final_merged_results]
-    
-    # =========================================================================
-    # THE MERGE & STREAM
-    # =========================================================================
-    async def streaming_generator():
-        success_count = 0
-        last_heartbeat = time.time()
-        
-        # Немедленный Heartbeat, чтобы клиент (urllib) не отвалился по таймауту 30с
-        yield " \n"
-        
-        # 1. Стримим готовые результаты из A (Heuristics) и B (Vector)
-        for pid, style in final_merged_results.items():
-            yield f"{json.dumps({'id': pid, 'style_name': style}, ensure_ascii=False)}\n"
-            success_count += 1
-            
-        # 2. Если все обработано — завершаем поток
+        # Шаг A: Эвристики — сразу клиенту
+        if paragraphs and style_map:
+            for pid, style in apply_heuristics(paragraphs, style_map, features).items():
+                final_merged_results[pid] = style
+                yield f"{json.dumps({'id': pid, 'style_name': style}, ensure_ascii=False)}\n"
+                success_count += 1
+
+        # Фильтруем оставшиеся для Шага B
+        remaining_for_vector = [p for p in paragraphs if p["id"] not in final_merged_results]
+
+        # Шаг B: Vector Fast Track (Batch)
+        provisional: dict[int, str] = {}
+        # Ближайший эталон для абзацев дальше 0.20: предварительный стиль (progressive),
+        # мера неоднозначности и стиль без LLM (дедлайн)
+        nearest: dict[int, tuple[str, float]] = {}
+        use_nearest = progressive or deadline_at is not None
+        if remaining_for_vector and style_map:
+            texts_to_search = [p["text"] for p in remaining_for_vector]
+            if use_nearest:
+                # Один запрос к Chroma: ближе 0.20 — окончательный ответ, ближе
+                # PROGRESSIVE_DISTANCE — предварительный стиль до ответа LLM
+                search = async_rag.search_batch_nearest(texts_to_search)
+            else:
+                # Дистанция 0.20 — очень высокая уверенность
+                search = async_rag.search_batch_fast_track(texts_to_search, fast_track_distance=0.20)
+            vector_hits = {}
+            try:
+                async for tick in with_heartbeats(once(search), settings.HEARTBEAT_INTERVAL):
+                    if tick is HEARTBEAT:
+                        yield " \n"
+                    else:
+                        vector_hits = tick
+            except Exception as e:
+                # Без Fast Track батч целиком уходит в LLM
+                print(f"⚠️ Vector Fast Track failed ({e}), falling back to LLM")
+
+            for batch_idx, hit in vector_hits.items():
+                pid = remaining_for_vector[batch_idx]["id"]
+                if use_nearest:
+                    style_name, dist = hit
+                    if dist > 0.20:
+                        nearest[pid] = hit
+                        if progressive and dist <= settings.PROGRESSIVE_DISTANCE:
+                            provisional[pid] = style_name
+                        continue
+                else:
+                    style_name = hit
+                final_merged_results[pid] = style_name
+                yield f"{json.dumps({'id': pid, 'style_name': style_name}, ensure_ascii=False)}\n"
+                success_count += 1
+
+        # Фильтруем оставшиеся для Шага C (LLM)
+        remaining_for_llm = [p for p in paragraphs if p["id"] not in final_merged_results]
+
+        # Каскад нужен только при шаблоне: маленькой модели даём выбор из его стилей.
+        # Под дедлайном каскада нет: две ступени LLM не укладываются в предсказуемый бюджет
+        cascading = cascade_requested and bool(style_map) and deadline_at is None
+
+        # Progressive: предварительные стили для всего, что ждёт LLM —
+        # документ оформлен целиком уже сейчас, LLM потом только правит.
+        # Остальным — основной стиль текста шаблона (тот же "Normal", что и catch-all)
+        if progressive and remaining_for_llm:
+            _progressive_stats["batches"] += 1
+            for p in remaining_for_llm:
+                provisional.setdefault(p["id"], "Normal")
+                yield f"{json.dumps({'id': p['id'], 'style_name': provisional[p['id']], 'provisional': True}, ensure_ascii=False)}\n"
+                _progressive_stats["provisional"] += 1
+                success_count += 1
+
+        # Если все обработано — завершаем поток
         if not remaining_for_llm:
             print(f"⚡ Batch completely resolved by FastTrack (A+B)! Yielded {success_count} items.")
+            if deadline_at is not None:
+                deadline_stats.record_finish(deadline_at)
+            yield "\n"
+            return
+
+        async def _fallback_lines(items: list[dict], reason: str | None = None):
+            """
+            Абзацы без LLM (breaker открыт, Ollama упала, не успеваем к дедлайну):
+            Fast Track с расслабленным порогом BREAKER_FALLBACK_DISTANCE, иначе основной стиль шаблона.
+            reason=None — "fallback": "vector" | "default", иначе — reason.
+            Progressive: предварительные стили уже у клиента — они и остаются.
+            """
+            if progressive:
+                return
+            # Ближайшие эталоны ещё не искали (Шаг B без use_nearest) — один запрос к Chroma
+            if style_map and not use_nearest:
+                try:
+                    async for tick in with_heartbeats(
+                        once(async_rag.search_batch_nearest([p["text"] for p in items])),
+                        settings.HEARTBEAT_INTERVAL,
+                    ):
+                        if tick is HEARTBEAT:
+                            yield " \n"
+                        else:
+                            nearest.update({items[idx]["id"]: hit for idx, hit in tick.items()})
+                except Exception as e:
+                    print(f"⚠️ Degraded Fast Track failed ({e}), default style only")
+            for p in items:
+                style_name, dist = nearest.get(p["id"], (None, None))
+                if style_name and dist <= settings.BREAKER_FALLBACK_DISTANCE:
+                    item = {"id": p["id"], "style_name": style_name, "fallback": reason or "vector"}
+                else:
+                    item = {"id": p["id"], "style_name": "Normal", "fallback": reason or "default"}
+                yield f"{json.dumps(item, ensure_ascii=False)}\n"
+
+        if llm_unavailable:
+            print(f"🔌 Circuit open for {model_name} @ {ollama_url}: {len(remaining_for_llm)} paragraphs without LLM")
+            circuit_breakers.record_degraded(len(remaining_for_llm))
+            async for line in _fallback_lines(remaining_for_llm):
+                if line.strip():
+                    success_count += 1
+                yield line
+            if deadline_at is not None:
+                deadline_stats.record_finish(deadline_at)
             yield "\n"
             return
+
+        pending = remaining_for_llm
+        deferred: list[dict] = []
+
+        # Дедлайн: в LLM — самые неоднозначные абзацы, сколько модель успеет; остальные — сразу без LLM
+        if deadline_at is not None:
+            seconds_left = deadline_at - time.monotonic() - settings.DEADLINE_RESERVE_MS / 1000
+            overhead = call_overhead_seconds(
+                model_name, len(system_message), model_name in node.residency.resident
+            )
+            pending, deferred = split_for_deadline(
+                model_name, by_ambiguity(remaining_for_llm, nearest), node.tps_for(model_name), seconds_left, overhead
+            )
+            deadline_stats.record_plan(len(pending), len(deferred))
+            print(f"⏱️ Deadline: {seconds_left * 1000:.0f} ms left → LLM {len(pending)}, without LLM {len(deferred)}")
+            plan_meta = {"deadline_ms": data.get("deadline_ms"), "llm": len(pending), "deferred": len(deferred)}
+            yield f"{json.dumps({'meta': {'deadline_plan': plan_meta}}, ensure_ascii=False)}\n"
+            async for line in _fallback_lines(deferred, "deadline"):
+                if line.strip():
+                    success_count += 1
+                yield line
+            # Порядок абзацев для LLM — как в документе: так ей проще с контекстом
+            pending_ids = {p["id"] for p in pending}
+            pending = [p for p in remaining_for_llm if p["id"] in pending_ids]
+            if not pending:
+                deadline_stats.record_finish(deadline_at)
+                yield "\n"
+                return
             
         # 3. Шаг C: Идем в LLM только с самыми сложными параграфами
-        print(f"🤖 Calling LLM for {len(remaining_for_llm)} objects...", flush=True)
-        
-        # Формируем промпт из параграфов формата [ID] Text
-        llm_prompt = "\n".join([f"[{p['id']}] {p['text']}" for p in remaining_for_llm])
-        
-        chat_payload = {
-            'model': model_name,
-            'messages': [
-                {'role': 'system', 'content': system_message},
-                {'role': 'user', 'content': llm_prompt}
-            ],
-            'format': {
-                "type": "object",
-                "additionalProperties": {"type": "string"}
-            },
-            'stream': True,
-            'options': {
-                'num_ctx': safe_context_budget, 
-                'temperature': 0.1
+        print(f"🤖 Calling LLM for {len(pending)} objects...", flush=True)
+        hedge_policy.record_request()
+
+        async def _llm_call(target_model: str, items: list[dict], samples: int = 1,
+                            temperature: float = 0.1, response_format: dict | None = None):
+            """
+            Один заход в LLM: резидентность → num_ctx → hedged_chat (samples параллельных выборок).
+            Единственный yield — список текстов ответа; heartbeat'ы добавляет with_heartbeats снаружи.
+            """
+            # Формируем промпт из параграфов формата [ID] Text
+            full_lines = [f"[{p['id']}] {p['text']}" for p in items]
+            system_prompt = system_message
+            truncated = 0
+            if compact:
+                # Голова абзаца + признаки; лимит головы — свой у каждой модели (в каскаде их две)
+                head_chars = head_chars_for(target_model)
+                lines = [prompt_line(p["id"], features[p["id"]], head_chars, document_size) for p in items]
+                truncated = sum(1 for p in items if 0 < head_chars < features[p["id"]].length)
+                system_prompt = system_message + COMPACTION_HINT
+            else:
+                lines = full_lines
+            llm_prompt = "\n".join(lines)
+            compaction_stats.record(compact, len(items), sum(map(len, full_lines)), sum(map(len, lines)), truncated)
+
+            chat_payload = {
+                'model': target_model,
+                'messages': [
+                    {'role': 'system', 'content': system_prompt},
+                    {'role': 'user', 'content': llm_prompt}
+                ],
+                'format': response_format or {
+                    "type": "object",
+                    "additionalProperties": {"type": "string"}
+                },
+                'stream': True,
+                'keep_alive': node.residency.keep_alive_for(target_model),
+                'options': {
+                    'num_ctx': safe_context_budget,
+                    'temperature': temperature
+                }
             }
-        }
-        
-        clean_url = ollama_url.rstrip('/')
-        target_endpoint = f"{clean_url}/api/chat"
+            # Reasoning-моделям — без «размышлений», и потолок ответа по числу id
+            try:
+                show = await ollama_meta.show(ollama_url, target_model)
+            except Exception:
+                show = {}
+            think, num_predict = chat_limits(show, len(items))
+            if think is not None:
+                chat_payload['think'] = think
+            if num_predict is not None:
+                chat_payload['options']['num_predict'] = num_predict
+
+            # Грубая оценка нагрузки для least_tokens: вход ~3 символа/токен + ~16 токенов ответа на ID
+            estimated_tokens = len(system_prompt + llm_prompt) // 3 + 16 * len(items)
+
+            # hedged_chat при «залипшем» первом токене дублирует запрос на другой узел/слот
+            # Таймаут — по профилю этой модели (prefill промпта + ответ), но не больше LLM_TIMEOUT
+            llm_timeout = min(settings.LLM_TIMEOUT, model_profiles.estimate_timeout(target_model, len(system_prompt + llm_prompt)))
+
+            @asynccontextmanager
+            async def _on_node(call_node):
+                """
+                Резидентность → num_ctx → breaker для вызова на узле call_node; отдаёт payload этого узла.
+                Тот же путь у основного запроса и у хеджа на другом узле (см. services/hedging.py).
+                """
+                # Резидентность: ждём в очереди, если загрузка модели вытеснит ту,
+                # что сейчас отвечает другим запросам (heartbeat идёт и во время ожидания)
+                await call_node.residency.acquire(target_model)
+                try:
+                    payload = {
+                        **chat_payload,
+                        'keep_alive': call_node.residency.keep_alive_for(target_model),
+                        'options': dict(chat_payload['options']),
+                    }
+                    budget = safe_context_budget
+                    if call_node is not node:
+                        budget, _ = await get_safe_context(target_model, call_node.url)
+                        payload['options']['num_ctx'] = budget
+                    # num_ctx по размеру запроса (ступенями), а не весь бюджет: KV-cache меньше,
+                    # а если модель уже загружена с подходящим контекстом — берём его, без перезагрузки
+                    if settings.NUM_CTX_SIZING:
+                        # Точные токены по абзацам: один /api/tokenize на батч, повторы — из кэша
+                        line_tokens = await token_counter.count_many(target_model, llm_prompt.split("\n"), call_node.url)
+                        needed_tokens = estimate_request_tokens(system_prompt, sum(line_tokens), len(items))
+                        num_ctx = context_sizer.choose(
+                            needed_tokens, budget, call_node.residency.loaded_ctx.get(target_model)
+                        )
+                        payload['options']['num_ctx'] = num_ctx
+                        print(f"📐 num_ctx={num_ctx} (нужно ~{needed_tokens}, потолок {budget})")
+
+                    # Ошибки и медленные ответы копятся в breaker'е (узел, модель)
+                    async with circuit_breakers.guard(call_node.url, target_model):
+                        yield payload
+                finally:
+                    await call_node.residency.release(target_model)
+
+            async def _collect(payload: dict) -> str:
+                buffer_text = ""
+                stopped = False
+                # Все id получили стиль — закрываем запрос, хвост генерации не ждём (кроме проб)
+                tracker = AnswerTracker(p["id"] for p in items)
+                may_stop = early_stop_stats.start(target_model, think is False)
+                chunks = hedged_chat(target_model, payload, node, estimated_tokens, timeout=llm_timeout, open_node=_on_node)
+                async with aclosing(chunks):
+                    async for chunk_data in chunks:
+                        if await client_gone(): break
+                        buffer_text += chunk_data.get("message", {}).get("content", "")
+                        answered = tracker.feed(buffer_text)
+                        if chunk_data.get("done"):
+                            compaction_stats.record_prompt_tokens(compact, chunk_data.get("prompt_eval_count", 0))
+                            early_stop_stats.record_done(target_model, tracker, chunk_data)
+                        elif answered and may_stop:
+                            early_stop_stats.record_stop(target_model)
+                            stopped = True
+                            break
+                if stopped:
+                    # Финального чанка с prompt_eval_count не было: промпт считаем сами (строки уже
+                    # в кэше token_counter после подбора num_ctx). Скорость генерации пишет hedged_chat
+                    prompt_tokens = await token_counter.count_many(
+                        target_model, [system_prompt, *llm_prompt.split("\n")], ollama_url
+                    )
+                    compaction_stats.record_prompt_tokens(compact, sum(prompt_tokens))
+                return buffer_text
+
+            async with _on_node(node) as payload:
+                llm_started_at = time.perf_counter()
+                buffers = await asyncio.gather(*(_collect(payload) for _ in range(samples)))
+            batch_planner.observe(target_model, len(items), time.perf_counter() - llm_started_at)
+            yield list(buffers)
+
+        llm_handled_ids = set()
+
+        def _result_line(pid: int, llm_style_name: str, tier: str | None = None) -> str | None:
+            """NDJSON-строка ответа LLM (None — клиенту слать нечего)."""
+            if progressive:
+                if pid not in provisional:
+                    return None
+                llm_handled_ids.add(pid)
+                # Совпало с предварительным — клиенту ничего не шлём
+                if llm_style_name == provisional[pid]:
+                    _progressive_stats["confirmed"] += 1
+                    return None
+
+            # --- ОБЪЕДИНЕНИЕ С ДАННЫМИ RAG (DNA стиля) ---
+            # Берем параметры стиля из RAG-карты (шрифт, размер, жирность)
+            rag_style_info = style_map.get(llm_style_name, {})
+
+            # Собираем финальный объект для клиента
+            enriched_item = {
+                "id": pid,
+                "style_name": llm_style_name,
+                "font_family": rag_style_info.get("font_family"),
+                "font_size": rag_style_info.get("font_size"),
+                "bold": rag_style_info.get("bold", False),
+                "align": rag_style_info.get("align", "left")
+            }
+            if tier:
+                # Каскад: ответила маленькая модель ("small") или большая после эскалации
+                enriched_item["cascade"] = tier
+            if progressive:
+                enriched_item["revision"] = True
+                _progressive_stats["revised"] += 1
+            llm_handled_ids.add(pid)
+            return f"{json.dumps(enriched_item, ensure_ascii=False)}\n"
+
+        # 3a. Каскад: маленькая модель отвечает за то, в чём уверена, остальное — дальше
+        if cascading:
+            small_started_at = time.perf_counter()
+            small_buffers = None
+            try:
+                async for tick in with_heartbeats(
+                    _llm_call(cascade_model, pending, samples=settings.CASCADE_SAMPLES,
+                              temperature=settings.CASCADE_TEMPERATURE, response_format=choice_schema(style_map)),
+                    settings.HEARTBEAT_INTERVAL,
+                ):
+                    if tick is HEARTBEAT:
+                        yield " \n"
+                    else:
+                        small_buffers = tick
+            except Exception as e:
+                # Маленькая модель недоступна — весь батч уходит к большой
+                print(f"⚠️ Cascade: {cascade_model} failed ({e}), escalating all")
+
+            votes = vote([_parse_llm_styles(b) for b in small_buffers or []], [p["id"] for p in pending], set(style_map))
+            confident, escalate = split(votes, settings.CASCADE_MIN_CONFIDENCE)
+            for pid, style in confident.items():
+                line = _result_line(pid, style, "small")
+                if line:
+                    yield line
+                    success_count += 1
+            escalate_ids = set(escalate)
+            pending = [p for p in pending if p["id"] in escalate_ids]
+            small_sec = time.perf_counter() - small_started_at
+            print(f"🪜 Cascade {cascade_model} → {model_name}: escalated {len(pending)}/{len(remaining_for_llm)}")
+
+        large_started_at = time.perf_counter()
         buffer_text = ""
-        
-        async with httpx.AsyncClient() as client:
+        deadline_hit = False
+        if pending:
+            # Heartbeat идёт отдельной задачей рядом с upstream: во время prefill
+            # Ollama молчит десятки секунд, а клиенту нужен хоть какой-то байт.
+            # Под дедлайном тик приходится и на сам дедлайн: дальше ответ LLM не ждём
+            llm_deadline = None
+            if deadline_at is not None:
+                llm_deadline = deadline_at - settings.DEADLINE_RESERVE_MS / 1000
             try:
-                async with client.stream("POST", target_endpoint, json=chat_payload, timeout=600.0) as resp:
-                    resp.raise_for_status()
-                    
-                    async for chunk in resp.aiter_lines():
-                        if await request.is_disconnected(): break
-                        if not chunk: continue
-                        
-                        chunk_data = json.loads(chunk)
-                        chunk_text = chunk_data.get("message", {}).get("content", "")
-                        if chunk_text:
-                            buffer_text += chunk_text
-                            
-                        # Heartbeat
-                        now = time.time()
-                        if now - last_heartbeat > 5.0:
-                            yield " \n"
-                            last_heartbeat = now
-                            
+                async for tick in with_heartbeats(
+                    _llm_call(model_name, pending), settings.HEARTBEAT_INTERVAL, deadline=llm_deadline
+                ):
+                    if tick is HEARTBEAT:
+                        if llm_deadline is not None and time.monotonic() >= llm_deadline:
+                            deadline_hit = True
+                            break
+                        yield " \n"
+                    else:
+                        buffer_text = tick[0]
             except Exception as e:
-                print(f"❌ LLM Stream Error: {e}")
-                yield f"{{\"error\": \"{str(e)}\"}}\n"
+                if isinstance(e, ModelResidencyError):
+                    print(f"⛔ {e}")
+                elif isinstance(e, CircuitOpenError):
+                    print(f"🔌 {e}")
+                else:
+                    print(f"❌ LLM Stream Error: {e}")
+                if cascading:
+                    cascade_stats.record(len(remaining_for_llm), len(pending), small_sec, small_failed=small_buffers is None)
+                if progressive:
+                    # Предварительные стили уже у клиента — это не фатальная ошибка
+                    _progressive_stats["refinement_errors"] += 1
+                    yield f"{json.dumps({'refinement_error': str(e)}, ensure_ascii=False)}\n"
+                    yield "\n"
+                    return
+                if settings.CIRCUIT_BREAKER and not isinstance(e, ModelResidencyError):
+                    # Документ не бросаем: оставшиеся абзацы — без LLM, с пометкой в потоке
+                    circuit_breakers.record_degraded(len(pending))
+                    yield f"{json.dumps({'meta': {'llm_unavailable': True}}, ensure_ascii=False)}\n"
+                    async for line in _fallback_lines(pending):
+                        if line.strip():
+                            success_count += 1
+                        yield line
+                    if deadline_at is not None:
+                        deadline_stats.record_finish(deadline_at)
+                    yield "\n"
+                    return
+                yield f"{json.dumps({'error': str(e)}, ensure_ascii=False)}\n"
                 return
 
+        if deadline_hit:
+            # LLM не уложилась в дедлайн: её абзацы — без LLM, как отложенные планом
+            deadline_stats.llm_overruns += 1
+            print(f"⏱️ Deadline reached, LLM abandoned: {len(pending)} paragraphs without LLM")
+            async for line in _fallback_lines(pending, "deadline"):
+                if line.strip():
+                    success_count += 1
+                yield line
+            deadline_stats.record_finish(deadline_at)
+            yield "\n"
+            return
+
+        if cascading:
+            cascade_stats.record(
+                len(remaining_for_llm), len(pending), small_sec,
+                time.perf_counter() - large_started_at if pending else 0.0,
+                small_failed=small_buffers is None,
+            )
+
         # После завершения стрима Ollama, чиним и парсим накопленный буфер
-        llm_handled_ids = set()
-        if buffer_text.strip():
-            try:
-                # json_repair вылечит обрывы (незакрытые скобки/кавычки)
-                parsed_dict = json_repair.loads(buffer_text)
-                
-                if isinstance(parsed_dict, dict):
-                    print(f"✅ LLM buffer repaired & parsed. Items: {len(parsed_dict)}", flush=True)
-                    for k, llm_style_name in parsed_dict.items():
-                        if not str(k).isdigit(): continue
-                        pid = int(k)
-                        
-                        # --- ОБЪЕДИНЕНИЕ С ДАННЫМИ RAG (DNA стиля) ---
-                        # Берем параметры стиля из RAG-карты (шрифт, размер, жирность)
-                        rag_style_info = style_map.get(llm_style_name, {})
-                        
-                        # Собираем финальный объект для клиента
-                        enriched_item = {
-                            "id": pid,
-                            "style_name": llm_style_name,
-                            "font_family": rag_style_info.get("font_family"),
-                            "font_size": rag_style_info.get("font_size"),
-                            "bold": rag_style_info.get("bold", False),
-                            "align": rag_style_info.get("align", "left")
-                        }
-                        
-                        yield f"{json.dumps(enriched_item, ensure_ascii=False)}\n"
-                        llm_handled_ids.add(pid)
-                        success_count += 1
-                else:
-                    print(f"⚠️ LLM returned non-dict JSON: {type(parsed_dict)}")
-            except Exception as e:
-                print(f"❌ JSON Repair failed for buffer: {e}")
+        pending_ids = {p["id"] for p in pending}
+        for pid, llm_style_name in _parse_llm_styles(buffer_text).items():
+            # В каскаде большая модель не переписывает уверенные ответы маленькой
+            if cascading and pid not in pending_ids:
+                continue
+            line = _result_line(pid, llm_style_name, "escalated" if cascading else None)
+            if line:
+                yield line
+                success_count += 1
                 
         # 4. Fallback (The Catch-All). Если LLM забыла вернуть стили для части ID,
         #    возвращаем для них "Normal", чтобы LibreOffice не "потерял" эти параграфы.
-        missing_ids = [p["id"] for p in remaining_for_llm if p["id"] not in llm_handled_ids]
+        deferred_ids = {p["id"] for p in deferred}
+        missing_ids = [p["id"] for p in remaining_for_llm if p["id"] not in llm_handled_ids and p["id"] not in deferred_ids]
+        if progressive:
+            # Потерянные LLM абзацы уже оформлены предварительным стилем — он и остаётся
+            if missing_ids:
+                print(f"⚠️ LLM lost {len(missing_ids)} IDs, provisional styles kept.")
+            missing_ids = []
         if missing_ids:
             print(f"⚠️ LLM lost {len(missing_ids)} IDs! Applying 'Normal' fallback.")
             for pid in missing_ids:
@@ -393,12 +916,59 @@ async def proxy_completions(request: Request):
                 success_count += 1
                 
         print(f"🏁 Hybrid Stream Finished. Total pushed: {success_count}.")
+        if deadline_at is not None:
+            deadline_stats.record_finish(deadline_at)
         yield "\n"
 
-    response_headers["Content-Type"] = "application/x-ndjson"
+    # Давление на память известно до RAG — его по-прежнему видно и заголовком
+    response_headers = {"Content-Type": "application/x-ndjson"}
+    if settings.memory_pressure:
+        response_headers["X-Degraded-Mode"] = "true"
     return StreamingResponse(streaming_generator(), headers=response_headers)
 
 
+@router.post("/api/audit")
+async def audit_styles(request: Request):
+    """
+    Аудит стилей без LLM: {"paragraphs": [{"id": 1, "text": "...", "style_name": "Normal"}, ...]}.
+    Только Шаг A (эвристики) и ближайшие эталоны RAG — один запрос к Chroma на весь документ;
+    в ответе — абзацы, чей текущий стиль расходится с ожидаемым, с confidence.
+    "min_confidence" (по умолчанию AUDIT_MIN_CONFIDENCE) отсекает неуверенные расхождения.
+    """
+    started = time.perf_counter()
+    try:
+        data = await request.json()
+        paragraphs = [
+            {"id": int(p["id"]), "text": str(p.get("text", "")), "style_name": str(p.get("style_name") or "")}
+            for p in data["paragraphs"]
+        ]
+        min_confidence = float(data.get("min_confidence", settings.AUDIT_MIN_CONFIDENCE))
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        return JSONResponse({"error": f"bad audit request: {e}"}, status_code=400)
+
+    # Шаблон — по первому содержательному абзацу, как в /v1/completions
+    features = compute_batch(paragraphs)
+    query = next((f.clean for f in features.values() if len(f.clean) > 5), "")
+    style_data = await async_rag.search_style_reference(query) if query else None
+    style_map = style_data.get("style_map", {}) if style_data else {}
+
+    heuristics = apply_heuristics(paragraphs, style_map, features) if style_map else {}
+    rest = [p for p in paragraphs if p["id"] not in heuristics and p["text"].strip()]
+    hits = await async_rag.search_batch_nearest([p["text"] for p in rest]) if rest else {}
+    nearest = {rest[batch_idx]["id"]: hit for batch_idx, hit in hits.items()}
+
+    expected = expected_styles(heuristics, nearest)
+    deviations = find_deviations(paragraphs, expected, min_confidence)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    audit_stats.record(len(paragraphs), len(deviations), len(paragraphs) - len(expected), elapsed_ms)
+    print(f"🔎 Audit: {len(paragraphs)} paragraphs, {len(deviations)} deviations, {elapsed_ms:.0f} ms")
+    return JSONResponse({
+        "template_id": style_data["source_id"] if style_data else None,
+        "checked": len(expected),
+        "unchecked": len(paragraphs) - len(expected),
+        "deviations": deviations,
+        "elapsed_ms": round(elapsed_ms, 1),
+    })
 
 
 # ... (остальные методы ingest/retrieve те же) ...
@@ -430,18 +1000,41 @@ async def ingest_document(file: UploadFile = File(...)):
         shutil.copyfileobj(file.file, buffer)
     try:
         result_uuid = await asyncio.to_thread(_do_ingest, file_path, file_ext, unique_filename)
+        # Шаблоны изменились — повтор старых ответов single-flight больше не годится
+        single_flight.invalidate()
         return JSONResponse({"status": "indexed", "uuid": result_uuid})
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
 @router.post("/api/retrieve_context")
-def retrieve_context(request: ContextRequest):
+async def retrieve_context(request: ContextRequest):
     try:
-        data = rag_engine.search_style_reference(request.text)
+        data = await async_rag.search_style_reference(request.text)
         if data: return {"context": data["full_context"], "source_id": data["source_id"]}
         return {"context": "No reference found.", "source_id": None}
     except Exception as e: return {"context": f"Error: {e}", "source_id": None}
 
+@router.post("/api/retrieve_context_batch")
+async def retrieve_context_batch(request: ContextBatchRequest):
+    """
+    /api/retrieve_context для многих запросов: {"texts": [...]} → {"results": [{"context", "source_id"}, ...]}
+    в порядке texts. Один вызов эмбеддера и один запрос к Chroma на кусок из RETRIEVE_BATCH_CHUNK текстов;
+    куски идут по очереди через общий пул RAG — поиск конвейера /v1/completions не ждёт весь батч.
+    """
+    results = []
+    chunk = max(1, settings.RETRIEVE_BATCH_CHUNK)
+    for start in range(0, len(request.texts), chunk):
+        texts = request.texts[start:start + chunk]
+        try:
+            references = await async_rag.search_style_reference_batch(texts)
+        except Exception as e:
+            results += [{"context": f"Error: {e}", "source_id": None} for _ in texts]
+            continue
+        for data in references:
+            if data: results.append({"context": data["full_context"], "source_id": data["source_id"]})
+            else: results.append({"context": "No reference found.", "source_id": None})
+    return {"results": results}
+
 @router.post("/api/extract_ground_truth")
 async def extract_ground_truth_api(file: UploadFile = File(...)):
     """API для извлечения Ground Truth напрямую из бэкенда (без дублирования логики в тесте)."""
@@ -1,6 +1,29 @@
 import os
 import psutil
 
+def _parse_list(raw: str) -> list[str]:
+    """"a, b,c" -> ["a", "b", "c"]"""
+    return [item.strip() for item in raw.split(",") if item.strip()]
+
+
+def _parse_pairs(raw: str) -> dict[str, str]:
+    """"a=1,b=2" -> {"a": "1", "b": "2"}. Ключ может содержать ':' (gemma3:12b)."""
+    pairs = {}
+    for item in _parse_list(raw):
+        if "=" in item:
+            key, value = item.rsplit("=", 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+def _parse_keep_alive(raw: str):
+    """Ollama принимает keep_alive и числом секунд (-1 = навсегда), и строкой "30m"."""
+    try:
+        return int(raw)
+    except ValueError:
+        return raw
+
+
 class HardwareProfile:
     def __init__(self):
         vm = psutil.virtual_memory()
@@ -9,6 +32,155 @@ class HardwareProfile:
 
         # URL локальной Ollama — бэкенд всегда работает с ней напрямую
         self.OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        # Состояние, которое бэкенд накапливает сам (профили моделей, leaderboard роутера).
+        # По умолчанию backend/data — не зависит от каталога, из которого запущен uvicorn
+        self.DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+
+        # Пул узлов Ollama (см. services/ollama_pool.py):
+        # OLLAMA_BASE_URLS="http://gpu1:11434,http://gpu2:11434". Пусто — один OLLAMA_BASE_URL.
+        self.OLLAMA_BASE_URLS = _parse_list(os.getenv("OLLAMA_BASE_URLS", "")) or [self.OLLAMA_BASE_URL]
+        # "least_tokens" — меньше всего токенов в работе; "least_latency" — быстрее отвечает
+        self.OLLAMA_ROUTING = os.getenv("OLLAMA_ROUTING", "least_tokens")
+        self.OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15"))
+        # TTL кэша метаданных Ollama (см. services/ollama_meta.py), сек. Ещё столько же
+        # после истечения отдаётся устаревшее значение, пока оно обновляется в фоне
+        self.META_TTL_TAGS = float(os.getenv("META_TTL_TAGS", "30"))
+        self.META_TTL_SHOW = float(os.getenv("META_TTL_SHOW", "600"))
+        self.META_TTL_PS = float(os.getenv("META_TTL_PS", "2"))
+        # Сколько держим привязку сессии документа к узлу (KV-cache reuse), сек
+        self.SESSION_STICKY_TTL = float(os.getenv("SESSION_STICKY_TTL", "600"))
+
+        # К какой длительности батча подгоняется совет клиенту (см. services/batch_planner.py), сек
+        self.BATCH_TARGET_SECONDS = float(os.getenv("BATCH_TARGET_SECONDS", "20"))
+        # Потоки пула RAG (см. services/rag_async.py). Половина физических ядер:
+        # SentenceTransformer/torch внутри ещё и сам распараллеливает каждый вызов
+        self.RAG_WORKERS = int(os.getenv("RAG_WORKERS", str(max(1, self.physical_cores // 2))))
+        # /api/retrieve_context_batch: текстов на один вызов эмбеддера и один запрос к Chroma
+        self.RETRIEVE_BATCH_CHUNK = int(os.getenv("RETRIEVE_BATCH_CHUNK", "64"))
+
+        # Интервал heartbeat-строк в NDJSON-стриме (сек). Должен быть заметно меньше
+        # таймаута urlopen клиента (30 с), иначе долгий prefill на CPU рвёт батч.
+        self.HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "5.0"))
+        # Progressive refinement: сразу предварительные стили для всех абзацев, потом правки LLM.
+        # Клиент включает полем "progressive" в запросе; здесь — значение по умолчанию.
+        # PROGRESSIVE_DISTANCE — расслабленный порог Vector Fast Track для предварительного стиля
+        self.PROGRESSIVE_DEFAULT = os.getenv("PROGRESSIVE_DEFAULT", "false").lower() == "true"
+        self.PROGRESSIVE_DISTANCE = float(os.getenv("PROGRESSIVE_DISTANCE", "0.5"))
+        # Single-flight для /v1/completions (см. services/single_flight.py): одинаковые запросы
+        # в полёте делят один конвейер, завершённые ещё SINGLE_FLIGHT_GRACE_SEC отдаются повтором.
+        # SINGLE_FLIGHT_SHARED=true — общий файловый спул для uvicorn --workers N
+        self.SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+        self.SINGLE_FLIGHT_GRACE_SEC = float(os.getenv("SINGLE_FLIGHT_GRACE_SEC", "10"))
+        self.SINGLE_FLIGHT_SHARED = os.getenv("SINGLE_FLIGHT_SHARED", "false").lower() == "true"
+        # Каскад моделей в Шаге C (см. services/cascade.py): маленькая модель размечает первой,
+        # к модели из запроса уходят только неуверенные абзацы. Пусто — каскад выключен
+        self.CASCADE_SMALL_MODEL = os.getenv("CASCADE_SMALL_MODEL", "")
+        self.CASCADE_SAMPLES = int(os.getenv("CASCADE_SAMPLES", "3"))
+        self.CASCADE_TEMPERATURE = float(os.getenv("CASCADE_TEMPERATURE", "0.5"))
+        self.CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", "1.0"))
+
+        # Сжатие промпта Шага C (см. services/prompt_compaction.py): голова абзаца + признаки.
+        # Клиент включает полем "prompt_compaction"; лимит головы — PROMPT_COMPACT_CHARS символов,
+        # по моделям — PROMPT_COMPACT_CHARS_MODELS="gemma3:12b=300,qwen3:0.6b=120" (0 — без обрезки)
+        self.PROMPT_COMPACTION = os.getenv("PROMPT_COMPACTION", "false").lower() == "true"
+        self.PROMPT_COMPACT_CHARS = int(os.getenv("PROMPT_COMPACT_CHARS", "160"))
+        self.PROMPT_COMPACT_CHARS_MODELS = {
+            name: int(value)
+            for name, value in _parse_pairs(os.getenv("PROMPT_COMPACT_CHARS_MODELS", "")).items()
+        }
+
+        # Алиас модели "auto" (см. services/model_router.py): самая быстрая модель из leaderboard
+        # контеста с точностью (avg_overall, %) не ниже ROUTER_ACCURACY_FLOOR.
+        # ROUTER_FALLBACK_MODEL — если leaderboard пуст или ни одна его модель не доступна
+        self.ROUTER_ACCURACY_FLOOR = float(os.getenv("ROUTER_ACCURACY_FLOOR", "80"))
+        self.ROUTER_FALLBACK_MODEL = os.getenv("ROUTER_FALLBACK_MODEL", "")
+
+        # Ступени num_ctx для Шага C (см. services/context_sizing.py): запрос округляется вверх
+        # до ступени, чтобы Ollama не перезагружала модель на каждый новый размер контекста
+        # NUM_CTX_SIZING=false — по-старому, num_ctx = весь безопасный бюджет модели
+        self.NUM_CTX_SIZING = os.getenv("NUM_CTX_SIZING", "true").lower() == "true"
+        self.NUM_CTX_BUCKETS = sorted(int(b) for b in _parse_list(
+            os.getenv("NUM_CTX_BUCKETS", "2048,4096,8192,16384,32768,65536,131072")
+        ))
+        # Жёсткий таймаут одного вызова LLM (Шаг C), сек
+        self.LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "600"))
+        # Hedged requests (см. services/hedging.py): дубль запроса, если первый токен «залип»
+        self.HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+        self.HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+        self.HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "10"))
+        self.HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "2.0"))
+        self.HEDGE_MAX_FRACTION = float(os.getenv("HEDGE_MAX_FRACTION", "0.1"))
+        self.HEDGE_SAME_NODE = os.getenv("HEDGE_SAME_NODE", "true").lower() == "true"
+
+        # Circuit breaker Шага C по (узел, модель), см. services/circuit_breaker.py.
+        # Открывается, когда в окне BREAKER_WINDOW_SEC не меньше BREAKER_MIN_CALLS вызовов и доля
+        # ошибок >= BREAKER_ERROR_RATE или доля вызовов дольше BREAKER_SLOW_CALL_SEC >= BREAKER_SLOW_RATE.
+        # Открытый breaker: абзацы без LLM — Fast Track с порогом BREAKER_FALLBACK_DISTANCE или "Normal"
+        self.CIRCUIT_BREAKER = os.getenv("CIRCUIT_BREAKER", "true").lower() == "true"
+        self.BREAKER_WINDOW_SEC = float(os.getenv("BREAKER_WINDOW_SEC", "60"))
+        self.BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "3"))
+        self.BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+        self.BREAKER_SLOW_CALL_SEC = float(os.getenv("BREAKER_SLOW_CALL_SEC", "120"))
+        self.BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))
+        self.BREAKER_OPEN_SEC = float(os.getenv("BREAKER_OPEN_SEC", "30"))
+        self.BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+        self.BREAKER_FALLBACK_DISTANCE = float(os.getenv("BREAKER_FALLBACK_DISTANCE", "0.5"))
+
+        # Дедлайн клиента (X-Deadline-Ms, см. services/deadline.py): сколько миллисекунд бюджета
+        # оставлять на разбор ответа LLM и хвост потока
+        self.DEADLINE_RESERVE_MS = float(os.getenv("DEADLINE_RESERVE_MS", "300"))
+
+        # Аудит стилей без LLM (/api/audit, см. services/style_audit.py): дальше AUDIT_MAX_DISTANCE
+        # от ближайшего эталона абзац не судим; расхождения с confidence ниже AUDIT_MIN_CONFIDENCE не отдаём
+        self.AUDIT_MAX_DISTANCE = float(os.getenv("AUDIT_MAX_DISTANCE", "0.5"))
+        self.AUDIT_MIN_CONFIDENCE = float(os.getenv("AUDIT_MIN_CONFIDENCE", "0.5"))
+
+        # Ранняя остановка Шага C (см. services/early_stop.py): запрос к Ollama закрывается,
+        # как только у всех id есть стиль; каждый EARLY_STOP_PROBE_EVERY-й вызов модели — проба до конца,
+        # модели с хвостом короче EARLY_STOP_MIN_TAIL токенов не обрываются.
+        # LLM_THINK=false шлёт "think": false thinking-моделям; потолок ответа —
+        # NUM_PREDICT_BASE + NUM_PREDICT_PER_ID токенов на id (NUM_PREDICT_PER_ID=0 — без потолка)
+        self.EARLY_STOP = os.getenv("EARLY_STOP", "true").lower() == "true"
+        self.EARLY_STOP_PROBE_EVERY = int(os.getenv("EARLY_STOP_PROBE_EVERY", "20"))
+        self.EARLY_STOP_MIN_TAIL = int(os.getenv("EARLY_STOP_MIN_TAIL", "8"))
+        self.LLM_THINK = os.getenv("LLM_THINK", "false").lower() == "true"
+        self.NUM_PREDICT_BASE = int(os.getenv("NUM_PREDICT_BASE", "64"))
+        self.NUM_PREDICT_PER_ID = int(os.getenv("NUM_PREDICT_PER_ID", "32"))
+
+        # Монитор лагов event loop (см. services/loop_monitor.py), по умолчанию выключен.
+        # Стек блокирующего кода снимается, если loop не отвечает дольше LOOP_LAG_THRESHOLD, сек
+        self.LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "false").lower() == "true"
+        self.LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))
+        self.LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.2"))
+
+        # Резидентность моделей в Ollama (см. services/model_residency.py)
+        # OLLAMA_WARM_MODELS="gemma3:12b,qwen3:4b" — прогреваются при старте
+        # OLLAMA_KEEP_ALIVE_MODELS="gemma3:12b=-1,qwen3:4b=10m" — keep_alive по моделям
+        self.WARM_MODELS = _parse_list(os.getenv("OLLAMA_WARM_MODELS", ""))
+        self.KEEP_ALIVE = _parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE", "30m"))
+        self.KEEP_ALIVE_MODELS = {
+            name: _parse_keep_alive(value)
+            for name, value in _parse_pairs(os.getenv("OLLAMA_KEEP_ALIVE_MODELS", "")).items()
+        }
+        # Какую долю RAM (available_ram_gb + уже загруженные модели) можно отдать под веса резидентных моделей
+        self.RESIDENCY_RAM_FRACTION = float(os.getenv("RESIDENCY_RAM_FRACTION", "0.8"))
+        # Сколько запрос ждёт в очереди, пока чужие модели освободятся (сек)
+        self.RESIDENCY_QUEUE_TIMEOUT = float(os.getenv("RESIDENCY_QUEUE_TIMEOUT", "120"))
+
+        # Мониторинг ресурсов (см. services/resource_monitor.py): раз в RESOURCE_MONITOR_INTERVAL сек
+        # перечитываем RAM/CPU. Под давлением (RAM < PRESSURE_RAM_GB или CPU >= PRESSURE_CPU_PERCENT
+        # PRESSURE_SAMPLES замеров подряд) переходим на «слабые» лимиты; обратно — только когда
+        # RAM поднялась выше PRESSURE_RAM_GB + PRESSURE_HYSTERESIS_GB на RECOVERY_SAMPLES замеров.
+        self.RESOURCE_MONITOR_INTERVAL = float(os.getenv("RESOURCE_MONITOR_INTERVAL", "5"))
+        self.PRESSURE_RAM_GB = float(os.getenv("PRESSURE_RAM_GB", "4"))
+        self.PRESSURE_HYSTERESIS_GB = float(os.getenv("PRESSURE_HYSTERESIS_GB", "1.5"))
+        self.PRESSURE_CPU_PERCENT = float(os.getenv("PRESSURE_CPU_PERCENT", "95"))
+        self.PRESSURE_SAMPLES = int(os.getenv("PRESSURE_SAMPLES", "3"))
+        self.RECOVERY_SAMPLES = int(os.getenv("RECOVERY_SAMPLES", "6"))
+        self.memory_pressure = False
+        # RAM, по которой считаются бюджеты контекста (_ram_cap). Меняется монитором
+        # с гистерезисом, а не на каждом замере, чтобы num_ctx не «дребезжал».
+        self.ctx_ram_gb = self.available_ram_gb
 
         # Начальная эвристика
         self.is_low_power = self.available_ram_gb < 8.0 or self.physical_cores < 6
@@ -16,20 +188,27 @@ class HardwareProfile:
         self._apply_settings()
 
     def update_from_benchmark(self, tokens_per_second: float):
+        """
+        Скорость по умолчанию для моделей без профиля. Режим LOW POWER отсюда не переключается:
+        замер одной модели ничего не говорит о других — медленная ли модель, решает её профиль
+        (model_profiles.is_low_power), а is_low_power процесса — только RAM и ядра.
+        """
         self.current_tps = tokens_per_second
         print(f"📊 BENCHMARK RESULT: {tokens_per_second:.2f} tokens/sec")
-        
-        if tokens_per_second < 15.0:
-            print("🐢 LLM is responding slowly. Switching to LOW POWER mode.")
-            self.is_low_power = True
+
+    def set_memory_pressure(self, active: bool):
+        """Включает/выключает режим давления на ресурсы (вызывает resource_monitor)."""
+        if active == self.memory_pressure:
+            return
+        self.memory_pressure = active
+        if active:
+            print(f"🥵 Resource pressure: {self.available_ram_gb:.1f} GB RAM free. Switching to LOW POWER limits.")
         else:
-            print("🚀 LLM is fast. Keeping/Switching to HIGH POWER mode.")
-            self.is_low_power = False
-            
+            print(f"😌 Resource pressure is over: {self.available_ram_gb:.1f} GB RAM free.")
         self._apply_settings()
 
     def _apply_settings(self):
-        if self.is_low_power:
+        if self.is_low_power or self.memory_pressure:
             self.OLLAMA_CTX = 4096
             self.RAG_CHUNK_LIMIT = 3
             self.MAX_INPUT_CHARS = 3500
@@ -38,10 +217,18 @@ class HardwareProfile:
             self.RAG_CHUNK_LIMIT = 10
             self.MAX_INPUT_CHARS = 12000
 
-    def estimate_timeout(self, input_char_len: int) -> float:
+    def estimate_timeout(
+        self,
+        input_char_len: int,
+        decode_tps: float | None = None,
+        prefill_tps: float | None = None,
+        load_sec: float = 0.0,
+    ) -> float:
         """
         Считает, сколько времени нужно модели, чтобы переварить текст.
         Эвристика: 1 токен ≈ 3-4 символа (для русского + код + json).
+        decode_tps / prefill_tps / load_sec — из профиля модели (model_profiles),
+        без них считаем по глобальному current_tps.
         """
         # Оценка количества входных токенов
         input_tokens = input_char_len / 3.0
@@ -51,13 +238,15 @@ class HardwareProfile:
         estimated_output_objects = max(1, input_char_len // 200)
         expected_output_tokens = min(8192, max(512, estimated_output_objects * 100))
 
-        total_workload = input_tokens + expected_output_tokens
-
         # Время = Объем / Скорость
         # Если TPS не измерен (0), берем 5.0 как safe-mode
-        speed = self.current_tps if self.current_tps > 0 else 5.0
+        speed = decode_tps or (self.current_tps if self.current_tps > 0 else 5.0)
 
-        estimated_seconds = total_workload / speed
+        if prefill_tps:
+            # Профиль модели знает prefill отдельно: промпт и ответ считаем по своим скоростям
+            estimated_seconds = input_tokens / prefill_tps + expected_output_tokens / speed + load_sec
+        else:
+            estimated_seconds = (input_tokens + expected_output_tokens) / speed + load_sec
 
         # Добавляем 30% буфера + 15 секунд на сеть/лаги
         final_timeout = (estimated_seconds * 1.3) + 15.0
@@ -7,8 +7,12 @@ try:
 except ImportError:
     from app.endpoints import router as api_router
 
-# Импорт калибровки
-from app.services.calibration import calibrate_ollama
+# Пул Ollama: health-пробы, калибровка скорости, прогрев моделей
+from app.services.ollama_pool import ollama_pool
+from app.services.model_profiles import model_profiles
+from app.services.resource_monitor import resource_monitor
+from app.services.loop_monitor import loop_monitor
+from app.config import settings
 
 app = FastAPI(title="LocalWriter Backend")
 
@@ -26,8 +30,26 @@ app.include_router(api_router)
 # --- STARTUP EVENT ---
 @app.on_event("startup")
 async def startup_event():
-    # Запускаем калибровку при старте
-    await calibrate_ollama()
+    # Следим за RAM/CPU: под давлением ужимаем num_ctx и RAG-лимиты
+    resource_monitor.start()
+    # Opt-in: лаги event loop и стеки блокирующего кода (для нагрузочных тестов)
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    # Проверяем узлы пула Ollama и дальше следим за ними в фоне
+    await ollama_pool.health_check()
+    ollama_pool.start_health_loop()
+    # Запускаем калибровку при старте на каждом узле (на первой модели из OLLAMA_WARM_MODELS, если заданы)
+    await ollama_pool.calibrate_all(model=settings.WARM_MODELS[0] if settings.WARM_MODELS else "")
+    # Прогреваем сконфигурированные модели с их keep_alive
+    for node in ollama_pool.nodes:
+        if node.healthy:
+            await node.residency.warm_up()
+
+# --- SHUTDOWN EVENT ---
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Профили моделей пишутся на диск не чаще раза в 10 сек — досохраняем хвост
+    await model_profiles.flush()
 
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8323, reload=True)
\ No newline at end of file
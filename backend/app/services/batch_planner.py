@@ -0,0 +1,91 @@
+#batch_planner.py
+"""
+Рекомендованный размер батча для клиента (extension/client.py).
+
+Правильный размер батча сильно разный для 2B-модели на ноутбуке и 14B на сервере,
+поэтому BATCH_SIZE больше не хардкодится на клиенте. Бэкенд советует:
+  - max_chars         — бюджет символов на батч
+  - max_paragraphs    — сколько абзацев в батче
+  - batch_timeout_sec — сколько клиенту ждать один батч целиком
+  - target_batch_sec  — к какой длительности батча клиенту стоит стремиться
+
+Оценка строится из:
+  - профиля модели (model_profiles: decode/prefill tokens/sec), а до первых замеров —
+    tokens/sec узла пула или HardwareProfile.current_tps
+  - безопасного контекста get_safe_context (символов не больше, чем влезет в num_ctx)
+  - наблюдаемой латентности Шага C (EWMA секунд на абзац по модели), когда она есть
+"""
+
+from app.config import settings
+from app.services import metrics
+from app.services.llm_checker import _default_user_cpt
+from app.services.model_profiles import model_profiles
+
+# Шаг C отвечает ~16 токенами на абзац: {"12": "Heading 1", ...}
+OUTPUT_TOKENS_PER_PARAGRAPH = 16
+# Prefill на CPU/GPU заметно быстрее генерации; грубый множитель, пока профиль модели пуст
+PREFILL_SPEEDUP = 4.0
+
+MIN_PARAGRAPHS = 3
+MAX_PARAGRAPHS = 60
+
+_EWMA_ALPHA = 0.3
+
+
+class BatchPlanner:
+    def __init__(self):
+        self.sec_per_paragraph: dict[str, float] = {}   # model -> EWMA секунд Шага C на абзац
+
+    def observe(self, model_name: str, paragraphs: int, seconds: float):
+        """Записывает длительность Шага C для батча из `paragraphs` абзацев."""
+        if paragraphs <= 0 or seconds <= 0:
+            return
+        value = seconds / paragraphs
+        old = self.sec_per_paragraph.get(model_name)
+        self.sec_per_paragraph[model_name] = value if old is None else old + _EWMA_ALPHA * (value - old)
+
+    def paragraph_seconds(self, model_name: str, chars: int, tps: float) -> float:
+        """Сколько Шаг C тратит на один абзац из chars символов: по наблюдениям, иначе по профилю модели."""
+        observed = self.sec_per_paragraph.get(model_name)
+        if observed:
+            return observed
+        tps = model_profiles.decode_tps(model_name, default=tps if tps > 0 else 5.0)
+        prefill_tps = model_profiles.prefill_tps(model_name) or tps * PREFILL_SPEEDUP
+        return OUTPUT_TOKENS_PER_PARAGRAPH / tps + chars / _default_user_cpt("ru") / prefill_tps
+
+    def plan(self, model_name: str, tps: float, user_budget_tokens: int) -> dict:
+        """Совет клиенту по размеру следующего батча."""
+        target = settings.BATCH_TARGET_SECONDS
+        tps = model_profiles.decode_tps(model_name, default=tps if tps > 0 else 5.0)
+        prefill_tps = model_profiles.prefill_tps(model_name) or tps * PREFILL_SPEEDUP
+        # Консервативно считаем текст русским: кириллица — самая «дорогая» по токенам
+        cpt = _default_user_cpt("ru")
+
+        # Символы: не больше, чем влезет в контекст, и не больше, чем prefill успеет за полбюджета
+        chars_by_ctx = int(user_budget_tokens * cpt)
+        chars_by_time = int(target * 0.5 * prefill_tps * cpt)
+        max_chars = max(500, min(chars_by_ctx, chars_by_time))
+
+        # Абзацы: по наблюдениям, если они есть, иначе — вторая половина бюджета на генерацию
+        observed = self.sec_per_paragraph.get(model_name)
+        if observed:
+            max_paragraphs = int(target / observed)
+        else:
+            max_paragraphs = int(target * 0.5 * tps / OUTPUT_TOKENS_PER_PARAGRAPH)
+        max_paragraphs = max(MIN_PARAGRAPHS, min(MAX_PARAGRAPHS, max_paragraphs))
+
+        return {
+            "model": model_name,
+            "max_chars": max_chars,
+            "max_paragraphs": max_paragraphs,
+            "batch_timeout_sec": round(model_profiles.estimate_timeout(model_name, max_chars), 1),
+            "target_batch_sec": target,
+            "observed_sec_per_paragraph": round(observed, 3) if observed else None,
+        }
+
+    def snapshot(self) -> dict:
+        return {m: round(v, 3) for m, v in self.sec_per_paragraph.items()}
+
+
+batch_planner = BatchPlanner()
+metrics.register("batch_planner", batch_planner.snapshot)
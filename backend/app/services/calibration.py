@@ -2,14 +2,14 @@ import os
 import time
 import httpx
 from app.config import settings
+from app.services.model_profiles import model_profiles
+from app.services.ollama_meta import ollama_meta
 
-async def calibrate_ollama(ollama_url: str | None = None, model: str = ""):
+async def measure_tps(ollama_url: str, model: str = "") -> tuple[str, float] | None:
     """
     Отправляет короткий запрос, чтобы прогреть модель и замерить скорость.
+    Возвращает (модель, tokens/sec) или None, если Ollama недоступна.
     """
-    if ollama_url is None:
-        ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
-
     print(f"⏳ Calibrating Inference Speed using {ollama_url}...")
     
     # 1. Если модель не задана, пытаемся узнать список тегов, берем первый попавшийся
@@ -19,14 +19,12 @@ async def calibrate_ollama(ollama_url: str | None = None, model: str = ""):
     # Пытаемся получить список моделей, если имя не передали
     if not model:
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(f"{ollama_url}/api/tags", timeout=2.0)
-                data = resp.json()
-                if data.get("models"):
-                    target_model = data["models"][0]["name"]
+            data = await ollama_meta.tags(ollama_url)
+            if data.get("models"):
+                target_model = data["models"][0]["name"]
         except:
             print("⚠️ Calibration skipped: Could not connect to Ollama.")
-            return
+            return None
 
     # 2. Тестовый промпт
     payload = {
@@ -46,6 +44,7 @@ async def calibrate_ollama(ollama_url: str | None = None, model: str = ""):
         
         if resp.status_code == 200:
             data = resp.json()
+            model_profiles.record(target_model, data)
             # Ollama возвращает точные метрики времени
             # eval_count - количество токенов ответа
             # eval_duration - время генерации в наносекундах
@@ -62,11 +61,25 @@ async def calibrate_ollama(ollama_url: str | None = None, model: str = ""):
                 # Примерно считаем, что ответ был токенов 10-15
                 tps = 10.0 / total_time 
 
-            # 3. ОБНОВЛЯЕМ НАСТРОЙКИ
-            settings.update_from_benchmark(tps)
+            return target_model, tps
             
         else:
             print(f"⚠️ Calibration failed: Status {resp.status_code}")
 
     except Exception as e:
-        print(f"⚠️ Calibration failed (Ollama might be down): {e}")
\ No newline at end of file
+        print(f"⚠️ Calibration failed (Ollama might be down): {e}")
+    return None
+
+
+async def calibrate_ollama(ollama_url: str | None = None, model: str = ""):
+    """
+    Замеряет скорость одной Ollama и обновляет глобальный профиль settings.
+    """
+    if ollama_url is None:
+        ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
+
+    measured = await measure_tps(ollama_url, model)
+    if measured:
+        # 3. ОБНОВЛЯЕМ НАСТРОЙКИ
+        settings.update_from_benchmark(measured[1])
+    return measured
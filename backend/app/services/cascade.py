@@ -0,0 +1,87 @@
+#cascade.py
+"""
+Каскад моделей для Шага C: маленькая быстрая модель размечает абзацы первой,
+большая (модель из запроса) получает только те, в которых маленькая не уверена.
+
+Уверенность — self-consistency при ограниченном выборе:
+  - CASCADE_SAMPLES параллельных выборок маленькой модели с temperature CASCADE_TEMPERATURE
+  - format — enum имён стилей шаблона: ответ вне шаблона невозможен грамматически
+  - confidence(id) = доля выборок, согласных с большинством; пропуск/чужой стиль = голос «против»
+  - id с confidence < CASCADE_MIN_CONFIDENCE эскалируются к большой модели
+
+Включается CASCADE_SMALL_MODEL (или полем "cascade_model" в запросе).
+Доля эскалаций и время ступеней — в /api/metrics ("cascade").
+"""
+
+from collections import Counter
+
+from app.services import metrics
+
+
+def choice_schema(styles) -> dict:
+    """JSON Schema для format Ollama: {"<id>": "<один из стилей шаблона>"}."""
+    return {
+        "type": "object",
+        "additionalProperties": {"type": "string", "enum": sorted(styles)},
+    }
+
+
+def vote(samples: list[dict[int, str]], ids: list[int], allowed: set[str]) -> dict[int, tuple[str | None, float]]:
+    """Голосование выборок: {id: (стиль большинства, доля согласных выборок)}."""
+    total = len(samples) or 1
+    votes: dict[int, tuple[str | None, float]] = {}
+    for pid in ids:
+        answers = [s.get(pid) for s in samples]
+        valid = [a for a in answers if a and (not allowed or a in allowed)]
+        if not valid:
+            votes[pid] = (None, 0.0)
+            continue
+        style, count = Counter(valid).most_common(1)[0]
+        votes[pid] = (style, count / total)
+    return votes
+
+
+def split(votes: dict[int, tuple[str | None, float]], min_confidence: float) -> tuple[dict[int, str], list[int]]:
+    """Уверенные ответы маленькой модели и id для эскалации (в исходном порядке)."""
+    confident: dict[int, str] = {}
+    escalate: list[int] = []
+    for pid, (style, confidence) in votes.items():
+        if style is not None and confidence >= min_confidence:
+            confident[pid] = style
+        else:
+            escalate.append(pid)
+    return confident, escalate
+
+
+class CascadeStats:
+    def __init__(self):
+        self.batches = 0
+        self.items = 0
+        self.escalated = 0
+        self.small_failures = 0
+        self.small_sec = 0.0
+        self.large_sec = 0.0
+
+    def record(self, items: int, escalated: int, small_sec: float, large_sec: float = 0.0, small_failed: bool = False):
+        self.batches += 1
+        self.items += items
+        self.escalated += escalated
+        self.small_sec += small_sec
+        self.large_sec += large_sec
+        if small_failed:
+            self.small_failures += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "escalated": self.escalated,
+            "escalated_pct": round(self.escalated / self.items * 100, 1) if self.items else 0.0,
+            "small_failures": self.small_failures,
+            "small_sec": round(self.small_sec, 1),
+            "large_sec": round(self.large_sec, 1),
+        }
+
+
+cascade_stats = CascadeStats()
+metrics.register("cascade", cascade_stats.snapshot)
@@ -0,0 +1,186 @@
+#circuit_breaker.py
+"""
+Circuit breaker вокруг Шага C: ключ — (узел Ollama, модель).
+
+Когда Ollama лежит или захлёбывается, каждый батч ждёт ошибку httpx и отдаёт
+клиенту "error" — расширение бросает весь документ. Здесь:
+  - closed:    вызовы идут как обычно, исходы копятся в окне BREAKER_WINDOW_SEC;
+  - open:      в окне не меньше BREAKER_MIN_CALLS вызовов, и доля ошибок >= BREAKER_ERROR_RATE
+               или доля медленных (дольше BREAKER_SLOW_CALL_SEC) >= BREAKER_SLOW_RATE —
+               BREAKER_OPEN_SEC секунд Шаг C не вызывается вовсе;
+  - half_open: после паузы до BREAKER_HALF_OPEN_PROBES настоящих запросов идут пробой;
+               успех закрывает breaker, ошибка — снова open.
+
+Пока breaker открыт, /v1/completions не ждёт LLM: оставшиеся абзацы получают стиль
+по Fast Track с расслабленным порогом (BREAKER_FALLBACK_DISTANCE) или основной стиль
+шаблона, а в потоке стоит {"meta": {"llm_unavailable": true}}.
+Состояние по ключам — в /api/metrics ("circuit_breaker").
+"""
+
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from app.config import settings
+from app.services import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Breaker (узел, модель) открыт: Шаг C не вызывается, батч уходит в деградацию."""
+
+
+class Breaker:
+    def __init__(self):
+        self.state = CLOSED
+        self.calls: deque = deque()   # (ts, ok, seconds)
+        self.opened_at = 0.0
+        self.probes = 0               # пробных вызовов в полёте (half_open)
+        self.trips = 0
+        self.rejected = 0
+        self.last_error: str | None = None
+
+    def _trim(self, now: float):
+        while self.calls and now - self.calls[0][0] > settings.BREAKER_WINDOW_SEC:
+            self.calls.popleft()
+
+    def _tick(self, now: float):
+        """open → half_open по истечении BREAKER_OPEN_SEC."""
+        if self.state == OPEN and now - self.opened_at >= settings.BREAKER_OPEN_SEC:
+            self.state = HALF_OPEN
+            self.probes = 0
+
+    def is_open(self) -> bool:
+        """Вызов сейчас точно не пройдёт (half_open со свободной пробой — пройдёт)."""
+        self._tick(time.monotonic())
+        if self.state == HALF_OPEN:
+            return self.probes >= settings.BREAKER_HALF_OPEN_PROBES
+        return self.state == OPEN
+
+    def allow(self) -> bool:
+        if self.is_open():
+            self.rejected += 1
+            return False
+        if self.state == HALF_OPEN:
+            self.probes += 1
+        return True
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.probes = 0
+        self.trips += 1
+
+    def record(self, ok: bool, seconds: float = 0.0, error: str | None = None) -> bool:
+        """Исход вызова; True — breaker только что открылся."""
+        now = time.monotonic()
+        slow = settings.BREAKER_SLOW_CALL_SEC > 0 and seconds >= settings.BREAKER_SLOW_CALL_SEC
+        if not ok:
+            self.last_error = error
+
+        if self.state == HALF_OPEN:
+            self.probes = max(0, self.probes - 1)
+            if ok and not slow:
+                self.state = CLOSED
+                self.calls.clear()
+                return False
+            self._open(now)
+            return True
+
+        self.calls.append((now, ok, seconds))
+        self._trim(now)
+        if self.state != CLOSED or len(self.calls) < settings.BREAKER_MIN_CALLS:
+            return False
+        errors = sum(1 for _, c_ok, _ in self.calls if not c_ok)
+        slow_calls = sum(
+            1 for _, c_ok, sec in self.calls
+            if c_ok and settings.BREAKER_SLOW_CALL_SEC > 0 and sec >= settings.BREAKER_SLOW_CALL_SEC
+        )
+        if errors / len(self.calls) >= settings.BREAKER_ERROR_RATE or slow_calls / len(self.calls) >= settings.BREAKER_SLOW_RATE:
+            self._open(now)
+            return True
+        return False
+
+    def release(self):
+        """Пробу заняли, но исхода нет (вызов отменён)."""
+        if self.state == HALF_OPEN:
+            self.probes = max(0, self.probes - 1)
+
+    def snapshot(self) -> dict:
+        self._tick(time.monotonic())
+        errors = sum(1 for _, ok, _ in self.calls if not ok)
+        return {
+            "state": self.state,
+            "window_calls": len(self.calls),
+            "window_errors": errors,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+        }
+
+
+class CircuitBreakers:
+    def __init__(self):
+        self.breakers: dict[tuple[str, str], Breaker] = {}
+        self.degraded_batches = 0
+        self.degraded_paragraphs = 0
+
+    def _get(self, url: str, model_name: str) -> Breaker:
+        key = (url.rstrip('/'), model_name)
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = Breaker()
+        return breaker
+
+    def is_open(self, url: str, model_name: str) -> bool:
+        if not settings.CIRCUIT_BREAKER:
+            return False
+        key = (url.rstrip('/'), model_name)
+        return key in self.breakers and self.breakers[key].is_open()
+
+    @asynccontextmanager
+    async def guard(self, url: str, model_name: str):
+        """
+        Вызов Шага C под breaker'ом: CircuitOpenError, если он открыт; иначе исход
+        (ошибка или длительность) учитывается. Отмена (клиент ушёл) — не вина Ollama.
+        """
+        if not settings.CIRCUIT_BREAKER:
+            yield
+            return
+        breaker = self._get(url, model_name)
+        if not breaker.allow():
+            raise CircuitOpenError(f"circuit open for {model_name} @ {url}")
+        started_at = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            if breaker.record(False, error=f"{type(e).__name__}: {e}"):
+                print(f"🔌 Circuit OPEN: {model_name} @ {url} ({type(e).__name__})")
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        else:
+            if breaker.record(True, time.perf_counter() - started_at):
+                print(f"🔌 Circuit OPEN: {model_name} @ {url} (slow calls)")
+            elif breaker.state == CLOSED and breaker.trips and not breaker.calls:
+                print(f"🔌 Circuit closed again: {model_name} @ {url}")
+
+    def record_degraded(self, paragraphs: int):
+        self.degraded_batches += 1
+        self.degraded_paragraphs += paragraphs
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": settings.CIRCUIT_BREAKER,
+            "breakers": {f"{model} @ {url}": b.snapshot() for (url, model), b in self.breakers.items()},
+            "degraded_batches": self.degraded_batches,
+            "degraded_paragraphs": self.degraded_paragraphs,
+        }
+
+
+circuit_breakers = CircuitBreakers()
+metrics.register("circuit_breaker", circuit_breakers.snapshot)
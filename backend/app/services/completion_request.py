@@ -0,0 +1,101 @@
+#completion_request.py
+"""
+Разбор тела /v1/completions. Поддерживаются три формата:
+
+  1. NDJSON (Content-Type: application/x-ndjson) — разбирается потоково, по мере чтения тела:
+       {"model": "...", "session_id": "...", ...}   ← первая строка: параметры запроса
+       {"id": 0, "text": "..."}                      ← дальше по абзацу на строку
+     В памяти — только недочитанный хвост строки и уже разобранные абзацы,
+     без полной копии тела в bytes и в str.
+  2. JSON с массивом верхнего уровня: {"model": "...", "paragraphs": [{"id": 0, "text": "..."}]}
+     — один json.loads, без строки-в-строке.
+  3. Старый формат расширения: абзацы json.dumps'ом внутри "prompt" после PROMPT_MARKER
+     (двойное кодирование) — оставлен для совместимости.
+
+На выходе всегда dict параметров, где "paragraphs" — список {"id": int, "text": str}.
+Всё, что не так, — CompletionRequestError (400) до начала стрима, а не падение внутри него.
+"""
+
+import json
+
+PROMPT_MARKER = "=== USER CONTENT (CONTENT SOURCE) ==="
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+class CompletionRequestError(ValueError):
+    """Тело запроса не разобрать."""
+
+
+def paragraphs_from_prompt(raw_prompt: str) -> list:
+    """Старый формат: JSON-массив абзацев после маркера в prompt."""
+    if PROMPT_MARKER not in raw_prompt:
+        return []
+    json_content = raw_prompt.split(PROMPT_MARKER)[-1].strip()
+    try:
+        # Клиент отправляет JSON: [{"id": N, "text": "..."}]
+        return json.loads(json_content)
+    except json.JSONDecodeError:
+        return []
+
+
+def _validate_paragraphs(paragraphs: list) -> list[dict]:
+    for i, p in enumerate(paragraphs):
+        pid = p.get("id") if isinstance(p, dict) else None
+        if not isinstance(pid, int) or isinstance(pid, bool) or not isinstance(p.get("text"), str):
+            raise CompletionRequestError(f'paragraph #{i} must be {{"id": int, "text": str}}, got {p!r:.80}')
+    return paragraphs
+
+
+async def _read_ndjson(request) -> dict:
+    data: dict | None = None
+    paragraphs: list[dict] = []
+    tail = b""
+
+    def _consume(lines: list[bytes]):
+        nonlocal data
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return
+        # Все целые строки куска — одним json.loads: заметно быстрее, чем по строке
+        try:
+            records = json.loads(b"[" + b",".join(lines) + b"]")
+        except json.JSONDecodeError as e:
+            raise CompletionRequestError(f"invalid NDJSON body: {e}") from e
+        if data is None:
+            data = records.pop(0)
+        paragraphs.extend(records)
+
+    async for chunk in request.stream():
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        _consume(lines)
+    _consume([tail])
+
+    if not isinstance(data, dict):
+        raise CompletionRequestError("NDJSON body must start with a request object")
+    data["paragraphs"] = _validate_paragraphs(paragraphs)
+    return data
+
+
+async def read_completion_request(request) -> dict:
+    headers = getattr(request, "headers", None) or {}
+    if headers.get("content-type", "").split(";")[0].strip() == NDJSON_CONTENT_TYPE:
+        return await _read_ndjson(request)
+
+    try:
+        data = await request.json()
+    except ValueError as e:
+        raise CompletionRequestError(f"invalid JSON body: {e}") from e
+    if not isinstance(data, dict):
+        raise CompletionRequestError("JSON body must be an object")
+    paragraphs = data.get("paragraphs")
+    if paragraphs is None:
+        prompt = data.get("prompt", "")
+        if not isinstance(prompt, str):
+            raise CompletionRequestError("prompt must be a string")
+        paragraphs = paragraphs_from_prompt(prompt)
+    if not isinstance(paragraphs, list):
+        print("⚠️ Warning: proxy_completions did not receive a JSON array of paragraphs.")
+        paragraphs = []
+    data["paragraphs"] = _validate_paragraphs(paragraphs)
+    return data
@@ -0,0 +1,75 @@
+#context_sizing.py
+"""
+Подбор num_ctx для Шага C под размер запроса.
+
+Раньше num_ctx всегда был равен safe_context_budget — весь бюджет модели даже для
+трёх абзацев. Ollama выделяет KV-cache под num_ctx целиком, так что маленькие батчи
+платили памятью и временем аллокации, а смена num_ctx может перезагрузить модель.
+
+Политика:
+  1. Оценка токенов: system_message / SYSTEM_CPT + точные токены промпта (token_counter)
+     + ~16 токенов ответа на абзац, плюс запас на шаблон чата.
+  2. Если модель уже загружена (context_length из /api/ps) с контекстом, которого хватает
+     и который не больше безопасного потолка, — берём его: перезагрузки не будет.
+  3. Иначе — ближайшая ступень NUM_CTX_BUCKETS сверху (ступеней мало → перезагрузки редки).
+  4. Никогда не больше safe_cap (бюджет get_safe_context).
+"""
+
+from collections import Counter
+
+from app.config import settings
+from app.services import metrics
+from app.services.batch_planner import OUTPUT_TOKENS_PER_PARAGRAPH
+from app.services.llm_checker import SYSTEM_CPT
+
+# Запас на шаблон чата, служебные токены и погрешность CPT
+_OVERHEAD_TOKENS = 256
+_MARGIN = 1.2
+
+
+def estimate_request_tokens(system_message: str, user_tokens: int, paragraphs: int) -> int:
+    """Сколько токенов займёт запрос Шага C вместе с ответом."""
+    prompt_tokens = len(system_message) / SYSTEM_CPT + user_tokens
+    output_tokens = paragraphs * OUTPUT_TOKENS_PER_PARAGRAPH
+    return int((prompt_tokens + output_tokens) * _MARGIN) + _OVERHEAD_TOKENS
+
+
+def bucket_for(tokens: int, safe_cap: int) -> int:
+    """Ближайшая ступень сверху, но не больше safe_cap."""
+    for bucket in settings.NUM_CTX_BUCKETS:
+        if bucket >= tokens:
+            return min(bucket, safe_cap)
+    return safe_cap
+
+
+class ContextSizer:
+    def __init__(self):
+        self.buckets: Counter = Counter()   # выбранный num_ctx -> сколько раз
+        self.reused_loaded = 0              # сколько раз взяли контекст уже загруженной модели
+        self.capped = 0                     # запрос не влез даже в safe_cap
+        self.tokens_saved = 0               # сумма (safe_cap - num_ctx) — сколько KV-cache не выделили
+
+    def choose(self, needed_tokens: int, safe_cap: int, loaded_ctx: int | None = None) -> int:
+        """num_ctx для запроса из needed_tokens токенов."""
+        if loaded_ctx and needed_tokens <= loaded_ctx <= safe_cap:
+            num_ctx = loaded_ctx
+            self.reused_loaded += 1
+        else:
+            num_ctx = bucket_for(needed_tokens, safe_cap)
+            if needed_tokens > safe_cap:
+                self.capped += 1
+        self.buckets[num_ctx] += 1
+        self.tokens_saved += max(0, safe_cap - num_ctx)
+        return num_ctx
+
+    def snapshot(self) -> dict:
+        return {
+            "buckets": {str(k): v for k, v in sorted(self.buckets.items())},
+            "reused_loaded": self.reused_loaded,
+            "capped": self.capped,
+            "ctx_tokens_saved": self.tokens_saved,
+        }
+
+
+context_sizer = ContextSizer()
+metrics.register("context_sizing", context_sizer.snapshot)
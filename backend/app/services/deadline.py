@@ -0,0 +1,122 @@
+#deadline.py
+"""
+Планирование запроса /v1/completions под дедлайн клиента.
+
+Клиент присылает бюджет латентности: заголовок X-Deadline-Ms (или поле "deadline_ms")
+— сколько миллисекунд от прихода запроса до последней строки ответа. По нему:
+  - Шаг B ищет ближайший эталон для каждого абзаца (не только уверенные попадания):
+    расстояние до него — мера неоднозначности абзаца;
+  - в LLM уходит столько абзацев, сколько успеет модель по её скорости
+    (batch_planner.paragraph_seconds + загрузка, если модель не в памяти),
+    начиная с самых неоднозначных — там LLM полезнее всего;
+  - остальные сразу получают стиль без LLM (Fast Track с порогом BREAKER_FALLBACK_DISTANCE
+    или "Normal", "fallback": "deadline");
+  - если LLM всё же не уложилась, на дедлайне её ответ не ждём: её абзацы тоже уходят без LLM.
+
+DEADLINE_RESERVE_MS оставляется на разбор ответа и хвост потока.
+Выполнение дедлайнов — в /api/metrics ("deadline").
+"""
+
+import time
+
+from app.config import settings
+from app.services import metrics
+from app.services.batch_planner import PREFILL_SPEEDUP, batch_planner
+from app.services.llm_checker import _default_user_cpt
+from app.services.model_profiles import model_profiles
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+
+
+def parse_deadline_ms(request, data: dict) -> float | None:
+    """Бюджет из заголовка X-Deadline-Ms или поля "deadline_ms"; None — без дедлайна."""
+    headers = getattr(request, "headers", None) or {}
+    raw = headers.get(DEADLINE_HEADER) or data.get("deadline_ms")
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def by_ambiguity(items: list[dict], nearest: dict[int, tuple[str, float]]) -> list[dict]:
+    """Самые неоднозначные первыми: дальше всех от эталонов (без эталона — в начало)."""
+    return sorted(items, key=lambda p: -nearest.get(p["id"], (None, float("inf")))[1])
+
+
+def call_overhead_seconds(model_name: str, system_chars: int, resident: bool) -> float:
+    """
+    Постоянная часть вызова: prefill system-промпта и загрузка модели, если её нет в памяти.
+    Наблюдаемое sec_per_paragraph батча уже включает prefill — тогда считаем только загрузку.
+    """
+    profile = model_profiles.get(model_name)
+    overhead = 0.0
+    if not batch_planner.sec_per_paragraph.get(model_name):
+        prefill_tps = profile.get("prefill_tps") or (model_profiles.decode_tps(model_name) or 5.0) * PREFILL_SPEEDUP
+        overhead = system_chars / _default_user_cpt("ru") / prefill_tps
+    if not resident:
+        overhead += profile.get("load_sec", 0.0)
+    return overhead
+
+
+def split_for_deadline(
+    model_name: str,
+    ranked: list[dict],
+    tps: float,
+    seconds_left: float,
+    overhead_sec: float,
+) -> tuple[list[dict], list[dict]]:
+    """(в LLM, без LLM): жадно берём абзацы по порядку ranked, пока оценка укладывается в seconds_left."""
+    budget = seconds_left - overhead_sec
+    chosen = 0
+    for p in ranked:
+        cost = batch_planner.paragraph_seconds(model_name, len(p["text"]), tps)
+        if cost > budget:
+            break
+        budget -= cost
+        chosen += 1
+    return ranked[:chosen], ranked[chosen:]
+
+
+class DeadlineStats:
+    def __init__(self):
+        self.requests = 0
+        self.met = 0
+        self.missed = 0
+        self.llm_paragraphs = 0
+        self.deferred_paragraphs = 0
+        self.llm_overruns = 0     # LLM не уложилась — её абзацы ушли без LLM
+        self.slack_ms: list[float] = []
+
+    def record_plan(self, to_llm: int, deferred: int):
+        self.llm_paragraphs += to_llm
+        self.deferred_paragraphs += deferred
+
+    def record_finish(self, deadline_at: float):
+        """Последняя строка потока ушла: запас до дедлайна (отрицательный — опоздали)."""
+        slack = (deadline_at - time.monotonic()) * 1000
+        self.requests += 1
+        if slack >= 0:
+            self.met += 1
+        else:
+            self.missed += 1
+        self.slack_ms.append(slack)
+        del self.slack_ms[:-200]
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.slack_ms)
+        return {
+            "requests": self.requests,
+            "met": self.met,
+            "missed": self.missed,
+            "llm_paragraphs": self.llm_paragraphs,
+            "deferred_paragraphs": self.deferred_paragraphs,
+            "llm_overruns": self.llm_overruns,
+            "min_slack_ms": round(ordered[0]) if ordered else None,
+            "median_slack_ms": round(ordered[len(ordered) // 2]) if ordered else None,
+            "reserve_ms": settings.DEADLINE_RESERVE_MS,
+        }
+
+
+deadline_stats = DeadlineStats()
+metrics.register("deadline", deadline_stats.snapshot)
@@ -0,0 +1,139 @@
+#early_stop.py
+"""
+Ранняя остановка генерации Шага C и подавление reasoning.
+
+Reasoning-модели (deepseek-r1, qwen3) дописывают после готового JSON пояснения или
+сначала сотнями токенов «думают» — _normalize_to_list давно вычищает это из ответа,
+но время GPU уже потрачено. Здесь:
+  - AnswerTracker следит за потоком {"<id>": "<стиль>"}: как только у каждого id
+    есть значение, endpoints закрывает запрос к Ollama (закрытие соединения
+    останавливает генерацию) — закрывающую "}" дорисует json_repair;
+  - chat_limits: модели с capability "thinking" (/api/show) получают "think": false,
+    если LLM_THINK не включён, а ответ — потолок по числу id
+    (NUM_PREDICT_BASE + NUM_PREDICT_PER_ID × id): ушедшая в рассуждения модель
+    не генерирует до конца контекста.
+
+Сколько сэкономлено, напрямую не видно: остановленный ответ не досчитан. Поэтому каждый
+EARLY_STOP_PROBE_EVERY-й вызов модели (и первый) идёт до конца — «проба» меряет хвост
+после последнего ответа (токены и секунды по eval_duration), а каждая ранняя остановка
+записывает в экономию EWMA этого хвоста. Модель, у которой хвост короче EARLY_STOP_MIN_TAIL
+токенов, не обрываем вовсе: экономить нечего. У оборванного вызова нет финального чанка:
+prompt_eval_count считает token_counter, скорость генерации — hedged_chat по пришедшим чанкам,
+а prefill и загрузку модели model_profiles учит только по досчитанным ответам.
+Счётчики по моделям — в /api/metrics ("early_stop").
+"""
+
+import re
+
+from app.config import settings
+from app.services import metrics
+
+# Готовая пара "id": "стиль" (значение — с закрывающей кавычкой)
+_ANSWER_RE = re.compile(r'"(\d+)"\s*:\s*"(?:[^"\\]|\\.)*"')
+
+_EWMA_ALPHA = 0.3
+
+
+def _ewma(old: float | None, value: float) -> float:
+    return value if old is None else old + _EWMA_ALPHA * (value - old)
+
+
+def chat_limits(show: dict, ids: int) -> tuple[bool | None, int | None]:
+    """
+    ("think", "num_predict") для /api/chat батча из ids абзацев (None — поле не шлём).
+    Модели с capability "thinking" — "think": false, если LLM_THINK выключен; рассуждения
+    тоже тратят num_predict, поэтому думающей модели потолок не ставим.
+    """
+    thinking = "thinking" in (show.get("capabilities") or [])
+    think = False if thinking and not settings.LLM_THINK else None
+    if settings.NUM_PREDICT_PER_ID <= 0 or (thinking and settings.LLM_THINK):
+        return think, None
+    return think, settings.NUM_PREDICT_BASE + settings.NUM_PREDICT_PER_ID * ids
+
+
+class AnswerTracker:
+    """Все ли id батча уже получили стиль в накопленном ответе модели."""
+
+    def __init__(self, ids):
+        self.waiting = {str(pid) for pid in ids}
+        self.tokens = 0                       # чанков стрима ≈ токенов ответа
+        self.answered_at: int | None = None   # на каком токене ответили все id
+        self._pos = 0
+
+    def feed(self, buffer: str) -> bool:
+        """Очередной чанк дописан в buffer; True — ответы есть для всех id."""
+        self.tokens += 1
+        if self.answered_at is not None:
+            return True
+        # Рассуждения внутри content (старые Ollama без "thinking") пропускаем целиком
+        if "<think>" in buffer:
+            end = buffer.find("</think>")
+            if end == -1:
+                return False
+            self._pos = max(self._pos, end + len("</think>"))
+        for match in _ANSWER_RE.finditer(buffer, self._pos):
+            self.waiting.discard(match.group(1))
+            self._pos = match.end()
+        if not self.waiting:
+            self.answered_at = self.tokens
+            return True
+        return False
+
+
+class EarlyStopStats:
+    def __init__(self):
+        self.models: dict[str, dict] = {}
+
+    def _model(self, model_name: str) -> dict:
+        return self.models.setdefault(model_name, {
+            "calls": 0, "early_stops": 0, "probes": 0, "think_off": 0,
+            "tail_tokens": None, "tail_sec": None, "saved_tokens": 0.0, "saved_sec": 0.0,
+        })
+
+    def start(self, model_name: str, think_off: bool) -> bool:
+        """Новый вызов модели; True — его можно оборвать, как только все id получат стиль."""
+        m = self._model(model_name)
+        probe = settings.EARLY_STOP_PROBE_EVERY > 0 and m["calls"] % settings.EARLY_STOP_PROBE_EVERY == 0
+        m["calls"] += 1
+        if think_off:
+            m["think_off"] += 1
+        if probe:
+            m["probes"] += 1
+        short_tail = m["tail_tokens"] is not None and m["tail_tokens"] < settings.EARLY_STOP_MIN_TAIL
+        return settings.EARLY_STOP and not probe and not short_tail
+
+    def record_done(self, model_name: str, tracker: AnswerTracker, done_chunk: dict):
+        """Вызов дошёл до конца (проба или короткий хвост): хвост после последнего ответа — в EWMA."""
+        if tracker.answered_at is None:
+            return
+        eval_count = done_chunk.get("eval_count") or tracker.tokens
+        eval_ns = done_chunk.get("eval_duration", 0)
+        tail = max(0, eval_count - tracker.answered_at)
+        m = self._model(model_name)
+        m["tail_tokens"] = _ewma(m["tail_tokens"], tail)
+        if eval_ns > 0 and eval_count > 0:
+            m["tail_sec"] = _ewma(m["tail_sec"], tail * eval_ns / 1e9 / eval_count)
+
+    def record_stop(self, model_name: str):
+        """Запрос закрыт досрочно: в экономию — типичный хвост модели (если уже мерили)."""
+        m = self._model(model_name)
+        m["early_stops"] += 1
+        m["saved_tokens"] += m["tail_tokens"] or 0.0
+        m["saved_sec"] += m["tail_sec"] or 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": settings.EARLY_STOP,
+            "think": settings.LLM_THINK,
+            "models": {
+                name: {
+                    key: (round(value, 2) if isinstance(value, float) else value)
+                    for key, value in m.items()
+                }
+                for name, m in self.models.items()
+            },
+        }
+
+
+early_stop_stats = EarlyStopStats()
+metrics.register("early_stop", early_stop_stats.snapshot)
@@ -0,0 +1,274 @@
+#hedging.py
+"""
+Hedged requests для Шага C: срезаем хвост латентности, когда узел Ollama «залип»
+(своп модели, нехватка памяти, застрявший слот).
+
+Как работает:
+  1. Запрос уходит на основной узел. Время до первого токена пишется в историю модели.
+  2. Если первый токен не пришёл за порог (перцентиль HEDGE_PERCENTILE по истории модели,
+     не меньше HEDGE_MIN_DELAY) — тот же запрос дублируется на другой узел
+     (или в другой слот того же узла, если узел один и HEDGE_SAME_NODE=true).
+  3. Кто первым прислал токен — того и стримим дальше; второй отменяется
+     (закрытие соединения останавливает генерацию в Ollama). Дубль идёт тем же путём,
+     что и основной запрос: резидентность модели, num_ctx узла, circuit breaker.
+  4. Хеджей не больше HEDGE_MAX_FRACTION от вызовов Шага C (один на запрос /v1/completions),
+     счётчики — в /api/metrics.
+
+По умолчанию выключено (HEDGE_ENABLED=false): дубль удваивает нагрузку на GPU/CPU.
+"""
+
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import AsyncContextManager, AsyncIterator, Callable
+
+from app.config import settings
+from app.services import metrics
+from app.services.model_profiles import model_profiles
+from app.services.ollama_client import stream_chat
+from app.services.ollama_pool import ollama_pool, OllamaNode
+
+_HISTORY_LIMIT = 200    # сколько последних замеров first-token латентности хранить на модель
+
+_END = object()
+
+# Подготовка запроса к узлу: async with open_node(node) as payload
+OpenNode = Callable[[OllamaNode], AsyncContextManager[dict]]
+
+
+class HedgePolicy:
+    def __init__(self):
+        self.first_token_history: dict[str, deque] = defaultdict(lambda: deque(maxlen=_HISTORY_LIMIT))
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.skipped_by_budget = 0
+
+    def record_request(self):
+        """
+        Ещё один вызов Шага C из /v1/completions — база доли HEDGE_MAX_FRACTION.
+        Выборки каскада и пробы ранней остановки — всё тот же вызов, не отдельные запросы.
+        """
+        self.requests += 1
+
+    def record_first_token(self, model_name: str, seconds: float):
+        self.first_token_history[model_name].append(seconds)
+
+    def threshold(self, model_name: str) -> float | None:
+        """Порог хеджа для модели или None (хедж выключен / мало замеров)."""
+        if not settings.HEDGE_ENABLED:
+            return None
+        history = sorted(self.first_token_history.get(model_name, ()))
+        if len(history) < settings.HEDGE_MIN_SAMPLES:
+            return None
+        idx = min(len(history) - 1, int(len(history) * settings.HEDGE_PERCENTILE / 100.0))
+        return max(history[idx], settings.HEDGE_MIN_DELAY)
+
+    def take_budget(self) -> bool:
+        """Можно ли отправить ещё один хедж, не превысив долю HEDGE_MAX_FRACTION."""
+        if self.hedges + 1 > settings.HEDGE_MAX_FRACTION * self.requests:
+            self.skipped_by_budget += 1
+            return False
+        self.hedges += 1
+        return True
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": settings.HEDGE_ENABLED,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_rate": round(self.hedges / self.requests, 3) if self.requests else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "primary_wins": self.primary_wins,
+            "skipped_by_budget": self.skipped_by_budget,
+            "thresholds_sec": {
+                m: round(t, 2) for m in self.first_token_history
+                if (t := self.threshold(m)) is not None
+            },
+        }
+
+
+class _Attempt:
+    """Один запрос /api/chat к узлу: чанки копятся в очередь, пока их не заберёт hedged_chat."""
+
+    def __init__(
+        self,
+        node: OllamaNode,
+        model_name: str,
+        payload: dict | None,
+        estimated_tokens: int,
+        timeout: float,
+        open_node: OpenNode | None = None,
+    ):
+        self.node = node
+        self.model_name = model_name
+        self.payload = payload
+        self.estimated_tokens = estimated_tokens
+        self.timeout = timeout
+        self.open_node = open_node
+        self.received = 0
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.first_token = asyncio.Event()
+        self.first_token_at: float | None = None
+        self.last_token_at: float | None = None
+        self.done = False
+        self.closing = False
+        self.error: Exception | None = None
+        self.task: asyncio.Task | None = None
+
+    def start(self) -> "_Attempt":
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def _run(self):
+        try:
+            if self.open_node is None:
+                await self._stream(self.payload)
+            else:
+                # Хедж на другом узле — тем же путём, что и основной запрос: резидентность, num_ctx, breaker
+                async with self.open_node(self.node) as payload:
+                    await self._stream(payload)
+        except Exception as e:
+            self.error = e
+        await self.queue.put(_END)
+
+    async def _stream(self, payload: dict):
+        start = time.perf_counter()
+        try:
+            async with ollama_pool.track(self.node, self.estimated_tokens):
+                async for chunk in stream_chat(self.node.url, payload, timeout=self.timeout):
+                    self.last_token_at = time.perf_counter()
+                    if not self.first_token.is_set():
+                        self.first_token.set()
+                        self.first_token_at = self.last_token_at
+                        hedge_policy.record_first_token(self.model_name, self.first_token_at - start)
+                    if chunk.get("done"):
+                        self.done = True
+                        ollama_pool.record_eval(self.node, self.model_name, chunk)
+                        model_profiles.record(self.model_name, chunk)
+                    self.received += 1
+                    await self.queue.put(chunk)
+        except asyncio.CancelledError:
+            # Ответ забрали досрочно (ранняя остановка, клиент ушёл) — для breaker'а вызов удался
+            if not self.closing:
+                raise
+
+    async def wait_first_token(self, timeout: float | None) -> bool:
+        """True, если за timeout пришёл первый токен или запрос уже завершился (в т.ч. ошибкой)."""
+        waiter = asyncio.ensure_future(self.first_token.wait())
+        try:
+            await asyncio.wait({waiter, self.task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        return self.first_token.is_set() or self.task.done()
+
+    async def stream(self) -> AsyncIterator[dict]:
+        while True:
+            item = await self.queue.get()
+            if item is _END:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+    def record_truncated(self):
+        """
+        Запрос закрыли до финального чанка (ранняя остановка, клиент ушёл): eval_count/eval_duration
+        Ollama не прислала — скорость генерации считаем по чанкам после первого токена.
+        prompt_eval_* и load_duration не пишем: время до первого токена смешивает загрузку модели,
+        очередь Ollama и prefill, профиль prefill учится только на досчитанных ответах.
+        """
+        if self.done or self.error is not None or self.first_token_at is None:
+            return
+        tokens = self.received - 1
+        seconds = self.last_token_at - self.first_token_at
+        if tokens <= 0 or seconds <= 0:
+            return
+        partial = {"eval_count": tokens, "eval_duration": int(seconds * 1e9)}
+        ollama_pool.record_eval(self.node, self.model_name, partial)
+        model_profiles.record(self.model_name, partial)
+
+    def close(self):
+        """Ответ больше не нужен тому, кто его читал: генерацию останавливаем, вызов — не ошибка."""
+        self.record_truncated()
+        if self.task and not self.task.done():
+            self.closing = True
+            self.task.cancel()
+
+    def cancel(self):
+        if self.task and not self.task.done() and not self.closing:
+            self.task.cancel()
+
+
+def _pick_alternate(model_name: str, primary: OllamaNode) -> OllamaNode | None:
+    others = [n for n in ollama_pool.candidates(model_name) if n is not primary]
+    if others:
+        return min(others, key=lambda n: n.outstanding_tokens / max(n.tps_for(model_name), 0.1))
+    return primary if settings.HEDGE_SAME_NODE else None
+
+
+async def _race(primary: _Attempt, backup: _Attempt) -> _Attempt:
+    """Ждёт первый токен от любого из запросов; второй отменяет. Упавший до первого токена — не победитель."""
+    waiters = {asyncio.ensure_future(a.wait_first_token(None)): a for a in (primary, backup)}
+    first_error = None
+    try:
+        while waiters:
+            done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in done:
+                attempt = waiters.pop(waiter)
+                if attempt.first_token.is_set() or attempt.error is None:
+                    (backup if attempt is primary else primary).cancel()
+                    return attempt
+                first_error = first_error or attempt.error
+        raise first_error
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+
+async def hedged_chat(
+    model_name: str,
+    payload: dict,
+    node: OllamaNode,
+    estimated_tokens: int,
+    timeout: float | None = None,
+    open_node: OpenNode | None = None,
+) -> AsyncIterator[dict]:
+    """
+    Стрим чанков /api/chat с опциональным хеджем: чанки отдаются по мере прихода —
+    с хеджем от того запроса, который первым прислал токен.
+    open_node(node) — как вызывающий готовит запрос к другому узлу (резидентность, num_ctx,
+    breaker; отдаёт payload). Без него хедж не отправляется.
+    """
+    timeout = timeout or settings.LLM_TIMEOUT
+    primary = _Attempt(node, model_name, payload, estimated_tokens, timeout).start()
+    backup = None
+    active = primary
+    try:
+        threshold = hedge_policy.threshold(model_name) if open_node is not None else None
+        if threshold is not None and not await primary.wait_first_token(threshold):
+            alternate = _pick_alternate(model_name, node)
+            if alternate is not None and hedge_policy.take_budget():
+                print(f"🪃 Hedge: {model_name} молчит > {threshold:.1f}s на {node.url} → дубль на {alternate.url}")
+                backup = _Attempt(alternate, model_name, None, estimated_tokens, timeout, open_node).start()
+                active = await _race(primary, backup)
+                if active is backup:
+                    hedge_policy.hedge_wins += 1
+                else:
+                    hedge_policy.primary_wins += 1
+
+        async for chunk in active.stream():
+            yield chunk
+    except GeneratorExit:
+        # Потребитель забрал сколько нужно (ранняя остановка, клиент ушёл)
+        active.close()
+        raise
+    finally:
+        primary.cancel()
+        if backup:
+            backup.cancel()
+
+
+hedge_policy = HedgePolicy()
+metrics.register("hedging", hedge_policy.snapshot)
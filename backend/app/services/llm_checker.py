@@ -7,8 +7,8 @@
   - Зависимость Node.js в Python-проекте — архитектурный запах
 
 Как работает теперь:
-  1. GET /api/show → model_info → парсим *.context_length (объявленный ctx)
-  2. psutil.virtual_memory().available → поправка на RAM сервера
+  1. /api/show (через кэш services/ollama_meta.py) → model_info → *.context_length (объявленный ctx)
+  2. settings.ctx_ram_gb (живой замер RAM от resource_monitor) → поправка на RAM сервера
   3. НЕТ внешних процессов. НЕТ npm. Только httpx + psutil (уже в зависимостях).
 
 Про CPT (chars_per_token):
@@ -18,9 +18,12 @@
 """
 
 import re
-import psutil
 import httpx
 
+from app.config import settings
+from app.services.ollama_meta import ollama_meta
+from app.services.text_features import detect_lang
+
 # --------------------------------------------------------------------------
 # Константы
 # --------------------------------------------------------------------------
@@ -46,7 +49,7 @@ _CTX_RAM_TABLE = [
 SAFETY_BUFFER = 2048
 
 # Кэши (singleton модуля)
-_ctx_cache: dict[str, tuple[int, bool]] = {}         # model -> (safe_context_for_user, is_degraded)
+_ctx_cache: dict[tuple, tuple[int, bool]] = {}       # (url, model) -> (safe_context_for_user, is_degraded)
 _cpt_cache: dict[tuple, float] = {}                  # (model, lang) -> chars_per_token
 
 
@@ -55,35 +58,72 @@ _cpt_cache: dict[tuple, float] = {}                  # (model, lang) -> chars_pe
 # --------------------------------------------------------------------------
 
 def _detect_lang(sample: str) -> str:
-    """Heuristic: если > 25% кириллицы — русский."""
-    if not sample:
-        return "other"
-    cyrillic = sum(1 for c in sample if '\u0400' <= c <= '\u04FF')
-    if cyrillic / len(sample) > 0.25:
-        return "ru"
-    latin = sum(1 for c in sample if 'a' <= c.lower() <= 'z')
-    if latin / len(sample) > 0.3:
-        return "en"
-    return "other"
+    """Heuristic: если > 25% кириллицы — русский (считает text_features за один проход)."""
+    return detect_lang(sample)
 
 
 def _default_user_cpt(lang: str) -> float:
     return {"ru": _DEFAULT_CPT_RU, "en": _DEFAULT_CPT_EN}.get(lang, _DEFAULT_CPT_MX)
 
 
+def ram_tier(available_gb: float) -> int:
+    """Номер строки _CTX_RAM_TABLE для объёма RAM (len(_CTX_RAM_TABLE) — без ограничений)."""
+    for tier, (threshold_gb, _) in enumerate(_CTX_RAM_TABLE):
+        if available_gb < threshold_gb:
+            return tier
+    return len(_CTX_RAM_TABLE)
+
+
+def _ctx_key(model_name: str, ollama_url: str) -> tuple[str, str]:
+    # У узлов пула одна и та же модель может быть разной сборки (другой context_length)
+    return ollama_url.rstrip('/'), model_name
+
+
+def invalidate_context_cache(ollama_url: str | None = None):
+    """
+    Сбрасывает закэшированные бюджеты контекста узла (None — всех узлов):
+    RAM изменилась — пересчитаем на следующем запросе.
+    """
+    if ollama_url is None:
+        _ctx_cache.clear()
+        return
+    url = ollama_url.rstrip('/')
+    for key in [k for k in _ctx_cache if k[0] == url]:
+        del _ctx_cache[key]
+
+
+def forget_model(model_name: str, ollama_url: str | None = None):
+    """Модель перекачали/пересобрали на узле (None — на всех): её бюджет контекста и CPT замеряются заново."""
+    if ollama_url is None:
+        for key in [k for k in _ctx_cache if k[1] == model_name]:
+            del _ctx_cache[key]
+    else:
+        _ctx_cache.pop(_ctx_key(model_name, ollama_url), None)
+    # CPT — свойство токенайзера модели, а не узла
+    for key in [k for k in _cpt_cache if k[0] == model_name]:
+        del _cpt_cache[key]
+
+
+ollama_meta.on_model_changed(forget_model)
+
+
 def _ram_cap(declared_ctx: int) -> tuple[int, bool]:
     """Ограничивает контекст по доступной RAM и возвращает флаг деградации."""
-    available_gb = psutil.virtual_memory().available / (1024 ** 3)
+    available_gb = settings.ctx_ram_gb
     is_degraded = False
     
     cap = declared_ctx
-    for threshold_gb, max_ctx in _CTX_RAM_TABLE:
-        if available_gb < threshold_gb:
-            cap = min(declared_ctx, max_ctx)
-            # Если мы порезали контекст из-за памяти — включаем флаг деградации
-            if cap < declared_ctx:
-                is_degraded = True
-            break
+    tier = ram_tier(available_gb)
+    if tier < len(_CTX_RAM_TABLE):
+        cap = min(declared_ctx, _CTX_RAM_TABLE[tier][1])
+        # Если мы порезали контекст из-за памяти — включаем флаг деградации
+        if cap < declared_ctx:
+            is_degraded = True
+
+    # Под давлением на ресурсы — не больше «слабого» OLLAMA_CTX
+    if settings.memory_pressure and cap > settings.OLLAMA_CTX:
+        cap = settings.OLLAMA_CTX
+        is_degraded = True
             
     return cap, is_degraded
 
@@ -117,19 +157,13 @@ async def get_safe_context(model_name: str, ollama_url: str) -> tuple[int, bool]
     Получает безопасный num_ctx для модели.
     Возвращает (user_token_budget, is_degraded)
     """
-    if model_name in _ctx_cache:
-        return _ctx_cache[model_name]
+    key = _ctx_key(model_name, ollama_url)
+    if key in _ctx_cache:
+        return _ctx_cache[key]
 
     declared_ctx = DEFAULT_CTX
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                f"{ollama_url.rstrip('/')}/api/show",
-                json={"name": model_name},
-                timeout=10,
-            )
-        resp.raise_for_status()
-        declared_ctx = _parse_context_from_show(resp.json())
+        declared_ctx = _parse_context_from_show(await ollama_meta.show(ollama_url, model_name))
         print(f"🔍 /api/show: {model_name} → declared context = {declared_ctx} tokens")
     except Exception as e:
         declared_ctx = DEFAULT_CTX
@@ -142,10 +176,10 @@ async def get_safe_context(model_name: str, ollama_url: str) -> tuple[int, bool]
     if safe_ctx != declared_ctx:
         print(
             f"📉 RAM-ограничение: {declared_ctx} → {safe_ctx} tokens "
-            f"(доступно {psutil.virtual_memory().available/(1024**3):.1f} GB RAM), Degraded={is_degraded}"
+            f"(доступно {settings.ctx_ram_gb:.1f} GB RAM), Degraded={is_degraded}"
         )
 
-    _ctx_cache[model_name] = (user_budget, is_degraded)
+    _ctx_cache[key] = (user_budget, is_degraded)
     return user_budget, is_degraded
 
 
@@ -0,0 +1,132 @@
+#loop_monitor.py
+"""
+Детектор лагов event loop и блокирующих вызовов (включается LOOP_MONITOR_ENABLED=true).
+
+Что-то синхронное в async-коде (Chroma, файловый I/O, print в огромный лог) блокирует
+FastAPI целиком, а узнаём мы об этом от пользователей. Монитор:
+  - тикер в event loop: спит LOOP_MONITOR_INTERVAL и меряет, насколько позже проснулся
+    (задержка планирования) → гистограмма лагов
+  - сторожевой поток: если тикер не отмечался дольше LOOP_LAG_THRESHOLD, снимает стек
+    потока event loop (sys._current_frames) ПРЯМО ВО ВРЕМЯ блокировки — видно виновника
+  - стеки дедуплицируются, отчёт — GET /api/admin/loop_lag, /api/metrics и лог
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from app.config import settings
+from app.services import metrics
+
+# Верхние границы корзин гистограммы лагов, мс
+_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+_STALLS_LIMIT = 50
+_STACK_DEPTH = 12
+
+
+class LoopLagMonitor:
+    def __init__(self):
+        self.histogram = [0] * len(_BUCKETS_MS)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.stalls: deque = deque(maxlen=_STALLS_LIMIT)   # последние эпизоды блокировки
+        self.stacks: dict[str, dict] = {}                   # стек -> {count, max_lag_ms, last_at}
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    # ------------------------------------------------------------------
+    # Тикер в event loop
+    # ------------------------------------------------------------------
+
+    def observe_lag(self, lag: float):
+        self.samples += 1
+        self.max_lag = max(self.max_lag, lag)
+        lag_ms = lag * 1000
+        for i, bound in enumerate(_BUCKETS_MS):
+            if lag_ms <= bound:
+                self.histogram[i] += 1
+                break
+
+    async def _ticker(self, interval: float):
+        while True:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            self._last_beat = now
+            self.observe_lag(max(0.0, now - expected))
+
+    # ------------------------------------------------------------------
+    # Сторожевой поток: стек виновника
+    # ------------------------------------------------------------------
+
+    def _capture(self, blocked_for: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = "".join(traceback.format_stack(frame, limit=_STACK_DEPTH))
+        entry = self.stacks.setdefault(stack, {"count": 0, "max_lag_ms": 0.0})
+        entry["count"] += 1
+        entry["max_lag_ms"] = round(max(entry["max_lag_ms"], blocked_for * 1000), 1)
+        entry["last_at"] = time.time()
+        self.stalls.append({"at": time.time(), "blocked_ms": round(blocked_for * 1000, 1), "stack": stack})
+        if entry["count"] == 1:
+            # Новый виновник — в лог целиком; повторы только считаем
+            print(f"🐌 Event loop blocked {blocked_for * 1000:.0f} ms in:\n{stack}", flush=True)
+
+    def _watch(self, threshold: float):
+        captured_beat = None
+        while not self._stop.wait(threshold / 2):
+            beat = self._last_beat
+            blocked_for = time.monotonic() - beat
+            # Один снимок на эпизод: пока тикер не отметился, тот же эпизод
+            if blocked_for > threshold and beat != captured_beat:
+                captured_beat = beat
+                self._capture(blocked_for)
+
+    # ------------------------------------------------------------------
+
+    def start(self, interval: float | None = None, threshold: float | None = None):
+        if self._task is not None and not self._task.done():
+            return
+        interval = interval or settings.LOOP_MONITOR_INTERVAL
+        threshold = threshold or settings.LOOP_LAG_THRESHOLD
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._ticker(interval))
+        self._watchdog = threading.Thread(target=self._watch, args=(threshold,), name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        print(f"🩺 Loop lag monitor: tick {interval * 1000:.0f} ms, stack capture > {threshold * 1000:.0f} ms")
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    def snapshot(self) -> dict:
+        labels = [f"<={b:g}ms" if b != float("inf") else ">5000ms" for b in _BUCKETS_MS]
+        return {
+            "enabled": self._task is not None and not self._task.done(),
+            "samples": self.samples,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "histogram": dict(zip(labels, self.histogram)),
+            "stalls": len(self.stalls),
+            "top_stacks": sorted(
+                ({"stack": s, **info} for s, info in self.stacks.items()),
+                key=lambda e: e["count"], reverse=True,
+            )[:5],
+        }
+
+    def report(self) -> dict:
+        """Полный отчёт для /api/admin/loop_lag: ещё и последние эпизоды со стеками."""
+        return {**self.snapshot(), "recent_stalls": list(self.stalls)[-10:]}
+
+
+loop_monitor = LoopLagMonitor()
+metrics.register("loop_lag", loop_monitor.snapshot)
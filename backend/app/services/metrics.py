@@ -0,0 +1,26 @@
+#metrics.py
+"""
+Реестр метрик бэкенда для GET /api/metrics.
+
+Каждый сервис регистрирует функцию-снимок под своим именем:
+    metrics.register("hedging", hedge_policy.snapshot)
+и endpoint собирает всё в один JSON.
+"""
+
+from typing import Callable
+
+_collectors: dict[str, Callable[[], dict]] = {}
+
+
+def register(name: str, snapshot_fn: Callable[[], dict]):
+    _collectors[name] = snapshot_fn
+
+
+def collect() -> dict:
+    report = {}
+    for name, fn in _collectors.items():
+        try:
+            report[name] = fn()
+        except Exception as e:
+            report[name] = {"error": str(e)}
+    return report
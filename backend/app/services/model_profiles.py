@@ -0,0 +1,152 @@
+#model_profiles.py
+"""
+Профили производительности моделей, обучаемые онлайн.
+
+HardwareProfile.current_tps — одно число на весь процесс, замеренное одним промптом
+на первой попавшейся модели. Здесь же по КАЖДОЙ модели копится EWMA:
+  - decode_tps   = eval_count / eval_duration                 (генерация)
+  - prefill_tps  = prompt_eval_count / prompt_eval_duration   (обработка промпта)
+  - load_sec     = load_duration                              (загрузка в память)
+из каждого ответа Ollama (калибровка, прогрев, Шаг C).
+
+Профили переживают рестарт: DATA_DIR/model_profiles.json (атомарная запись через os.replace,
+чтобы параллельные воркеры uvicorn не оставили битый файл). record() зовётся посреди стрима
+Шага C, поэтому из event loop файл пишется в потоке (asyncio.to_thread), не чаще _SAVE_INTERVAL.
+
+«Медленная» модель (LOW POWER) — решение по её профилю (is_low_power), а не флаг на весь процесс.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+from app.config import settings
+from app.services import metrics
+
+PROFILES_PATH = os.path.join(settings.DATA_DIR, "model_profiles.json")
+
+_EWMA_ALPHA = 0.2
+_SAVE_INTERVAL = 10.0   # не пишем на диск чаще, чем раз в N секунд
+LOW_POWER_TPS = 15.0    # decode tokens/sec, ниже которого модель считается медленной
+
+
+def _ewma(old: float | None, value: float) -> float:
+    return value if old is None else old + _EWMA_ALPHA * (value - old)
+
+
+class ModelProfileStore:
+    def __init__(self, path: str = PROFILES_PATH):
+        self.path = path
+        self.profiles: dict[str, dict] = {}
+        self._saved_at = 0.0
+        self._save_task: asyncio.Task | None = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.profiles = json.load(f)
+            print(f"📈 Model profiles loaded: {len(self.profiles)} models")
+        except FileNotFoundError:
+            self.profiles = {}
+        except Exception as e:
+            print(f"⚠️ Model profiles unreadable ({e}), starting fresh")
+            self.profiles = {}
+
+    def save(self, profiles: dict | None = None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.profiles if profiles is None else profiles, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            self._saved_at = time.monotonic()
+        except Exception as e:
+            print(f"⚠️ Model profiles save failed: {e}")
+
+    def record(self, model_name: str, data: dict):
+        """Учитывает метрики из финального ответа Ollama (/api/chat done=true, /api/generate)."""
+        if not model_name:
+            return
+        profile = self.profiles.setdefault(model_name, {"samples": 0})
+        updated = False
+
+        eval_count = data.get("eval_count", 0)
+        eval_ns = data.get("eval_duration", 0)
+        if eval_count > 0 and eval_ns > 0:
+            profile["decode_tps"] = _ewma(profile.get("decode_tps"), eval_count / (eval_ns / 1e9))
+            updated = True
+
+        prompt_count = data.get("prompt_eval_count", 0)
+        prompt_ns = data.get("prompt_eval_duration", 0)
+        if prompt_count > 0 and prompt_ns > 0:
+            profile["prefill_tps"] = _ewma(profile.get("prefill_tps"), prompt_count / (prompt_ns / 1e9))
+            updated = True
+
+        # load_duration ~0, если модель уже в памяти: учитываем только реальные загрузки
+        load_ns = data.get("load_duration", 0)
+        if load_ns > 0.5e9:
+            profile["load_sec"] = _ewma(profile.get("load_sec"), load_ns / 1e9)
+            updated = True
+
+        if updated:
+            profile["samples"] += 1
+            profile["updated_at"] = time.time()
+            if time.monotonic() - self._saved_at > _SAVE_INTERVAL:
+                self._save_soon()
+
+    def _save_soon(self):
+        """Запись вне event loop: копия профилей — в поток, пока loop продолжает их обновлять."""
+        if self._save_task is not None and not self._save_task.done():
+            return
+        self._saved_at = time.monotonic()
+        profiles = {m: dict(p) for m, p in self.profiles.items()}
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (скрипты, тесты) — как раньше, сразу
+            self.save(profiles)
+            return
+        self._save_task = loop.create_task(asyncio.to_thread(self.save, profiles))
+
+    def get(self, model_name: str) -> dict:
+        return self.profiles.get(model_name, {})
+
+    def decode_tps(self, model_name: str, default: float | None = None) -> float:
+        return self.get(model_name).get("decode_tps") or default or settings.current_tps
+
+    async def flush(self):
+        """Досохраняет хвост (shutdown): дожидается фоновой записи и пишет текущие профили."""
+        if self._save_task is not None:
+            await self._save_task
+        await asyncio.to_thread(self.save, {m: dict(p) for m, p in self.profiles.items()})
+
+    def is_low_power(self, model_name: str) -> bool:
+        """Модель генерирует медленнее LOW_POWER_TPS (по её профилю; без замеров — нет)."""
+        decode_tps = self.get(model_name).get("decode_tps")
+        return decode_tps is not None and decode_tps < LOW_POWER_TPS
+
+    def prefill_tps(self, model_name: str) -> float | None:
+        return self.get(model_name).get("prefill_tps")
+
+    def estimate_timeout(self, model_name: str, input_char_len: int) -> float:
+        """HardwareProfile.estimate_timeout, но по скоростям конкретной модели."""
+        profile = self.get(model_name)
+        return settings.estimate_timeout(
+            input_char_len,
+            decode_tps=profile.get("decode_tps"),
+            prefill_tps=profile.get("prefill_tps"),
+            load_sec=profile.get("load_sec", 0.0),
+        )
+
+    def snapshot(self) -> dict:
+        return {
+            m: {**{k: (round(v, 2) if isinstance(v, float) else v) for k, v in p.items()},
+                "low_power": self.is_low_power(m)}
+            for m, p in self.profiles.items()
+        }
+
+
+model_profiles = ModelProfileStore()
+metrics.register("model_profiles", model_profiles.snapshot)
@@ -0,0 +1,207 @@
+#model_residency.py
+"""
+Менеджер резидентности моделей Ollama.
+
+Проблема: каждый клиент присылает свой `model`. Ollama выгружает одну модель,
+чтобы загрузить другую, и каждая перезагрузка — десятки секунд дискового I/O.
+Если пользователи чередуют модели, сервер занят только свопом (thrashing).
+
+Что делает менеджер:
+  1. Следит, какие модели загружены (GET /api/ps), и пишет события load/evict.
+  2. Прогревает модели из OLLAMA_WARM_MODELS при старте.
+  3. Выдаёт keep_alive для каждой модели (OLLAMA_KEEP_ALIVE / OLLAMA_KEEP_ALIVE_MODELS).
+  4. Перед Шагом C решает, можно ли грузить модель: если она не влезает в RAM
+     вместе с резидентными, а они сейчас заняты чужими запросами — запрос ждёт
+     в очереди; если модель одна больше бюджета RAM — запрос отклоняется.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+import httpx
+
+from app.config import settings
+from app.services.model_profiles import model_profiles
+from app.services.ollama_meta import ollama_meta
+
+_EVENTS_LIMIT = 200     # сколько последних событий хранить для /api/models/residency
+
+_GB = 1024 ** 3
+
+
+class ModelResidencyError(Exception):
+    """Модель нельзя загрузить без риска вытеснить чужие in-flight модели / OOM."""
+
+
+class ModelResidencyManager:
+    def __init__(self, base_url: str | None = None):
+        # У каждого узла пула Ollama свой менеджер (см. services/ollama_pool.py)
+        self.base_url = base_url
+        self.resident: dict[str, int] = {}      # model -> size (bytes) из /api/ps
+        self.loaded_ctx: dict[str, int] = {}    # model -> context_length, с которым модель загружена
+        self.disk_sizes: dict[str, int] = {}    # model -> size (bytes) из /api/tags
+        self.in_flight: dict[str, int] = {}     # model -> активных запросов Шага C
+        self.events: deque = deque(maxlen=_EVENTS_LIMIT)
+        self._changed = asyncio.Condition()
+
+    def _url(self) -> str:
+        return (self.base_url or settings.OLLAMA_BASE_URL).rstrip('/')
+
+    # ------------------------------------------------------------------
+    # keep_alive
+    # ------------------------------------------------------------------
+
+    def keep_alive_for(self, model_name: str):
+        """keep_alive для payload Ollama: персональный, иначе общий."""
+        return settings.KEEP_ALIVE_MODELS.get(model_name, settings.KEEP_ALIVE)
+
+    # ------------------------------------------------------------------
+    # Наблюдение за Ollama
+    # ------------------------------------------------------------------
+
+    def _record(self, event: str, model_name: str, **details):
+        entry = {"ts": time.time(), "event": event, "model": model_name, **details}
+        self.events.append(entry)
+        icon = {"load": "📥", "evict": "📤", "warm": "🔥", "queued": "⏳", "refused": "⛔"}.get(event, "ℹ️")
+        print(f"{icon} Residency [{event}] {model_name} @ {self._url()} {details if details else ''}".rstrip())
+
+    async def refresh(self, force: bool = False) -> dict[str, int]:
+        """Обновляет список загруженных моделей из /api/ps (кэш META_TTL_PS) и логирует load/evict."""
+        try:
+            models = (await ollama_meta.ps(self._url(), force=force)).get("models", [])
+        except Exception as e:
+            print(f"⚠️ Residency: /api/ps недоступен ({type(e).__name__})")
+            return self.resident
+
+        current = {m.get("name") or m.get("model"): int(m.get("size", 0)) for m in models}
+        for name in current.keys() - self.resident.keys():
+            self._record("load", name, size_gb=round(current[name] / _GB, 2))
+        for name in self.resident.keys() - current.keys():
+            self._record("evict", name)
+
+        self.resident = current
+        # Новые версии Ollama отдают context_length: с ним модель уже загружена (см. context_sizing)
+        self.loaded_ctx = {
+            m.get("name") or m.get("model"): int(m["context_length"])
+            for m in models if m.get("context_length")
+        }
+        return self.resident
+
+    async def _model_size(self, model_name: str) -> int:
+        """Размер модели (bytes): из /api/ps, если загружена, иначе с диска по /api/tags (кэш META_TTL_TAGS)."""
+        if model_name in self.resident:
+            return self.resident[model_name]
+        try:
+            for m in (await ollama_meta.tags(self._url())).get("models", []):
+                self.disk_sizes[m.get("name")] = int(m.get("size", 0))
+        except Exception as e:
+            print(f"⚠️ Residency: /api/tags недоступен ({type(e).__name__})")
+        return self.disk_sizes.get(model_name, 0)
+
+    def ram_budget_bytes(self) -> float:
+        """
+        Сколько RAM можно отдать под все резидентные модели узла вместе.
+        available_ram_gb (его обновляет resource_monitor) уже не включает загруженные модели —
+        их размер возвращаем в бюджет, иначе они вычитались бы дважды.
+        """
+        resident_gb = sum(self.resident.values()) / _GB
+        return (settings.available_ram_gb + resident_gb) * settings.RESIDENCY_RAM_FRACTION * _GB
+
+    def fits(self, model_name: str, size: int) -> bool:
+        """Модель уже загружена или встанет рядом с резидентными, никого не вытеснив."""
+        if model_name in self.resident:
+            return True
+        return sum(self.resident.values()) + size <= self.ram_budget_bytes()
+
+    # ------------------------------------------------------------------
+    # Прогрев
+    # ------------------------------------------------------------------
+
+    async def warm_up(self, models: list[str] | None = None):
+        """Загружает модели заранее (пустой prompt в /api/generate) с их keep_alive."""
+        ollama_url = self._url()
+        for model_name in models if models is not None else settings.WARM_MODELS:
+            payload = {"model": model_name, "prompt": "", "keep_alive": self.keep_alive_for(model_name)}
+            start = time.perf_counter()
+            try:
+                async with httpx.AsyncClient() as client:
+                    resp = await client.post(f"{ollama_url}/api/generate", json=payload, timeout=120.0)
+                resp.raise_for_status()
+                # load_duration прогрева — самый честный замер времени загрузки модели
+                model_profiles.record(model_name, resp.json())
+                self._record("warm", model_name, seconds=round(time.perf_counter() - start, 1))
+            except Exception as e:
+                print(f"⚠️ Residency: прогрев {model_name} не удался ({e})")
+        await self.refresh(force=True)
+
+    # ------------------------------------------------------------------
+    # Допуск запросов
+    # ------------------------------------------------------------------
+
+    def _busy_others(self, model_name: str) -> list[str]:
+        return [m for m, n in self.in_flight.items() if n > 0 and m != model_name]
+
+    async def loadable(self, model_name: str) -> bool:
+        """acquire() пустит запрос без очереди: модель влезает в бюджет и никого занятого не вытеснит."""
+        size = await self._model_size(model_name)
+        if model_name not in self.resident and size > self.ram_budget_bytes():
+            return False
+        return self.fits(model_name, size) or not self._busy_others(model_name)
+
+    async def acquire(self, model_name: str):
+        """
+        Регистрирует запрос Шага C к модели.
+        Ждёт в очереди, если загрузка вытеснит модели, которые сейчас отвечают другим.
+        Бросает ModelResidencyError, если модель не влезает в RAM в принципе
+        или очередь не рассосалась за RESIDENCY_QUEUE_TIMEOUT.
+        """
+        await self.refresh()
+        budget = self.ram_budget_bytes()
+        size = await self._model_size(model_name)
+
+        if model_name not in self.resident and size > budget:
+            self._record("refused", model_name, size_gb=round(size / _GB, 2), budget_gb=round(budget / _GB, 2))
+            raise ModelResidencyError(
+                f"Model {model_name} ({size / _GB:.1f} GB) does not fit into RAM budget ({budget / _GB:.1f} GB)"
+            )
+
+        deadline = time.monotonic() + settings.RESIDENCY_QUEUE_TIMEOUT
+        queued = False
+        async with self._changed:
+            while True:
+                await self.refresh()
+                busy = self._busy_others(model_name)
+                if self.fits(model_name, size) or not busy:
+                    break
+
+                if not queued:
+                    self._record("queued", model_name, waiting_for=busy)
+                    queued = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._record("refused", model_name, reason="queue timeout")
+                    raise ModelResidencyError(
+                        f"Model {model_name} would evict busy models {busy}; queue timeout"
+                    )
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=min(remaining, settings.META_TTL_PS))
+                except asyncio.TimeoutError:
+                    pass
+
+            self.in_flight[model_name] = self.in_flight.get(model_name, 0) + 1
+
+    async def release(self, model_name: str):
+        async with self._changed:
+            self.in_flight[model_name] = max(0, self.in_flight.get(model_name, 0) - 1)
+            self._changed.notify_all()
+
+    def snapshot(self) -> dict:
+        return {
+            "resident": {m: round(s / _GB, 2) for m, s in self.resident.items()},
+            "in_flight": {m: n for m, n in self.in_flight.items() if n},
+            "ram_budget_gb": round(self.ram_budget_bytes() / _GB, 2),
+            "keep_alive_default": settings.KEEP_ALIVE,
+            "keep_alive_models": settings.KEEP_ALIVE_MODELS,
+            "events": list(self.events),
+        }
@@ -0,0 +1,208 @@
+#model_router.py
+"""
+Алиас модели "auto": самая быстрая модель, точность которой не ниже порога.
+
+Пользователи выбирают модель по имени и почти всегда берут самую большую. При этом
+tests/test_formatting_quality.py уже меряет по каждой модели точность (avg_overall)
+и время на документ. Здесь:
+  - leaderboard контеста загружается в бэкенд (POST /api/models/leaderboard,
+    `test_formatting_quality.py --publish`) и переживает рестарт: DATA_DIR/model_leaderboard.json;
+  - кандидаты "auto" — модели leaderboard с avg_overall >= ROUTER_ACCURACY_FLOOR,
+    которые есть на живом узле пула;
+  - стоимость — секунды на абзац: наблюдаемая онлайн латентность Шага C
+    (batch_planner, EWMA по модели), а до первых замеров — время контеста / число абзацев;
+    плюс load_sec из профиля модели, если она не загружена в Ollama;
+  - модель, которая не влезет в RAM или вытеснит занятые модели (model_residency),
+    пропускается: берётся следующая по скорости;
+  - никто не прошёл порог — самая точная из доступных, потом ROUTER_FALLBACK_MODEL.
+
+Решения и их причины — в /api/metrics ("model_router") и GET /api/models/router.
+"""
+
+import json
+import os
+import time
+from collections import Counter
+
+from app.config import settings
+from app.services import metrics
+from app.services.batch_planner import batch_planner
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+
+AUTO_MODEL = "auto"
+LEADERBOARD_PATH = os.path.join(settings.DATA_DIR, "model_leaderboard.json")
+
+# Стоимость считается для батча такого размера: загрузка модели размазывается по нему
+REFERENCE_PARAGRAPHS = 20
+# Модель не загружена и профиль ещё не видел её загрузки
+DEFAULT_LOAD_SEC = 10.0
+
+
+def is_auto(model_name: str) -> bool:
+    return model_name == AUTO_MODEL
+
+
+def _is_plain_run(label: str) -> bool:
+    """Прогоны каскада ('a→b') и сжатого промпта ('m [compact]') — не отдельные модели."""
+    return bool(label) and "→" not in label and not label.endswith("]") and not is_auto(label)
+
+
+class ModelRouter:
+    def __init__(self, path: str = LEADERBOARD_PATH):
+        self.path = path
+        self.leaderboard: dict[str, dict] = {}   # model -> {accuracy, sec_per_paragraph, files_ok}
+        self.ingested_at: float | None = None
+        self.decisions: Counter = Counter()      # выбранная модель -> сколько раз
+        self.last_decision: dict | None = None
+        self.load()
+
+    # ------------------------------------------------------------------
+    # Leaderboard
+    # ------------------------------------------------------------------
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            self.leaderboard = stored.get("models", {})
+            self.ingested_at = stored.get("ingested_at")
+            print(f"🧭 Model leaderboard loaded: {len(self.leaderboard)} models")
+        except FileNotFoundError:
+            self.leaderboard = {}
+        except Exception as e:
+            print(f"⚠️ Model leaderboard unreadable ({e}), starting empty")
+            self.leaderboard = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"ingested_at": self.ingested_at, "models": self.leaderboard}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"⚠️ Model leaderboard save failed: {e}")
+
+    def ingest(self, report: dict) -> dict[str, dict]:
+        """
+        Принимает JSON контеста ({"leaderboard": [{"model", "avg_overall", "avg_time_sec",
+        "avg_elements", "files_ok", ...}]}). Модели без успешных прогонов пропускаются,
+        модели из прошлых контестов, которых нет в этом, остаются.
+        """
+        rows = report.get("leaderboard")
+        if not isinstance(rows, list):
+            raise ValueError("report must contain a 'leaderboard' list")
+
+        accepted = {}
+        for row in rows:
+            label = row.get("model", "")
+            if not _is_plain_run(label) or not row.get("files_ok"):
+                continue
+            elements = row.get("avg_elements") or 0
+            seconds = row.get("avg_time_sec") or 0
+            accepted[label] = {
+                "accuracy": float(row.get("avg_overall", 0)),
+                "sec_per_paragraph": round(seconds / elements, 4) if elements and seconds else None,
+                "files_ok": int(row["files_ok"]),
+            }
+        self.leaderboard.update(accepted)
+        self.ingested_at = time.time()
+        self.save()
+        print(f"🧭 Model leaderboard: +{len(accepted)} models ({len(self.leaderboard)} total)")
+        return accepted
+
+    # ------------------------------------------------------------------
+    # Стоимость и доступность
+    # ------------------------------------------------------------------
+
+    def sec_per_paragraph(self, model_name: str) -> float | None:
+        """Онлайн-замер Шага C, если он есть, иначе — оффлайн из контеста."""
+        observed = batch_planner.sec_per_paragraph.get(model_name)
+        if observed:
+            return observed
+        return self.leaderboard.get(model_name, {}).get("sec_per_paragraph")
+
+    async def _availability(self, model_name: str) -> tuple[bool, bool]:
+        """(resident, loadable): загружена ли модель на каком-то живом узле и можно ли её загрузить без очереди."""
+        loadable = False
+        for node in ollama_pool.nodes:
+            if not node.healthy or model_name not in node.models:
+                continue
+            residency = node.residency
+            await residency.refresh()
+            if model_name in residency.resident:
+                return True, True
+            if await residency.loadable(model_name):
+                loadable = True
+        return False, loadable
+
+    # ------------------------------------------------------------------
+    # Выбор
+    # ------------------------------------------------------------------
+
+    async def route(self) -> tuple[str, str]:
+        """Модель для алиаса "auto" и причина выбора (для meta-записи и метрик)."""
+        floor = settings.ROUTER_ACCURACY_FLOOR
+        # Узлы, на которых ещё не было health-пробы, не знают своих моделей
+        for node in ollama_pool.nodes:
+            if node.healthy and not node.models:
+                await ollama_pool.probe(node)
+
+        options = []   # (cost, model, resident)
+        available = []
+        for model_name, entry in self.leaderboard.items():
+            resident, loadable = await self._availability(model_name)
+            if not loadable:
+                continue
+            available.append(model_name)
+            per_paragraph = self.sec_per_paragraph(model_name)
+            if entry["accuracy"] < floor or per_paragraph is None:
+                continue
+            cost = per_paragraph * REFERENCE_PARAGRAPHS
+            if not resident:
+                cost += model_profiles.get(model_name).get("load_sec", DEFAULT_LOAD_SEC)
+            options.append((cost, model_name, resident))
+
+        if options:
+            cost, model_name, resident = min(options)
+            reason = (
+                f"fastest with accuracy >= {floor:g}: ~{cost:.1f}s per {REFERENCE_PARAGRAPHS} paragraphs"
+                f"{'' if resident else ' incl. load'}"
+            )
+        elif available:
+            model_name = max(available, key=lambda m: self.leaderboard[m]["accuracy"])
+            reason = f"no model meets accuracy {floor:g}; most accurate available"
+        else:
+            installed = sorted({m for n in ollama_pool.nodes if n.healthy for m in n.models})
+            model_name = settings.ROUTER_FALLBACK_MODEL or (installed[0] if installed else "")
+            reason = "no leaderboard model available; fallback"
+
+        self.decisions[model_name] += 1
+        self.last_decision = {"model": model_name, "reason": reason, "at": time.time()}
+        print(f"🧭 auto → {model_name or '?'} ({reason})")
+        return model_name, reason
+
+    async def resolve(self, model_name: str) -> tuple[str, str | None]:
+        """Имя модели из запроса → реальная модель; для не-"auto" — без изменений."""
+        if not is_auto(model_name):
+            return model_name, None
+        return await self.route()
+
+    def snapshot(self) -> dict:
+        return {
+            "accuracy_floor": settings.ROUTER_ACCURACY_FLOOR,
+            "fallback_model": settings.ROUTER_FALLBACK_MODEL,
+            "leaderboard": {
+                m: {**e, "online_sec_per_paragraph": round(batch_planner.sec_per_paragraph[m], 3)
+                    if m in batch_planner.sec_per_paragraph else None}
+                for m, e in self.leaderboard.items()
+            },
+            "ingested_at": self.ingested_at,
+            "decisions": dict(self.decisions),
+            "last_decision": self.last_decision,
+        }
+
+
+model_router = ModelRouter()
+metrics.register("model_router", model_router.snapshot)
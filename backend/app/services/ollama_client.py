@@ -3,21 +3,17 @@ import httpx
 import json
 from typing import AsyncGenerator
 
+from app.services.ollama_meta import ollama_meta
+
 # Больше никакого хардкода OLLAMA_URL здесь!
 
 async def get_tags(base_url: str):
-    """Получить список моделей с указанного адреса"""
-    # Защита от дублирования слешей
-    clean_url = base_url.rstrip('/')
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            print(f"Proxying tags request to: {clean_url}/api/tags")
-            resp = await client.get(f"{clean_url}/api/tags", timeout=5.0)
-            return resp.json()
-        except Exception as e:
-            print(f"Ollama connection error ({clean_url}): {e}")
-            return {"models": []}
+    """Получить список моделей с указанного адреса (через кэш метаданных ollama_meta)"""
+    try:
+        return await ollama_meta.tags(base_url)
+    except Exception as e:
+        print(f"Ollama connection error ({base_url.rstrip('/')}): {e}")
+        return {"models": []}
 
 async def stream_completion(base_url: str, data: dict) -> AsyncGenerator[bytes, None]:
     """
@@ -35,4 +31,19 @@ async def stream_completion(base_url: str, data: dict) -> AsyncGenerator[bytes,
                     yield chunk
         except Exception as e:
             # Возвращаем ошибку в поток, чтобы клиент увидел её
-            yield json.dumps({"error": str(e)}).encode()
\ No newline at end of file
+            yield json.dumps({"error": str(e)}).encode()
+
+async def stream_chat(base_url: str, payload: dict, timeout: float = 600.0) -> AsyncGenerator[dict, None]:
+    """
+    Стримит /api/chat и отдаёт распарсенные NDJSON-чанки Ollama.
+    Соединение открывается только при первой итерации — поэтому генератор
+    удобно оборачивать в streaming.with_heartbeats (heartbeat идёт и во время connect/prefill).
+    """
+    clean_url = base_url.rstrip('/')
+    async with httpx.AsyncClient() as client:
+        async with client.stream("POST", f"{clean_url}/api/chat", json=payload, timeout=timeout) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                yield json.loads(line)
@@ -0,0 +1,173 @@
+#ollama_meta.py
+"""
+Кэш метаданных Ollama: /api/tags, /api/show, /api/ps.
+
+Раньше каждый вызывал их сам: /api/tags — на каждый CheckConn клиента и каждую
+health-пробу, /api/show — один раз навсегда (llm_checker._ctx_cache), и после
+`ollama pull` модели с другим context_length бюджет оставался старым.
+
+Здесь один слой на все три эндпоинта:
+  - свой TTL у каждого (META_TTL_TAGS / META_TTL_SHOW / META_TTL_PS);
+  - stale-while-revalidate: ещё один TTL после истечения отдаём старое значение
+    и обновляем его фоновым запросом; дальше — синхронный запрос;
+  - одновременные промахи по одному ключу делят один HTTP-запрос;
+  - неудачное обновление выкидывает запись: мёртвый узел не «оживает» из кэша;
+  - digest моделей из /api/tags: модель перекачали/пересобрали или удалили —
+    сбрасываем её /api/show и зовём подписчиков (бюджеты контекста, кэши токенов).
+"""
+
+import asyncio
+import time
+from typing import Callable
+
+import httpx
+
+from app.config import settings
+from app.services import metrics
+
+_TIMEOUTS = {"tags": 5.0, "show": 10.0, "ps": 5.0}
+
+
+class OllamaMetaCache:
+    def __init__(self):
+        self.entries: dict[tuple[str, str, str], tuple[float, dict]] = {}   # (endpoint, url, model) -> (fetched_at, value)
+        self.digests: dict[str, dict[str, str]] = {}                        # url -> {model: digest}
+        self._inflight: dict[tuple[str, str, str], asyncio.Task] = {}
+        self._listeners: list[Callable[[str], None]] = []
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.requests = 0
+        self.errors = 0
+        self.digest_changes = 0
+
+    def _ttl(self, endpoint: str) -> float:
+        return {
+            "tags": settings.META_TTL_TAGS,
+            "show": settings.META_TTL_SHOW,
+            "ps": settings.META_TTL_PS,
+        }[endpoint]
+
+    # ------------------------------------------------------------------
+    # Подписка на смену модели
+    # ------------------------------------------------------------------
+
+    def on_model_changed(self, callback: Callable[[str, str], None]):
+        """callback(model_name, url) — модель на узле url перекачали или удалили, её производные кэши устарели."""
+        self._listeners.append(callback)
+
+    def model_changed(self, url: str, model_name: str):
+        self.digest_changes += 1
+        self.entries.pop(("show", url, model_name), None)
+        print(f"🔄 Ollama meta: {model_name} @ {url} изменилась — сбрасываем её кэши")
+        for callback in self._listeners:
+            try:
+                callback(model_name, url)
+            except Exception as e:
+                print(f"⚠️ Ollama meta: подписчик упал ({e})")
+
+    def _track_digests(self, url: str, tags: dict):
+        current = {
+            m.get("name"): m.get("digest", "")
+            for m in tags.get("models", []) if m.get("name")
+        }
+        previous = self.digests.get(url)
+        self.digests[url] = current
+        if previous is None:
+            return
+        for name, digest in previous.items():
+            if current.get(name) != digest:
+                self.model_changed(url, name)
+
+    # ------------------------------------------------------------------
+    # Запросы
+    # ------------------------------------------------------------------
+
+    async def _request(self, endpoint: str, url: str, model_name: str) -> dict:
+        self.requests += 1
+        async with httpx.AsyncClient() as client:
+            if endpoint == "show":
+                resp = await client.post(f"{url}/api/show", json={"name": model_name}, timeout=_TIMEOUTS[endpoint])
+            else:
+                resp = await client.get(f"{url}/api/{endpoint}", timeout=_TIMEOUTS[endpoint])
+        resp.raise_for_status()
+        return resp.json()
+
+    async def _fetch(self, key: tuple[str, str, str]) -> dict:
+        endpoint, url, model_name = key
+        try:
+            value = await self._request(endpoint, url, model_name)
+        except Exception:
+            self.errors += 1
+            self.entries.pop(key, None)
+            raise
+        self.entries[key] = (time.monotonic(), value)
+        if endpoint == "tags":
+            self._track_digests(url, value)
+        return value
+
+    def _fetch_shared(self, key: tuple[str, str, str]) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key))
+            self._inflight[key] = task
+
+            def _done(t: asyncio.Task):
+                if self._inflight.get(key) is t:
+                    del self._inflight[key]
+                # Ошибку фонового обновления никто не ждёт — забираем, чтобы asyncio не ругался
+                if not t.cancelled():
+                    t.exception()
+
+            task.add_done_callback(_done)
+        return task
+
+    async def get(self, endpoint: str, url: str, model_name: str = "", force: bool = False) -> dict:
+        """Ответ эндпоинта из кэша; force=True — всегда свежий (health-проба, явный refresh)."""
+        key = (endpoint, url.rstrip('/'), model_name)
+        cached = self.entries.get(key)
+        if cached is not None and not force:
+            fetched_at, value = cached
+            age = time.monotonic() - fetched_at
+            ttl = self._ttl(endpoint)
+            if age < ttl:
+                self.hits += 1
+                return value
+            if age < 2 * ttl:
+                self.stale_hits += 1
+                self._fetch_shared(key)
+                return value
+        self.misses += 1
+        # shield: отменённый клиент не отменяет общий запрос для остальных
+        return await asyncio.shield(self._fetch_shared(key))
+
+    async def tags(self, url: str, force: bool = False) -> dict:
+        return await self.get("tags", url, force=force)
+
+    async def show(self, url: str, model_name: str, force: bool = False) -> dict:
+        return await self.get("show", url, model_name, force=force)
+
+    async def ps(self, url: str, force: bool = False) -> dict:
+        return await self.get("ps", url, force=force)
+
+    def invalidate(self, url: str | None = None):
+        """Сбрасывает записи узла (или все): следующий запрос пойдёт в Ollama."""
+        for key in list(self.entries):
+            if url is None or key[1] == url.rstrip('/'):
+                del self.entries[key]
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+            "stale_hits": self.stale_hits,
+            "requests": self.requests,
+            "errors": self.errors,
+            "digest_changes": self.digest_changes,
+            "ttl_sec": {e: self._ttl(e) for e in ("tags", "show", "ps")},
+        }
+
+
+ollama_meta = OllamaMetaCache()
+metrics.register("ollama_meta", ollama_meta.snapshot)
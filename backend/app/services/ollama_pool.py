@@ -0,0 +1,223 @@
+#ollama_pool.py
+"""
+Пул узлов Ollama: health-пробы, замер скорости по узлам и маршрутизация.
+
+Один OLLAMA_BASE_URL ограничивает пропускную способность одним хостом.
+Пул берёт список из OLLAMA_BASE_URLS и для каждого узла хранит:
+  - healthy / список моделей (проба — GET /api/tags, раз в OLLAMA_HEALTH_INTERVAL)
+  - токены в работе (outstanding) и EWMA латентности запросов
+  - tokens/sec по моделям (как в calibrate_ollama: eval_count / eval_duration)
+  - свой ModelResidencyManager
+
+Маршрутизация /api/chat и /api/show:
+  - sticky: запросы одной сессии документа идут на тот же узел (KV-cache reuse)
+  - иначе OLLAMA_ROUTING = least_tokens | least_latency
+  - узлы с открытым circuit breaker модели — только если других нет
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from app.config import settings
+from app.services.calibration import measure_tps
+from app.services.circuit_breaker import circuit_breakers
+from app.services.model_residency import ModelResidencyManager
+from app.services.model_profiles import LOW_POWER_TPS
+from app.services.ollama_meta import ollama_meta
+
+_EWMA_ALPHA = 0.3
+
+
+def _ewma(old: float | None, value: float) -> float:
+    return value if old is None else old + _EWMA_ALPHA * (value - old)
+
+
+class OllamaNode:
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.healthy = True          # оптимистично до первой пробы
+        self.models: set[str] = set()
+        self.outstanding_tokens = 0
+        self.in_flight = 0
+        self.latency_ewma: float | None = None
+        self.model_tps: dict[str, float] = {}
+        self.last_error: str | None = None
+        self.last_probe_at = 0.0
+        self.residency = ModelResidencyManager(self.url)
+
+    def has_model(self, model_name: str) -> bool:
+        # Список моделей ещё не известен — не отбрасываем узел
+        return not self.models or model_name in self.models
+
+    def tps_for(self, model_name: str) -> float:
+        return self.model_tps.get(model_name, settings.current_tps)
+
+    def snapshot(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "models": sorted(self.models),
+            "outstanding_tokens": self.outstanding_tokens,
+            "in_flight": self.in_flight,
+            "latency_ewma_sec": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "model_tps": {m: round(t, 2) for m, t in self.model_tps.items()},
+            "last_error": self.last_error,
+        }
+
+
+class OllamaPool:
+    def __init__(self, urls: list[str]):
+        self.nodes: list[OllamaNode] = []
+        self.sessions: dict[str, tuple[str, float]] = {}   # session_id -> (url, last_used)
+        self._health_task: asyncio.Task | None = None
+        self.configure(urls)
+
+    def configure(self, urls: list[str]):
+        """(Пере)задаёт список узлов. Используется при старте и в тестах."""
+        self.nodes = [OllamaNode(u) for u in urls]
+        self.sessions.clear()
+
+    @property
+    def primary(self) -> OllamaNode:
+        return self.nodes[0]
+
+    def get(self, url: str) -> OllamaNode | None:
+        url = url.rstrip('/')
+        return next((n for n in self.nodes if n.url == url), None)
+
+    # ------------------------------------------------------------------
+    # Health
+    # ------------------------------------------------------------------
+
+    async def probe(self, node: OllamaNode):
+        """
+        GET /api/tags: жив ли узел и какие модели на нём есть.
+        Всегда мимо TTL — проба заодно обновляет кэш ollama_meta и ловит смену digest моделей.
+        """
+        try:
+            tags = await ollama_meta.tags(node.url, force=True)
+            node.models = {m.get("name") for m in tags.get("models", []) if m.get("name")}
+            if not node.healthy:
+                print(f"💚 Ollama node is back: {node.url}")
+            node.healthy = True
+            node.last_error = None
+        except Exception as e:
+            if node.healthy:
+                print(f"💔 Ollama node is down: {node.url} ({type(e).__name__})")
+            node.healthy = False
+            node.last_error = f"{type(e).__name__}: {e}"
+        node.last_probe_at = time.time()
+
+    async def health_check(self):
+        await asyncio.gather(*(self.probe(n) for n in self.nodes))
+
+    async def _health_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.health_check()
+
+    def start_health_loop(self, interval: float | None = None):
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(
+                self._health_loop(interval or settings.OLLAMA_HEALTH_INTERVAL)
+            )
+
+    # ------------------------------------------------------------------
+    # Скорость
+    # ------------------------------------------------------------------
+
+    async def calibrate_all(self, model: str = ""):
+        """
+        Замеряет tokens/sec на каждом живом узле. Скорость по умолчанию (для моделей без профиля) —
+        по самому быстрому; медленный узел/модель режим всего процесса не меняет.
+        """
+        best_tps = None
+        for node in self.nodes:
+            if not node.healthy:
+                continue
+            measured = await measure_tps(node.url, model)
+            if measured:
+                model_name, tps = measured
+                node.model_tps[model_name] = tps
+                slow = " 🐢 low power" if tps < LOW_POWER_TPS else ""
+                print(f"📊 {node.url} [{model_name}]: {tps:.2f} tokens/sec{slow}")
+                best_tps = tps if best_tps is None else max(best_tps, tps)
+        if best_tps is not None:
+            settings.update_from_benchmark(best_tps)
+
+    def record_eval(self, node: OllamaNode, model_name: str, data: dict):
+        """Обновляет tokens/sec узла по финальному чанку Ollama (done=true)."""
+        eval_count = data.get("eval_count", 0)
+        eval_duration_ns = data.get("eval_duration", 0)
+        if eval_count > 0 and eval_duration_ns > 0:
+            tps = eval_count / (eval_duration_ns / 1e9)
+            node.model_tps[model_name] = _ewma(node.model_tps.get(model_name), tps)
+
+    # ------------------------------------------------------------------
+    # Маршрутизация
+    # ------------------------------------------------------------------
+
+    def candidates(self, model_name: str) -> list[OllamaNode]:
+        healthy = [n for n in self.nodes if n.healthy and n.has_model(model_name)]
+        # Узлы, где breaker этой модели открыт, — только если других нет (services/circuit_breaker.py)
+        closed = [n for n in healthy if not circuit_breakers.is_open(n.url, model_name)]
+        if closed:
+            return closed
+        if healthy:
+            return healthy
+        # Все узлы «мертвы» по последней пробе — всё равно пробуем, вдруг ожили
+        return [n for n in self.nodes if n.has_model(model_name)] or self.nodes
+
+    def pick(self, model_name: str, session_id: str | None = None) -> OllamaNode:
+        """Выбирает узел для запроса к модели."""
+        now = time.time()
+        candidates = self.candidates(model_name)
+
+        if session_id and session_id in self.sessions:
+            url, last_used = self.sessions[session_id]
+            node = self.get(url)
+            if node in candidates and now - last_used < settings.SESSION_STICKY_TTL:
+                self.sessions[session_id] = (url, now)
+                return node
+
+        if settings.OLLAMA_ROUTING == "least_latency":
+            # Узлы без замеров пробуем первыми, чтобы получить хоть одну оценку
+            node = min(candidates, key=lambda n: (
+                n.latency_ewma if n.latency_ewma is not None else 0.0,
+                n.outstanding_tokens,
+            ))
+        else:
+            # Нормируем на скорость: 1000 токенов на быстром узле «легче», чем на медленном
+            node = min(candidates, key=lambda n: (n.outstanding_tokens / max(n.tps_for(model_name), 0.1), n.in_flight))
+
+        if session_id:
+            self.sessions[session_id] = (node.url, now)
+            # Чистим протухшие сессии, чтобы словарь не рос бесконечно
+            for sid, (_, used) in list(self.sessions.items()):
+                if now - used >= settings.SESSION_STICKY_TTL:
+                    del self.sessions[sid]
+        return node
+
+    @asynccontextmanager
+    async def track(self, node: OllamaNode, estimated_tokens: int):
+        """Учитывает запрос в нагрузке узла и обновляет EWMA латентности."""
+        node.outstanding_tokens += estimated_tokens
+        node.in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield node
+        finally:
+            node.outstanding_tokens -= estimated_tokens
+            node.in_flight -= 1
+            node.latency_ewma = _ewma(node.latency_ewma, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        return {
+            "routing": settings.OLLAMA_ROUTING,
+            "nodes": [n.snapshot() for n in self.nodes],
+            "sticky_sessions": len(self.sessions),
+        }
+
+
+ollama_pool = OllamaPool(settings.OLLAMA_BASE_URLS)
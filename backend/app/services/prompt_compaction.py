@@ -0,0 +1,110 @@
+#prompt_compaction.py
+"""
+Сжатие промпта Шага C: вместо полного абзаца — его начало и короткая сводка признаков.
+
+Для выбора стиля почти никогда не нужны 3-е–20-е предложения длинного абзаца
+основного текста, а каждый входной токен на CPU — это время prefill. В режиме
+сжатия строка промпта выглядит так:
+    [12] Исполнитель обязуется оказать услуги в срок, установленный… {len=long case=mixed list=none pos=12/340}
+  - голова абзаца — не длиннее PROMPT_COMPACT_CHARS символов (по границе слова),
+    лимит по моделям — PROMPT_COMPACT_CHARS_MODELS ("gemma3:12b=300,qwen3:0.6b=120");
+  - признаки берутся из text_features (уже посчитаны для Шага A): корзина длины,
+    регистр, нумерация, позиция абзаца в документе (id из document_size абзацев).
+
+Включается PROMPT_COMPACTION (или полем "prompt_compaction" в запросе).
+Символы до/после и prompt_eval_count Ollama по обоим режимам — в /api/metrics ("prompt_compaction").
+"""
+
+from app.config import settings
+from app.services import metrics
+from app.services.text_features import TextFeatures
+
+ELLIPSIS = "…"
+_LENGTH_BUCKETS = ((80, "short"), (400, "medium"))
+
+# Дописывается к system-промпту: модель должна понимать формат сжатых строк
+SYSTEM_HINT = (
+    "Each line is: [ID] beginning of the paragraph (… marks a cut) {features}.\n"
+    "Features: len=short|medium|long (full length), case=upper|title|lower|mixed, "
+    "list=num|bullet|none (numbering prefix), pos=paragraph index/total paragraphs in the document.\n"
+)
+
+
+def head_chars_for(model_name: str) -> int:
+    """Лимит головы абзаца для модели (0 — без обрезки, только признаки)."""
+    return settings.PROMPT_COMPACT_CHARS_MODELS.get(model_name, settings.PROMPT_COMPACT_CHARS)
+
+
+def length_bucket(length: int) -> str:
+    for limit, name in _LENGTH_BUCKETS:
+        if length < limit:
+            return name
+    return "long"
+
+
+def casing(features: TextFeatures) -> str:
+    if features.is_upper:
+        return "upper"
+    letters = [c for c in features.text if c.isalpha()]
+    if not letters:
+        return "mixed"
+    if all(c.islower() for c in letters):
+        return "lower"
+    if letters[0].isupper() and all(c.islower() for c in letters[1:]):
+        return "title"
+    return "mixed"
+
+
+def truncate(text: str, limit: int) -> str:
+    """Начало текста не длиннее limit символов, по границе слова; обрезка помечается «…»."""
+    if limit <= 0 or len(text) <= limit:
+        return text
+    head = text[:limit]
+    cut = head.rfind(" ")
+    if cut > limit // 2:
+        head = head[:cut]
+    return head.rstrip(" .,;:") + ELLIPSIS
+
+
+def prompt_line(pid: int, features: TextFeatures, head_chars: int, document_size: int | None = None) -> str:
+    position = f"{pid}/{document_size}" if document_size else str(pid)
+    suffix = (
+        f"{{len={length_bucket(features.length)} case={casing(features)} "
+        f"list={features.list_prefix or 'none'} pos={position}}}"
+    )
+    return f"[{pid}] {truncate(features.text, head_chars)} {suffix}"
+
+
+class CompactionStats:
+    def __init__(self):
+        # mode ("compact" | "full") -> счётчики; full — для сравнения в том же /api/metrics
+        self.modes: dict[str, dict[str, int]] = {}
+
+    def _mode(self, compact: bool) -> dict[str, int]:
+        return self.modes.setdefault("compact" if compact else "full", {
+            "requests": 0, "lines": 0, "chars_full": 0, "chars_sent": 0, "truncated": 0, "prompt_tokens": 0,
+        })
+
+    def record(self, compact: bool, lines: int, chars_full: int, chars_sent: int, truncated: int = 0):
+        s = self._mode(compact)
+        s["requests"] += 1
+        s["lines"] += lines
+        s["chars_full"] += chars_full
+        s["chars_sent"] += chars_sent
+        s["truncated"] += truncated
+
+    def record_prompt_tokens(self, compact: bool, tokens: int):
+        """prompt_eval_count из финального чанка Ollama (без префикса из KV-кэша)."""
+        self._mode(compact)["prompt_tokens"] += tokens
+
+    def snapshot(self) -> dict:
+        report = {}
+        for mode, s in self.modes.items():
+            report[mode] = dict(s)
+            if s.get("chars_full"):
+                report[mode]["chars_saved_pct"] = round((1 - s["chars_sent"] / s["chars_full"]) * 100, 1)
+        return report
+
+
+compaction_stats = CompactionStats()
+metrics.register("prompt_compaction", compaction_stats.snapshot)
@@ -0,0 +1,97 @@
+#rag_async.py
+"""
+Асинхронный фасад над RagEngine: эмбеддинги и запросы к Chroma — в отдельном пуле потоков.
+
+proxy_completions — async, а search_style_reference / search_batch_fast_track синхронные:
+SentenceTransformer и SQLite/HNSW Chroma крутились прямо в потоке event loop, и пока шёл
+поиск, стояли все остальные запросы, heartbeat'ы стримов и /api/tags.
+
+Здесь:
+  - выделенный ThreadPoolExecutor на RAG_WORKERS потоков (по умолчанию от physical_cores):
+    поиск не конкурирует с потоками anyio/to_thread и не раздувается без предела
+  - методы берутся у rag_engine в момент вызова (тесты подменяют их MagicMock'ами)
+  - очередь/время ожидания/выполнения — в /api/metrics ("rag"); счётчики меняются
+    из потоков пула, поэтому под threading.Lock
+
+Индексация (/api/ingest) остаётся в asyncio.to_thread под FileLock: она долгая
+и не должна занимать потоки поиска.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import settings
+from app.services import metrics
+from app.services.rag_engine import rag_engine
+
+
+class AsyncRag:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+        self.wait_max = 0.0
+
+    async def _run(self, method: str, *args, **kwargs):
+        fn = getattr(rag_engine, method)
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+
+        def _call():
+            started = time.perf_counter()
+            wait = started - submitted
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.run_total += time.perf_counter() - started
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _call)
+
+    async def search_style_reference(self, query_text: str):
+        return await self._run("search_style_reference", query_text)
+
+    async def search_style_reference_batch(self, query_texts: list[str]) -> list:
+        return await self._run("search_style_reference_batch", query_texts)
+
+    async def search_batch_fast_track(self, texts: list[str], fast_track_distance: float = 0.20) -> dict:
+        return await self._run("search_batch_fast_track", texts, fast_track_distance=fast_track_distance)
+
+    async def search_batch_nearest(self, texts: list[str]) -> dict:
+        return await self._run("search_batch_nearest", texts)
+
+    async def search(self, query_text: str, n_results: int = 5):
+        return await self._run("search", query_text, n_results=n_results)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            done = self.completed or 1
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "avg_wait_ms": round(self.wait_total / done * 1000, 1),
+                "max_wait_ms": round(self.wait_max * 1000, 1),
+                "avg_run_ms": round(self.run_total / done * 1000, 1),
+            }
+
+
+async_rag = AsyncRag(settings.RAG_WORKERS)
+metrics.register("rag", async_rag.snapshot)
@@ -131,18 +131,37 @@ class RagEngine:
         # Находим ЛУЧШИЕ чанки (K=3)
         # 3 чанка * 500 токенов = 1500 токенов максимум (идеально ложится в лимит)
         K = min(getattr(settings, 'RAG_CHUNK_LIMIT', 3), 5)
-        MAX_DIST = getattr(settings, 'RAG_MAX_DISTANCE', 1.5) # Порог отсечения мусора
-        
         results = self.collection.query(query_texts=[query_text], n_results=K)
         if not results['metadatas'] or not results['metadatas'][0]:
             return None
-            
+        return self._style_reference(results['metadatas'][0], results.get('distances', [[0]*K])[0])
+
+    def search_style_reference_batch(self, query_texts: list[str]) -> list:
+        """
+        search_style_reference для многих запросов: один вызов эмбеддера и один запрос к ChromaDB.
+        Результаты — в порядке query_texts (None — эталон не найден).
+        """
+        if not query_texts:
+            return []
+        K = min(getattr(settings, 'RAG_CHUNK_LIMIT', 3), 5)
+        results = self.collection.query(query_texts=query_texts, n_results=K)
+        metadatas_matrix = results.get('metadatas') or []
+        distances_matrix = results.get('distances') or []
+        references = []
+        for idx in range(len(query_texts)):
+            metas = metadatas_matrix[idx] if idx < len(metadatas_matrix) else []
+            distances = distances_matrix[idx] if idx < len(distances_matrix) else [0] * len(metas)
+            references.append(self._style_reference(metas, distances) if metas else None)
+        return references
+
+    def _style_reference(self, metadatas: list[dict], distances: list[float]):
+        """Палитра стилей из найденных чанков одного запроса (дальше RAG_MAX_DISTANCE — мусор)."""
+        MAX_DIST = getattr(settings, 'RAG_MAX_DISTANCE', 1.5) # Порог отсечения мусора
+
         valid_metas = []
-        distances = results.get('distances', [[0]*K])[0]
-        
         for idx, dist in enumerate(distances):
             if dist <= MAX_DIST:
-                valid_metas.append(results['metadatas'][0][idx])
+                valid_metas.append(metadatas[idx])
             else:
                 print(f"🔸 RAG Chunk Rejected: Distance {dist:.2f} > Threshold {MAX_DIST}")
                 
@@ -224,6 +243,19 @@ class RagEngine:
         Returns:
             {batch_idx: style_name} — только для параграфов с высокой уверенностью.
         """
+        fast_track_hits: dict[int, str] = {}
+        for batch_idx, (style_name, dist) in self.search_batch_nearest(texts).items():
+            if dist <= fast_track_distance:
+                fast_track_hits[batch_idx] = style_name
+                print(f"  ⚡ Vector FastTrack[{batch_idx}]: dist={dist:.3f} → '{style_name}'")
+
+        return fast_track_hits
+
+    def search_batch_nearest(self, texts: list[str]) -> dict[int, tuple[str, float]]:
+        """
+        Ближайший эталонный абзац для каждого текста батча (один запрос к ChromaDB).
+        Возвращает {batch_idx: (style_name, distance)} без порога — порог решает вызывающий.
+        """
         if not texts:
             return {}
 
@@ -236,7 +268,7 @@ class RagEngine:
             print(f"⚠️ RAG batch fast track error: {e}")
             return {}
 
-        fast_track_hits: dict[int, str] = {}
+        nearest: dict[int, tuple[str, float]] = {}
 
         distances_matrix = results.get("distances", [])
         metadatas_matrix = results.get("metadatas", [])
@@ -246,14 +278,10 @@ class RagEngine:
         ):
             if not dist_list or not meta_list:
                 continue
-            dist = dist_list[0]
             meta = meta_list[0]
-            if dist <= fast_track_distance:
-                style_name = meta.get("style_name") or meta.get("tag_S", "Normal")
-                fast_track_hits[batch_idx] = style_name
-                print(f"  ⚡ Vector FastTrack[{batch_idx}]: dist={dist:.3f} → '{style_name}'")
+            nearest[batch_idx] = (meta.get("style_name") or meta.get("tag_S", "Normal"), dist_list[0])
 
-        return fast_track_hits
+        return nearest
 
 
 rag_engine = RagEngine()
\ No newline at end of file
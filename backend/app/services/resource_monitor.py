@@ -0,0 +1,112 @@
+#resource_monitor.py
+"""
+Фоновый монитор RAM/CPU: подстраивает лимиты под текущую нагрузку машины.
+
+HardwareProfile читает psutil один раз при импорте, а бюджет контекста модели
+кэшируется в llm_checker._ctx_cache навсегда. Если днём память заберут другие процессы,
+мы продолжаем просить тот же num_ctx — и Ollama уходит в своп.
+
+Монитор раз в RESOURCE_MONITOR_INTERVAL сек:
+  - обновляет settings.available_ram_gb (живое значение для residency и отчётов)
+  - режим давления (settings.memory_pressure → OLLAMA_CTX / RAG_CHUNK_LIMIT «слабого» профиля):
+      вход  — RAM < PRESSURE_RAM_GB или CPU >= PRESSURE_CPU_PERCENT PRESSURE_SAMPLES замеров подряд
+      выход — RAM >= PRESSURE_RAM_GB + PRESSURE_HYSTERESIS_GB и CPU ниже порога RECOVERY_SAMPLES замеров подряд
+  - ступень RAM для бюджета контекста (settings.ctx_ram_gb, строки _CTX_RAM_TABLE):
+      вниз — сразу (своп дороже лишнего батча), вверх — только с запасом PRESSURE_HYSTERESIS_GB
+  - при любой смене режима/ступени сбрасывает кэш бюджетов get_safe_context.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+import psutil
+
+from app.config import settings
+from app.services import metrics
+from app.services.llm_checker import ram_tier, invalidate_context_cache
+
+_GB = 1024 ** 3
+_EVENTS_LIMIT = 100
+
+
+class ResourceMonitor:
+    def __init__(self):
+        self.cpu_percent = 0.0
+        self.samples = 0
+        self._pressure_streak = 0
+        self._recovery_streak = 0
+        self.events: deque = deque(maxlen=_EVENTS_LIMIT)
+        self._task: asyncio.Task | None = None
+
+    def _record(self, event: str, **details):
+        self.events.append({"at": time.time(), "event": event, **details})
+
+    def sample(self):
+        """Один замер psutil. cpu_percent(None) — загрузка CPU с прошлого вызова, без блокировки."""
+        self.observe(psutil.virtual_memory().available / _GB, psutil.cpu_percent(interval=None))
+
+    def observe(self, available_gb: float, cpu_percent: float):
+        """Применяет замер: обновляет settings и при необходимости переключает режимы."""
+        self.samples += 1
+        self.cpu_percent = cpu_percent
+        settings.available_ram_gb = available_gb
+        changed = False
+
+        # --- Режим давления ---
+        stressed = available_gb < settings.PRESSURE_RAM_GB or cpu_percent >= settings.PRESSURE_CPU_PERCENT
+        relaxed = (
+            available_gb >= settings.PRESSURE_RAM_GB + settings.PRESSURE_HYSTERESIS_GB
+            and cpu_percent < settings.PRESSURE_CPU_PERCENT
+        )
+        self._pressure_streak = self._pressure_streak + 1 if stressed else 0
+        self._recovery_streak = self._recovery_streak + 1 if relaxed else 0
+
+        if not settings.memory_pressure and self._pressure_streak >= settings.PRESSURE_SAMPLES:
+            settings.set_memory_pressure(True)
+            self._record("pressure_on", available_gb=round(available_gb, 2), cpu_percent=cpu_percent)
+            changed = True
+        elif settings.memory_pressure and self._recovery_streak >= settings.RECOVERY_SAMPLES:
+            settings.set_memory_pressure(False)
+            self._record("pressure_off", available_gb=round(available_gb, 2), cpu_percent=cpu_percent)
+            changed = True
+
+        # --- Ступень RAM для бюджета контекста ---
+        committed_tier = ram_tier(settings.ctx_ram_gb)
+        if ram_tier(available_gb) < committed_tier or ram_tier(available_gb - settings.PRESSURE_HYSTERESIS_GB) > committed_tier:
+            self._record("ctx_ram", old_gb=round(settings.ctx_ram_gb, 2), new_gb=round(available_gb, 2))
+            print(f"🧠 Context RAM tier: {settings.ctx_ram_gb:.1f} → {available_gb:.1f} GB, budgets will be recomputed")
+            settings.ctx_ram_gb = available_gb
+            changed = True
+
+        if changed:
+            invalidate_context_cache()
+
+    async def _loop(self, interval: float):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"⚠️ Resource monitor sample failed: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float | None = None):
+        if self._task is None or self._task.done():
+            psutil.cpu_percent(interval=None)   # первый вызов всегда 0.0 — «заряжаем» счётчик
+            self._task = asyncio.create_task(self._loop(interval or settings.RESOURCE_MONITOR_INTERVAL))
+
+    def snapshot(self) -> dict:
+        return {
+            "mode": "degraded" if settings.memory_pressure else "normal",
+            "available_ram_gb": round(settings.available_ram_gb, 2),
+            "ctx_ram_gb": round(settings.ctx_ram_gb, 2),
+            "cpu_percent": self.cpu_percent,
+            "ollama_ctx": settings.OLLAMA_CTX,
+            "rag_chunk_limit": settings.RAG_CHUNK_LIMIT,
+            "samples": self.samples,
+            "events": list(self.events)[-20:],
+        }
+
+
+resource_monitor = ResourceMonitor()
+metrics.register("resources", resource_monitor.snapshot)
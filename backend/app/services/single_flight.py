@@ -0,0 +1,414 @@
+#single_flight.py
+"""
+Single-flight для /v1/completions: одинаковые запросы (повтор клиента по таймауту,
+двойной клик ApplyTemplate) не гоняют гибридный конвейер и Ollama второй раз.
+
+  - отпечаток: модель + абзацы + флаги, меняющие ответ (progressive, cascade_model)
+    + поколение RAG-индекса: шаблон выбирается по абзацам и меняется только через /api/ingest.
+    session_id в отпечаток не входит — у повторного клика он новый
+  - пока запрос «в полёте», одинаковые подключаются к его потоку результатов
+  - поток, завершившийся без ошибок, ещё SINGLE_FLIGHT_GRACE_SEC отдаётся повтором (replay),
+    потом удаляется сам (call_later), даже если одинаковых запросов больше нет
+  - конвейер крутится фоновой задачей; генерацию LLM прерывает, только когда отключились
+    ВСЕ читатели, а не первый клиент
+  - heartbeat'ы не буферизуются: каждый читатель шлёт свои, пока ждёт новых строк
+  - SINGLE_FLIGHT_SHARED=true: то же между воркерами uvicorn через файловый спул
+    DATA_DIR/single_flight (лидер держит FileLock и пишет NDJSON в файл, остальные читают хвост
+    в потоке); по истечении grace лидер удаляет файлы спула
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import time
+
+from filelock import FileLock, Timeout
+
+from app.config import settings
+from app.services import metrics
+
+_POLL_SEC = 0.05
+_SPOOL_SUFFIXES = ("ndjson", "headers.json", "done")
+
+
+class Flight:
+    """Один запрос «в полёте»: буфер NDJSON-строк, заголовки ответа и читатели."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.lines: list[str] = []
+        self.headers: dict | None = None
+        self.done = False
+        self.failed = False
+        self.finished_at = 0.0
+        self.readers = 0
+        self.attached = 0
+        self.task: asyncio.Task | None = None
+        self.spool_lock: FileLock | None = None
+        self._published = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, line: str):
+        # Ответ с ошибкой (в т.ч. несостоявшийся refinement) повтором не отдаём
+        if 'error"' in line:
+            try:
+                record = json.loads(line)
+                self.failed = self.failed or "error" in record or "refinement_error" in record
+            except json.JSONDecodeError:
+                pass
+        self.lines.append(line)
+        self._notify()
+
+    def finish(self, failed: bool = False):
+        self.failed = self.failed or failed
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._published.set()
+        self._notify()
+
+    def abandoned(self) -> bool:
+        """Все подключавшиеся читатели ушли — продолжать генерацию незачем."""
+        return self.attached > 0 and self.readers == 0
+
+    async def wait_published(self) -> dict | None:
+        """Заголовки ответа лидера; None — лидер упал до начала стрима."""
+        await self._published.wait()
+        return self.headers
+
+    async def stream(self):
+        """Поток для одного клиента: буфер с начала, затем новые строки по мере появления."""
+        self.readers += 1
+        self.attached += 1
+        pos = 0
+        try:
+            # Немедленный Heartbeat, как у самого конвейера
+            yield " \n"
+            while True:
+                while pos < len(self.lines):
+                    yield self.lines[pos]
+                    pos += 1
+                if self.done:
+                    yield "\n"
+                    return
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), settings.HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield " \n"
+        finally:
+            self.readers -= 1
+
+
+class SingleFlight:
+    def __init__(self, grace_sec: float, shared_dir: str | None = None):
+        self.grace_sec = grace_sec
+        self.shared_dir = shared_dir
+        self.flights: dict[str, Flight] = {}
+        self.generation = 0
+        self.leaders = 0
+        self.joined = 0
+        self.replayed = 0
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Отпечаток
+    # ------------------------------------------------------------------
+
+    def _current_generation(self) -> int:
+        if not self.shared_dir:
+            return self.generation
+        try:
+            with open(os.path.join(self.shared_dir, "generation")) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def fingerprint(self, data: dict) -> str:
+        paragraphs = data.get("paragraphs") or []
+        digest = hashlib.sha256(json.dumps({
+            "model": data.get("model", ""),
+            # Без разобранных абзацев различаем по сырому prompt
+            "prompt": "" if paragraphs else data.get("prompt", ""),
+            "progressive": data.get("progressive"),
+            "cascade_model": data.get("cascade_model"),
+            "prompt_compaction": data.get("prompt_compaction"),
+            "document_size": data.get("document_size"),
+            "deadline_ms": data.get("deadline_ms"),
+            "generation": self._current_generation(),
+        }, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+        # Абзацы — по одному, без сериализации всего документа в одну строку
+        for p in paragraphs:
+            digest.update(json.dumps(p, ensure_ascii=False).encode("utf-8") + b"\n")
+        return digest.hexdigest()[:32]
+
+    def invalidate(self):
+        """Индекс шаблонов изменился (/api/ingest): завершённые ответы больше не повторяем."""
+        self.generation += 1
+        for key in [k for k, f in self.flights.items() if f.done]:
+            del self.flights[key]
+        if self.shared_dir:
+            path = os.path.join(self.shared_dir, "generation")
+            with FileLock(path + ".lock", timeout=10):
+                value = self._current_generation() + 1
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "w") as f:
+                    f.write(str(value))
+                os.replace(tmp, path)
+
+    # ------------------------------------------------------------------
+    # Лидер / последователи
+    # ------------------------------------------------------------------
+
+    def _finish(self, flight: Flight, failed: bool = False):
+        """Поток закончился: через grace_sec (упавший — сразу) flight удаляется сам, без новых join."""
+        flight.finish(failed)
+        delay = 0 if flight.failed else self.grace_sec
+        asyncio.get_running_loop().call_later(delay, self._forget, flight)
+
+    def _forget(self, flight: Flight):
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [k for k, f in self.flights.items()
+                    if f.done and (f.failed or now - f.finished_at > self.grace_sec)]:
+            del self.flights[key]
+
+    def join(self, key: str) -> tuple[Flight, bool]:
+        """(flight, True) — мы лидер и должны запустить конвейер; иначе — читаем чужой."""
+        self._expire()
+        flight = self.flights.get(key)
+        if flight is not None:
+            if flight.done:
+                self.replayed += 1
+            else:
+                self.joined += 1
+            return flight, False
+
+        flight = Flight(key)
+        if self.shared_dir and not self._lead_spool(flight):
+            # Этот запрос уже выполняет (или недавно выполнил) другой воркер
+            flight.task = asyncio.create_task(self._tail_spool(flight))
+            self.flights[key] = flight
+            return flight, False
+
+        self.flights[key] = flight
+        self.leaders += 1
+        return flight, True
+
+    def publish(self, flight: Flight, headers: dict, body):
+        """Лидер готов стримить: заголовки — последователям, body — в фоновую задачу."""
+        flight.headers = headers
+        flight._published.set()
+        flight.task = asyncio.create_task(self._produce(flight, body))
+
+    def abort(self, flight: Flight):
+        """Лидер упал до начала стрима: последователи выполнят запрос сами."""
+        flight.headers = None
+        flight.finish(failed=True)
+        self.flights.pop(flight.key, None)
+        if flight.spool_lock is not None:
+            self._release_spool(flight)
+            # Результата нет и не будет — спул сразу в мусор
+            asyncio.get_running_loop().run_in_executor(None, self._drop_spool, flight.key, None)
+
+    async def _produce(self, flight: Flight, body):
+        # Запись в спул — в потоке: общий диск (NFS, нагруженный SSD) не должен тормозить event loop
+        spool = flight.spool_lock is not None
+        try:
+            if spool:
+                await asyncio.to_thread(self._write_spool, flight.key, "headers.json", json.dumps(flight.headers))
+            async for chunk in body:
+                if not chunk.strip():
+                    continue  # heartbeat'ы читатели шлют сами
+                flight.append(chunk)
+                if spool:
+                    await asyncio.to_thread(self._write_spool, flight.key, "ndjson", chunk, "a")
+        except Exception as e:
+            print(f"❌ Single-flight producer error: {e}")
+            line = f"{json.dumps({'error': str(e)}, ensure_ascii=False)}\n"
+            flight.append(line)
+            if spool:
+                await asyncio.to_thread(self._write_spool, flight.key, "ndjson", line, "a")
+        finally:
+            self._finish(flight)
+            if spool:
+                done_at = await asyncio.to_thread(self._write_done, flight.key, "failed" if flight.failed else "ok")
+                self._release_spool(flight)
+                # Повтор другим воркерам отдаётся grace_sec, дальше файлы спула не нужны
+                loop = asyncio.get_running_loop()
+                loop.call_later(self.grace_sec, loop.run_in_executor, None, self._drop_spool, flight.key, done_at)
+
+    # ------------------------------------------------------------------
+    # Файловый спул между воркерами (SINGLE_FLIGHT_SHARED)
+    # ------------------------------------------------------------------
+
+    def _spool_path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.shared_dir, f"{key}.{suffix}")
+
+    def _write_spool(self, key: str, suffix: str, text: str, mode: str = "w"):
+        with open(self._spool_path(key, suffix), mode, encoding="utf-8") as f:
+            f.write(text)
+
+    def _write_done(self, key: str, status: str) -> float:
+        """Отметка конца потока; mtime — чтобы потом не удалить спул следующего лидера."""
+        self._write_spool(key, "done", status)
+        return os.path.getmtime(self._spool_path(key, "done"))
+
+    def _drop_spool(self, key: str, done_at: float | None):
+        """
+        Удаляет файлы спула (в потоке). Запрос снова выполняется (lock занят) или его уже
+        завершил следующий лидер (done новее done_at) — файлы чужие, не трогаем.
+        """
+        lock = FileLock(self._spool_path(key, "lock"))
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            return
+        try:
+            try:
+                if os.path.getmtime(self._spool_path(key, "done")) != done_at:
+                    return
+            except FileNotFoundError:
+                if done_at is not None:
+                    return
+            for suffix in (*_SPOOL_SUFFIXES, "lock"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self._spool_path(key, suffix))
+        finally:
+            lock.release()
+
+    def _fresh_result(self, key: str) -> bool:
+        """Другой воркер завершил этот запрос без ошибок меньше grace назад."""
+        done_path = self._spool_path(key, "done")
+        try:
+            with open(done_path, encoding="utf-8") as f:
+                ok = f.read().strip() == "ok"
+            return ok and time.time() - os.path.getmtime(done_path) <= self.grace_sec
+        except OSError:
+            return False
+
+    def _lead_spool(self, flight: Flight) -> bool:
+        if self._fresh_result(flight.key):
+            self.replayed += 1
+            return False
+        lock = FileLock(self._spool_path(flight.key, "lock"))
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            self.joined += 1
+            return False
+        for suffix in _SPOOL_SUFFIXES:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._spool_path(flight.key, suffix))
+        self._write_spool(flight.key, "ndjson", "")
+        flight.spool_lock = lock
+        return True
+
+    def _release_spool(self, flight: Flight):
+        if flight.spool_lock is not None:
+            flight.spool_lock.release()
+            flight.spool_lock = None
+
+    def _leader_alive(self, key: str) -> bool:
+        lock = FileLock(self._spool_path(key, "lock"))
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            return True
+        lock.release()
+        return False
+
+    def _read_spool_headers(self, key: str) -> tuple[dict | None, bool]:
+        """(заголовки лидера или None, жив ли лидер) — в потоке, как и запись спула."""
+        path = self._spool_path(key, "headers.json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f), True
+        except (OSError, ValueError):
+            pass
+        if self._leader_alive(key):
+            return None, True
+        # Лидер мог дописать заголовки и завершиться между двумя проверками
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f), True
+        except (OSError, ValueError):
+            return None, False
+
+    def _read_spool_lines(self, key: str, offset: int) -> tuple[list[str], int, str | None]:
+        """
+        Полные строки спула с offset (в потоке). Состояние лидера: None — ещё пишет,
+        "done" — закончил, "lost" — умер, не дописав.
+        """
+        # done пишется после всех строк: увидели его — дочитываем файл целиком
+        done = os.path.exists(self._spool_path(key, "done"))
+        try:
+            with open(self._spool_path(key, "ndjson"), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return [], offset, "lost"
+        if not done:
+            # Хвост без \n — строка ещё пишется
+            data = data[: data.rfind(b"\n") + 1]
+        lines = [line + "\n" for line in data.decode("utf-8").split("\n") if line.strip()]
+        state = "done" if done else None
+        if not done and not lines and not self._leader_alive(key) \
+                and not os.path.exists(self._spool_path(key, "done")):
+            state = "lost"
+        return lines, offset + len(data), state
+
+    async def _tail_spool(self, flight: Flight):
+        key = flight.key
+        while True:
+            headers, leader_alive = await asyncio.to_thread(self._read_spool_headers, key)
+            if headers is not None:
+                break
+            if not leader_alive:
+                # Лидер упал до начала стрима — выполняем запрос сами
+                self.abort(flight)
+                return
+            await asyncio.sleep(_POLL_SEC)
+        flight.headers = headers
+        flight._published.set()
+
+        offset = 0
+        while True:
+            lines, offset, state = await asyncio.to_thread(self._read_spool_lines, key, offset)
+            for line in lines:
+                flight.append(line)
+            if state == "done":
+                self._finish(flight)
+                return
+            if state == "lost":
+                flight.append(f"{json.dumps({'error': 'single-flight leader worker exited'})}\n")
+                self._finish(flight, failed=True)
+                return
+            if not lines:
+                await asyncio.sleep(_POLL_SEC)
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": sum(1 for f in self.flights.values() if not f.done),
+            "replayable": sum(1 for f in self.flights.values() if f.done and not f.failed),
+            "leaders": self.leaders,
+            "joined": self.joined,
+            "replayed": self.replayed,
+            "shared": bool(self.shared_dir),
+        }
+
+
+single_flight = SingleFlight(
+    settings.SINGLE_FLIGHT_GRACE_SEC,
+    os.path.join(settings.DATA_DIR, "single_flight") if settings.SINGLE_FLIGHT_SHARED else None,
+)
+metrics.register("single_flight", single_flight.snapshot)
@@ -0,0 +1,89 @@
+#streaming.py
+"""
+Утилиты для NDJSON-стриминга клиенту.
+
+Heartbeat живёт отдельной задачей рядом с upstream-потоком Ollama:
+пока модель делает prefill (на CPU это десятки секунд без единого чанка),
+клиент всё равно получает " \\n" каждые `interval` секунд и не падает
+по таймауту urlopen(..., timeout=30).
+"""
+
+import asyncio
+import contextlib
+import time
+from typing import Awaitable, AsyncIterator, TypeVar
+
+T = TypeVar("T")
+
+# Маркер heartbeat-тика. Потребитель сравнивает через `is`.
+HEARTBEAT = object()
+
+_END = object()
+
+
+async def with_heartbeats(
+    source: AsyncIterator[T], interval: float, deadline: float | None = None
+) -> AsyncIterator[T | object]:
+    """
+    Оборачивает async-итератор: отдаёт его элементы как есть, а если за `interval`
+    секунд от upstream ничего не пришло — отдаёт HEARTBEAT.
+
+    deadline (time.monotonic()) — ожидание тика на него не перескакивает: интервал
+    пересчитывается на каждом тике, и HEARTBEAT приходит к самому дедлайну, а не к
+    первому тику после него. Что делать на дедлайне, решает потребитель.
+
+    Upstream читается в отдельной задаче, поэтому heartbeat идёт и во время
+    установки соединения / ожидания заголовков, и во время prefill.
+    Исключения upstream пробрасываются потребителю. При закрытии генератора
+    (клиент отвалился, break) задача-читатель отменяется.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def _pump():
+        try:
+            async for item in source:
+                await queue.put((item, None))
+        except Exception as e:
+            await queue.put((_END, e))
+            return
+        await queue.put((_END, None))
+
+    pump_task = asyncio.create_task(_pump())
+    getter = None
+    try:
+        while True:
+            # Держим один getter между тиками: wait_for(queue.get()) при таймауте
+            # отменяет get и может потерять уже взятый элемент.
+            if getter is None:
+                getter = asyncio.ensure_future(queue.get())
+            timeout = interval
+            if deadline is not None and deadline > time.monotonic():
+                timeout = min(interval, deadline - time.monotonic())
+            done, _ = await asyncio.wait({getter}, timeout=timeout)
+            if not done:
+                yield HEARTBEAT
+                continue
+            item, error = getter.result()
+            getter = None
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        if getter is not None:
+            getter.cancel()
+        if not pump_task.done():
+            pump_task.cancel()
+            # Ждём, пока upstream закроется; CancelledError здесь — от нашей же отмены насоса
+            with contextlib.suppress(asyncio.CancelledError):
+                await pump_task
+            task = asyncio.current_task()
+            if task is not None and task.cancelling():
+                # Отменяли и нас самих (до finally или пока ждали насос) — отмену не глотаем
+                raise asyncio.CancelledError
+
+
+async def once(awaitable: Awaitable[T]) -> AsyncIterator[T]:
+    """Async-итератор из одного awaitable: стадию без потока тоже можно обернуть в with_heartbeats."""
+    yield await awaitable
@@ -0,0 +1,95 @@
+#style_audit.py
+"""
+Аудит стилей документа без LLM (/api/audit): какие абзацы расходятся с корпоративным шаблоном.
+
+Прогоняются только быстрые стадии конвейера /v1/completions, по всему документу сразу:
+  - Шаг A, эвристики (заголовок капсом, нумерованный/маркированный список) — confidence 1.0;
+  - ближайший эталонный абзац в RAG-индексе (один запрос к Chroma на весь документ):
+    ближе 0.20 — "fast_track", как в Шаге B; ближе AUDIT_MAX_DISTANCE — "nearest";
+    confidence = 1 - distance. Дальше порога — не судим: такие абзацы решала бы LLM.
+
+Расхождение — ожидаемый стиль не совпадает с текущим (без учёта регистра и пробелов по краям).
+Счётчики — в /api/metrics ("audit").
+"""
+
+from app.config import settings
+from app.services import metrics
+
+# Порог Vector Fast Track Шага B: ближе — стиль назначается без LLM
+FAST_TRACK_DISTANCE = 0.20
+
+
+def _same_style(a: str, b: str) -> bool:
+    return a.strip().casefold() == b.strip().casefold()
+
+
+def expected_styles(
+    heuristics: dict[int, str],
+    nearest: dict[int, tuple[str, float]],
+) -> dict[int, tuple[str, str, float]]:
+    """{id: (ожидаемый стиль, стадия, confidence)}: эвристики важнее эталона, как в конвейере."""
+    expected: dict[int, tuple[str, str, float]] = {
+        pid: (style, "heuristic", 1.0) for pid, style in heuristics.items()
+    }
+    for pid, (style, dist) in nearest.items():
+        if pid in expected or dist > settings.AUDIT_MAX_DISTANCE:
+            continue
+        stage = "fast_track" if dist <= FAST_TRACK_DISTANCE else "nearest"
+        expected[pid] = (style, stage, round(max(0.0, 1.0 - dist), 3))
+    return expected
+
+
+def find_deviations(
+    paragraphs: list[dict],
+    expected: dict[int, tuple[str, str, float]],
+    min_confidence: float,
+) -> list[dict]:
+    """Расхождения в порядке документа: [{"id", "current", "expected", "stage", "confidence"}]."""
+    deviations = []
+    for p in paragraphs:
+        verdict = expected.get(p["id"])
+        if verdict is None:
+            continue
+        style, stage, confidence = verdict
+        if confidence < min_confidence or _same_style(style, p.get("style_name") or ""):
+            continue
+        deviations.append({
+            "id": p["id"],
+            "current": p.get("style_name") or "",
+            "expected": style,
+            "stage": stage,
+            "confidence": confidence,
+        })
+    return deviations
+
+
+class AuditStats:
+    def __init__(self):
+        self.audits = 0
+        self.paragraphs = 0
+        self.deviations = 0
+        self.unchecked = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, paragraphs: int, deviations: int, unchecked: int, elapsed_ms: float):
+        self.audits += 1
+        self.paragraphs += paragraphs
+        self.deviations += deviations
+        self.unchecked += unchecked
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self) -> dict:
+        return {
+            "audits": self.audits,
+            "paragraphs": self.paragraphs,
+            "deviations": self.deviations,
+            "unchecked": self.unchecked,
+            "avg_ms": round(self.total_ms / self.audits, 1) if self.audits else 0.0,
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+audit_stats = AuditStats()
+metrics.register("audit", audit_stats.snapshot)
@@ -0,0 +1,109 @@
+#text_features.py
+"""
+Признаки текста абзацев за один проход — общие для всех стадий конвейера.
+
+Раньше один и тот же абзац разбирался несколько раз:
+  - llm_checker._detect_lang  — два посимвольных цикла на Python (кириллица, латиница)
+  - apply_heuristics          — strip / isupper / два re.match на каждый абзац
+  - clean_query для RAG       — свой re.sub
+Здесь всё считается один раз на батч, и стадии берут готовое:
+  - доли кириллицы/латиницы/цифр — один bytes.translate по UTF-8 + bytes.count (всё в C):
+    кириллица U+0400–U+04FF в UTF-8 — это ровно ведущие байты 0xD0–0xD3
+  - нумерация/маркер списка — один скомпилированный regex
+  - длина, ALL CAPS, завершающая пунктуация, язык, очищенный текст для RAG-запроса
+"""
+
+import re
+
+# Класс каждого байта UTF-8: 1 — латиница, 2 — цифра, 3 — ведущий байт кириллицы, 0 — прочее
+_LATIN, _DIGIT, _CYRILLIC = 1, 2, 3
+_BYTE_CLASS = bytearray(256)
+for _b in b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz":
+    _BYTE_CLASS[_b] = _LATIN
+for _b in b"0123456789":
+    _BYTE_CLASS[_b] = _DIGIT
+for _b in (0xD0, 0xD1, 0xD2, 0xD3):
+    _BYTE_CLASS[_b] = _CYRILLIC
+_BYTE_CLASS = bytes(_BYTE_CLASS)
+
+_LIST_PREFIX = re.compile(r'^(?:(?P<num>\d+[\.\)])|(?P<bullet>[-•\*]))\s+')
+_NON_WORD = re.compile(r'[^\w\s]')
+
+TRAILING_PUNCTUATION = ".:;!?,"
+
+
+def _script_counts(text: str) -> tuple[int, int, int]:
+    """(кириллица, латиница, цифры) — число символов каждого класса."""
+    classes = text.encode("utf-8", "surrogatepass").translate(_BYTE_CLASS)
+    return classes.count(_CYRILLIC), classes.count(_LATIN), classes.count(_DIGIT)
+
+
+def script_ratios(text: str) -> tuple[float, float]:
+    """(доля кириллицы, доля латиницы) в тексте."""
+    if not text:
+        return 0.0, 0.0
+    n = len(text)
+    cyrillic, latin, _ = _script_counts(text)
+    return cyrillic / n, latin / n
+
+
+def detect_lang(text: str) -> str:
+    """> 25% кириллицы — "ru", > 30% латиницы — "en", иначе "other"."""
+    if not text:
+        return "other"
+    cyrillic, latin = script_ratios(text)
+    if cyrillic > 0.25:
+        return "ru"
+    if latin > 0.3:
+        return "en"
+    return "other"
+
+
+def clean_query(text: str) -> str:
+    """Текст для векторного поиска: пунктуация и спецсимволы → пробелы."""
+    return _NON_WORD.sub(' ', text).strip()
+
+
+class TextFeatures:
+    """Признаки одного абзаца (text — уже без пробелов по краям)."""
+
+    __slots__ = ("text", "length", "cyrillic_ratio", "latin_ratio", "digit_ratio",
+                 "is_upper", "list_prefix", "trailing_punct", "lang")
+
+    def __init__(self, raw: str):
+        text = raw.strip()
+        n = len(text)
+        self.text = text
+        self.length = n
+        cyrillic, latin, digits = _script_counts(text)
+        self.cyrillic_ratio = cyrillic / n if n else 0.0
+        self.latin_ratio = latin / n if n else 0.0
+        self.digit_ratio = digits / n if n else 0.0
+        self.is_upper = text.isupper()
+        m = _LIST_PREFIX.match(text)
+        self.list_prefix = m.lastgroup if m else None          # "num" | "bullet" | None
+        self.trailing_punct = text[-1] if n and text[-1] in TRAILING_PUNCTUATION else ""
+        if not n:
+            self.lang = "other"
+        elif self.cyrillic_ratio > 0.25:
+            self.lang = "ru"
+        elif self.latin_ratio > 0.3:
+            self.lang = "en"
+        else:
+            self.lang = "other"
+
+    @property
+    def clean(self) -> str:
+        return clean_query(self.text)
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def compute_batch(paragraphs: list[dict]) -> dict:
+    """{id: TextFeatures} для батча [{"id": N, "text": "..."}]. Абзацы без id пропускаются."""
+    return {
+        p["id"]: TextFeatures(str(p.get("text", "")))
+        for p in paragraphs
+        if p.get("id") is not None
+    }
@@ -0,0 +1,203 @@
+#token_counter.py
+"""
+Точный подсчёт токенов через /api/tokenize: батчами и с кэшем по хэшу текста.
+
+get_chars_per_token щупает только первые 500 символов и держит одно отношение на
+(модель, язык) — для юридического текста вперемешку с цифрами и таблицами бюджет
+получается грубым. Здесь:
+  - тексты склеиваются через разделитель и токенизируются ОДНИМ запросом;
+    список id режется по id разделителя. Если на стыке токены слиплись
+    (кусков не столько, сколько текстов) — этот батч считается по одному тексту.
+  - точные счёты кэшируются по (модель, sha1 текста): повторные батчи, ретраи
+    и перезапуски документа не ходят в Ollama вообще.
+  - Ollama недоступна → фоллбэк на CPT-эвристику (замеренный _cpt_cache или дефолт языка),
+    такие оценки не кэшируются.
+  - сборка Ollama без /api/tokenize (404/405/501) запоминается по (узел, модель) на
+    _UNSUPPORTED_TTL: батчи Шага C идут сразу в CPT-оценку, без заведомо неудачного запроса.
+    Смена digest модели (ollama_meta) сбрасывает отметку.
+"""
+
+import asyncio
+import hashlib
+import math
+import time
+from collections import OrderedDict
+
+import httpx
+
+from app.services import metrics
+from app.services.llm_checker import _cpt_cache, _default_user_cpt, _detect_lang
+from app.services.ollama_meta import ollama_meta
+
+# Разделитель: редкая последовательность, которая не склеивается с обычным текстом
+SEPARATOR = "\n\n⁂⁂⁂\n\n"
+_MAX_BATCH_CHARS = 32000      # один запрос /api/tokenize не больше N символов
+_CACHE_LIMIT = 50000          # сколько счётов держим в памяти (LRU)
+_SINGLE_CONCURRENCY = 8       # параллельных запросов при поштучном подсчёте
+_UNSUPPORTED_TTL = 600.0      # через сколько сек снова пробуем /api/tokenize на узле без него
+_UNSUPPORTED_STATUSES = (404, 405, 501)
+
+
+def _key(model_name: str, text: str) -> tuple[str, str]:
+    return model_name, hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _split(tokens: list[int], sep: list[int]) -> list[list[int]]:
+    """Режет список id по вхождениям последовательности sep."""
+    parts, current, i, n = [], [], 0, len(sep)
+    while i < len(tokens):
+        if n and tokens[i:i + n] == sep:
+            parts.append(current)
+            current = []
+            i += n
+        else:
+            current.append(tokens[i])
+            i += 1
+    parts.append(current)
+    return parts
+
+
+def heuristic_count(model_name: str, text: str) -> int:
+    """Оценка по CPT: замеренный get_chars_per_token, если есть, иначе дефолт языка."""
+    lang = _detect_lang(text)
+    cpt = _cpt_cache.get((model_name, lang)) or _default_user_cpt(lang)
+    return math.ceil(len(text) / cpt)
+
+
+class TokenCounter:
+    def __init__(self):
+        self.cache: OrderedDict[tuple[str, str], int] = OrderedDict()
+        self._sep_tokens: dict[str, list[int]] = {}   # model -> id разделителя
+        self._unsupported: dict[tuple[str, str], float] = {}   # (url, model) -> когда отметили
+        self.hits = 0
+        self.misses = 0
+        self.tokenize_calls = 0
+        self.split_fallbacks = 0
+        self.heuristic = 0
+
+    def _remember(self, key: tuple[str, str], count: int):
+        self.cache[key] = count
+        self.cache.move_to_end(key)
+        if len(self.cache) > _CACHE_LIMIT:
+            self.cache.popitem(last=False)
+
+    def forget_model(self, model_name: str, ollama_url: str | None = None):
+        """Модель сменила digest — другой токенайзер, старые счёты недействительны (кэш общий для узлов)."""
+        for key in [k for k in self.cache if k[0] == model_name]:
+            del self.cache[key]
+        self._sep_tokens.pop(model_name, None)
+        for key in [k for k in self._unsupported
+                    if k[1] == model_name and (ollama_url is None or k[0] == ollama_url.rstrip('/'))]:
+            del self._unsupported[key]
+
+    def _supported(self, ollama_url: str, model_name: str) -> bool:
+        marked_at = self._unsupported.get((ollama_url.rstrip('/'), model_name))
+        return marked_at is None or time.monotonic() - marked_at > _UNSUPPORTED_TTL
+
+    async def _tokenize(self, client: httpx.AsyncClient, ollama_url: str, model_name: str, content: str) -> list[int]:
+        self.tokenize_calls += 1
+        resp = await client.post(
+            f"{ollama_url.rstrip('/')}/api/tokenize",
+            json={"model": model_name, "content": content},
+            timeout=10,
+        )
+        resp.raise_for_status()
+        return resp.json().get("tokens", [])
+
+    async def _count_batch(self, client, ollama_url: str, model_name: str, texts: list[str]) -> list[int]:
+        if len(texts) == 1:
+            return [len(await self._tokenize(client, ollama_url, model_name, texts[0]))]
+
+        if model_name not in self._sep_tokens:
+            self._sep_tokens[model_name] = await self._tokenize(client, ollama_url, model_name, SEPARATOR)
+        sep = self._sep_tokens[model_name]
+
+        tokens = await self._tokenize(client, ollama_url, model_name, SEPARATOR.join(texts))
+        parts = _split(tokens, sep) if sep else []
+        if len(parts) == len(texts):
+            return [len(p) for p in parts]
+
+        # Разделитель слился с соседним текстом — считаем этот батч поштучно
+        self.split_fallbacks += 1
+        semaphore = asyncio.Semaphore(_SINGLE_CONCURRENCY)
+
+        async def _one(text: str) -> int:
+            async with semaphore:
+                return len(await self._tokenize(client, ollama_url, model_name, text))
+
+        return list(await asyncio.gather(*(_one(t) for t in texts)))
+
+    async def count_many(self, model_name: str, texts: list[str], ollama_url: str) -> list[int]:
+        """Число токенов для каждого текста (в том же порядке)."""
+        counts: list[int | None] = [None] * len(texts)
+        pending: dict[tuple[str, str], list[int]] = {}   # ключ -> индексы (дубликаты считаем один раз)
+        for i, text in enumerate(texts):
+            key = _key(model_name, text)
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                counts[i] = self.cache[key]
+            else:
+                pending.setdefault(key, []).append(i)
+
+        if pending and not self._supported(ollama_url, model_name):
+            self.misses += len(pending)
+            pending_idx = [i for idxs in pending.values() for i in idxs]
+            self.heuristic += len(pending_idx)
+            for i in pending_idx:
+                counts[i] = heuristic_count(model_name, texts[i])
+        elif pending:
+            self.misses += len(pending)
+            # Пакуем уникальные тексты в батчи не длиннее _MAX_BATCH_CHARS
+            batches, current, size = [], [], 0
+            for key, idxs in pending.items():
+                text = texts[idxs[0]]
+                if current and size + len(text) > _MAX_BATCH_CHARS:
+                    batches.append(current)
+                    current, size = [], 0
+                current.append(key)
+                size += len(text) + len(SEPARATOR)
+            if current:
+                batches.append(current)
+
+            try:
+                async with httpx.AsyncClient() as client:
+                    for batch in batches:
+                        batch_counts = await self._count_batch(
+                            client, ollama_url, model_name, [texts[pending[k][0]] for k in batch]
+                        )
+                        for key, count in zip(batch, batch_counts):
+                            self._remember(key, count)
+                            for i in pending[key]:
+                                counts[i] = count
+            except Exception as e:
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code in _UNSUPPORTED_STATUSES:
+                    # Эндпоинта нет в этой сборке Ollama — не спрашиваем перед каждым батчем
+                    self._unsupported[(ollama_url.rstrip('/'), model_name)] = time.monotonic()
+                print(f"⚠️  /api/tokenize недоступен ({type(e).__name__}) → CPT-оценка для {len(pending)} текстов")
+
+            for i, count in enumerate(counts):
+                if count is None:
+                    self.heuristic += 1
+                    counts[i] = heuristic_count(model_name, texts[i])
+
+        return counts
+
+    async def count(self, model_name: str, text: str, ollama_url: str) -> int:
+        return (await self.count_many(model_name, [text], ollama_url))[0]
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached": len(self.cache),
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "tokenize_calls": self.tokenize_calls,
+            "split_fallbacks": self.split_fallbacks,
+            "heuristic_counts": self.heuristic,
+            "tokenize_unsupported": len(self._unsupported),
+        }
+
+
+token_counter = TokenCounter()
+ollama_meta.on_model_changed(token_counter.forget_model)
+metrics.register("token_counter", token_counter.snapshot)
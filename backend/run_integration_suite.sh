@@ -139,6 +139,52 @@ run_test_step "XML DOCX Styles Parser" \
     "poetry run python tests/xml_docx_styles.py"
 run_test_step "Corner Cases (Heartbeat & Ghost Connects)" \
     "poetry run python tests/test_corner_cases.py"
+run_test_step "Heartbeat vs Slow Ollama" \
+    "poetry run python tests/test_heartbeat.py"
+run_test_step "Ollama Pool (stand-in servers)" \
+    "poetry run python tests/test_ollama_pool.py"
+run_test_step "Model Profiles (EWMA + persistence)" \
+    "poetry run python tests/test_model_profiles.py"
+run_test_step "Resource Monitor (hysteresis)" \
+    "poetry run python tests/test_resource_monitor.py"
+run_test_step "Context Sizing (num_ctx buckets)" \
+    "poetry run python tests/test_context_sizing.py"
+run_test_step "Token Counter (stand-in tokenize)" \
+    "poetry run python tests/test_token_counter.py"
+run_test_step "Text Features (10k paragraphs micro-benchmark)" \
+    "poetry run python tests/benchmark_text_features.py"
+run_test_step "Loop Lag Monitor (blocking call capture)" \
+    "poetry run python tests/test_loop_monitor.py"
+run_test_step "Progressive Refinement (provisional + revisions)" \
+    "poetry run python tests/test_progressive_refinement.py"
+run_test_step "Model Cascade (confidence escalation)" \
+    "poetry run python tests/test_cascade.py"
+run_test_step "Single-flight (dedup + replay)" \
+    "poetry run python tests/test_single_flight.py"
+run_test_step "Completion Request Formats (paragraphs / NDJSON / prompt)" \
+    "poetry run python tests/test_completion_request.py"
+run_test_step "Request Parsing (5 MB benchmark)" \
+    "poetry run python tests/benchmark_request_parsing.py"
+run_test_step "Ollama Metadata Cache (TTL + digest invalidation)" \
+    "poetry run python tests/test_ollama_meta.py"
+run_test_step "Prompt Compaction (head + features)" \
+    "poetry run python tests/test_prompt_compaction.py"
+run_test_step "Model Router (auto alias)" \
+    "poetry run python tests/test_model_router.py"
+run_test_step "Circuit Breaker (degraded non-LLM path)" \
+    "poetry run python tests/test_circuit_breaker.py"
+run_test_step "Deadline Planning (X-Deadline-Ms)" \
+    "poetry run python tests/test_deadline.py"
+run_test_step "Early Stop (Step C, reasoning off)" \
+    "poetry run python tests/test_early_stop.py"
+run_test_step "Style Audit (/api/audit, no LLM)" \
+    "poetry run python tests/test_audit.py"
+run_test_step "Retrieve Context Batch (one embed call)" \
+    "poetry run python tests/test_retrieve_context_batch.py"
+run_test_step "Hedged Requests (same path, first token wins)" \
+    "poetry run python tests/test_hedging.py"
+run_test_step "Model Residency (RAM budget, queue, release wake-up)" \
+    "poetry run python tests/test_model_residency.py"
 
 # ─────────────────────────────────────────────────────────────────────────────
 # ШАГ 3–4: Тесты среднего уровня (RAG + Workflow)
@@ -149,6 +195,8 @@ run_test_step "RAG Benchmark" \
     "poetry run python tests/benchmark_rag.py"
 run_test_step "Workflow Validator" \
     "poetry run python tests/workflow_validator.py"
+run_test_step "Event Loop Concurrency Benchmark" \
+    "poetry run python tests/benchmark_event_loop_concurrency.py --seconds 3"
 
 # ─────────────────────────────────────────────────────────────────────────────
 # ШАГ 5: E2E тест через боевой client.py (production pipeline)
@@ -0,0 +1,145 @@
+"""
+Бенчмарк конкурентности: p99 латентности «лёгких» endpoint'ов, пока идут тяжёлые батчи.
+
+Сравниваются два режима RAG в proxy_completions:
+  - inline      — как раньше: поиск выполняется прямо в потоке event loop
+  - thread_pool — через async_rag (services/rag_async.py), выделенный пул RAG_WORKERS потоков
+
+Нагрузка (in-process, httpx.ASGITransport, один event loop):
+  - N «тяжёлых» клиентов гоняют /v1/completions (батч разрешается Шагами A+B, без Ollama)
+  - один «лёгкий» клиент каждые 20 мс дёргает GET /api/ollama/nodes и меряет латентность
+    от запланированного момента отправки (без coordinated omission)
+
+По умолчанию стоимость RAG имитируется (time.sleep в потоке, как нативный код
+эмбеддинга/HNSW, отпускающий GIL). С --real — настоящий RagEngine и индекс из data/vector_db.
+
+Запуск:
+  poetry run python tests/benchmark_event_loop_concurrency.py [--heavy 4] [--seconds 5] [--rag-ms 150] [--real]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.api.endpoints import router
+from app.config import settings
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+from app.services.rag_async import async_rag
+from app.services.rag_engine import rag_engine
+
+STYLE_MAP = {"Heading 1": {}, "Normal": {}}
+PARAGRAPHS = [{"id": i, "text": f"Пункт {i}. Стороны договорились о нижеследующем."} for i in range(1, 16)]
+PROMPT = "=== USER CONTENT (CONTENT SOURCE) ===\n" + json.dumps(PARAGRAPHS, ensure_ascii=False)
+
+
+def simulate_rag(rag_ms: float):
+    """Подменяет поиск RagEngine на «тяжёлую» работу, отпускающую GIL, как эмбеддинг на torch."""
+    def search_style_reference(query_text):
+        time.sleep(rag_ms / 1000)
+        return {"source_id": "bench", "style_map": STYLE_MAP, "full_context": ""}
+
+    def search_batch_fast_track(texts, fast_track_distance=0.20):
+        time.sleep(rag_ms / 1000)
+        return {i: "Normal" for i in range(len(texts))}
+
+    rag_engine.search_style_reference = search_style_reference
+    rag_engine.search_batch_fast_track = search_batch_fast_track
+
+
+def use_inline_rag():
+    """Старое поведение: вызов RagEngine прямо в event loop."""
+    async def _inline(method, *args, **kwargs):
+        return getattr(rag_engine, method)(*args, **kwargs)
+    async_rag._run = _inline
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run_mode(app: FastAPI, heavy: int, seconds: float) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    light_latencies: list[float] = []
+    heavy_latencies: list[float] = []
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        # Прогрев: первый запрос кэширует бюджет контекста и создаёт клиентов — в замер не идёт
+        await client.post("/v1/completions", json={"model": "bench:1b", "prompt": PROMPT})
+        stop_at = time.perf_counter() + seconds
+
+        async def heavy_client():
+            while time.perf_counter() < stop_at:
+                start = time.perf_counter()
+                resp = await client.post("/v1/completions", json={"model": "bench:1b", "prompt": PROMPT})
+                resp.raise_for_status()
+                heavy_latencies.append(time.perf_counter() - start)
+
+        async def light_client():
+            # Латентность считаем от ЗАПЛАНИРОВАННОГО момента отправки: пока event loop
+            # заблокирован, запрос даже не уходит, и это тоже ожидание клиента
+            scheduled = time.perf_counter()
+            while scheduled < stop_at:
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                resp = await client.get("/api/ollama/nodes")
+                resp.raise_for_status()
+                light_latencies.append(time.perf_counter() - scheduled)
+                scheduled += 0.02
+
+        await asyncio.gather(light_client(), *(heavy_client() for _ in range(heavy)))
+
+    return {
+        "light_requests": len(light_latencies),
+        "light_p50_ms": round(statistics.median(light_latencies) * 1000, 1),
+        "light_p99_ms": round(percentile(light_latencies, 99) * 1000, 1),
+        "light_max_ms": round(max(light_latencies) * 1000, 1),
+        "heavy_batches": len(heavy_latencies),
+        "heavy_p50_ms": round(statistics.median(heavy_latencies) * 1000, 1) if heavy_latencies else None,
+    }
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    parser = argparse.ArgumentParser(description="Event loop responsiveness under RAG load")
+    parser.add_argument("--heavy", type=int, default=4, help="параллельных тяжёлых клиентов")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--rag-ms", type=float, default=150.0, help="имитируемая стоимость одного RAG-вызова")
+    parser.add_argument("--real", action="store_true", help="настоящий RagEngine вместо имитации")
+    args = parser.parse_args()
+
+    # Ollama не нужна: батч закрывается Шагами A+B, /api/show падает в DEFAULT_CTX
+    ollama_pool.configure(["http://127.0.0.1:9"])
+    # Тяжёлые клиенты шлют один и тот же батч: single-flight превратил бы их в повторы
+    settings.SINGLE_FLIGHT = False
+    if not args.real:
+        simulate_rag(args.rag_ms)
+
+    app = FastAPI()
+    app.include_router(router)
+
+    print(f"🚀 {args.heavy} heavy clients, {args.seconds}s per mode, RAG workers = {async_rag.workers}")
+    results = {"thread_pool": await run_mode(app, args.heavy, args.seconds)}
+    use_inline_rag()
+    results["inline"] = await run_mode(app, args.heavy, args.seconds)
+
+    for mode, r in results.items():
+        print(f"  {mode:<12} {r}")
+    ratio = results["inline"]["light_p99_ms"] / max(results["thread_pool"]["light_p99_ms"], 0.1)
+    print(f"📊 p99 лёгких запросов: thread_pool лучше inline в x{ratio:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
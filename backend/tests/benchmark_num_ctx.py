@@ -0,0 +1,164 @@
+"""
+Бенчмарк num_ctx: «весь безопасный бюджет» (старое поведение) против подбора по размеру
+запроса (services/context_sizing.py). Нужна живая Ollama.
+
+Для каждого размера батча (абзацев) и каждой политики:
+  - латентность /api/chat (wall, load_duration, prompt_eval_duration из ответа Ollama)
+  - RSS процессов ollama (psutil) и size из /api/ps после запроса
+
+Политики гоняются блоками (сначала все запросы одной, потом другой), чтобы смена
+num_ctx и перезагрузка модели попадали в статистику так же, как в реальной работе.
+
+Запуск:
+  poetry run python tests/benchmark_num_ctx.py --model gemma3:4b --rounds 3
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import httpx
+import psutil
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.context_sizing import ContextSizer, estimate_request_tokens
+from app.services.llm_checker import get_safe_context
+from app.services.token_counter import token_counter
+
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reports")
+
+SYSTEM_MESSAGE = (
+    "YOU ARE A JSON-ONLY STYLE CLASSIFIER.\n"
+    "DO NOT SUMMARIZE. DO NOT ADD TEXT. DO NOT REASON.\n"
+    'Available exact style names: ["Normal", "Heading 1", "Heading 2", "List Bullet", "Title"]\n\n'
+    "Return exactly ONE JSON dict where keys are IDs (strings) and values are style names.\n"
+)
+SAMPLE_TEXTS = [
+    "Глава 1. Общие положения",
+    "Настоящий договор определяет порядок оказания услуг и ответственность сторон.",
+    "• Исполнитель обязуется выполнить работы в срок, указанный в приложении № 2.",
+    "Стороны договорились о нижеследующем, руководствуясь действующим законодательством.",
+]
+
+
+def make_prompt(paragraphs: int) -> str:
+    return "\n".join(f"[{i}] {SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]}" for i in range(1, paragraphs + 1))
+
+
+def ollama_rss_mb() -> float:
+    """Суммарный RSS процессов ollama (сервер + runner'ы моделей)."""
+    total = 0
+    for proc in psutil.process_iter(["name", "memory_info"]):
+        try:
+            if "ollama" in (proc.info["name"] or "").lower():
+                total += proc.info["memory_info"].rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return total / (1024 ** 2)
+
+
+async def ps_size_mb(client: httpx.AsyncClient, url: str, model: str) -> float | None:
+    try:
+        resp = await client.get(f"{url}/api/ps", timeout=5.0)
+        for m in resp.json().get("models", []):
+            if (m.get("name") or m.get("model")) == model:
+                return int(m.get("size", 0)) / (1024 ** 2)
+    except Exception:
+        pass
+    return None
+
+
+async def run_one(client: httpx.AsyncClient, url: str, model: str, prompt: str, num_ctx: int) -> dict:
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt},
+        ],
+        "format": {"type": "object", "additionalProperties": {"type": "string"}},
+        "stream": False,
+        "options": {"num_ctx": num_ctx, "temperature": 0.1},
+    }
+    start = time.perf_counter()
+    resp = await client.post(f"{url}/api/chat", json=payload, timeout=settings.LLM_TIMEOUT)
+    wall = time.perf_counter() - start
+    resp.raise_for_status()
+    data = resp.json()
+    return {
+        "num_ctx": num_ctx,
+        "wall_sec": wall,
+        "load_sec": data.get("load_duration", 0) / 1e9,
+        "prefill_sec": data.get("prompt_eval_duration", 0) / 1e9,
+        "rss_mb": ollama_rss_mb(),
+        "ps_size_mb": await ps_size_mb(client, url, model),
+    }
+
+
+def summarize(rows: list[dict]) -> dict:
+    walls = sorted(r["wall_sec"] for r in rows)
+    return {
+        "num_ctx": sorted({r["num_ctx"] for r in rows}),
+        "wall_p50_sec": round(statistics.median(walls), 2),
+        "wall_max_sec": round(walls[-1], 2),
+        "load_total_sec": round(sum(r["load_sec"] for r in rows), 2),
+        "prefill_p50_sec": round(statistics.median(r["prefill_sec"] for r in rows), 2),
+        "rss_max_mb": round(max(r["rss_mb"] for r in rows), 1),
+        "ps_size_max_mb": max((r["ps_size_mb"] or 0) for r in rows),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="num_ctx: full budget vs right-sized")
+    parser.add_argument("--ollama", default=settings.OLLAMA_BASE_URL)
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--sizes", default="3,15,40", help="абзацев в батче, через запятую")
+    args = parser.parse_args()
+    url = args.ollama.rstrip("/")
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    safe_cap, _ = await get_safe_context(args.model, url)
+    sizer = ContextSizer()
+    print(f"🚀 num_ctx benchmark: {args.model} @ {url}, safe cap = {safe_cap}")
+
+    results = {"full_budget": [], "right_sized": []}
+    async with httpx.AsyncClient() as client:
+        for policy in results:
+            for _ in range(args.rounds):
+                for size in sizes:
+                    prompt = make_prompt(size)
+                    if policy == "full_budget":
+                        num_ctx = safe_cap
+                    else:
+                        tokens = await token_counter.count_many(args.model, prompt.split("\n"), url)
+                        needed = estimate_request_tokens(SYSTEM_MESSAGE, sum(tokens), size)
+                        num_ctx = sizer.choose(needed, safe_cap)
+                    row = await run_one(client, url, args.model, prompt, num_ctx)
+                    row["paragraphs"] = size
+                    results[policy].append(row)
+                    print(f"  [{policy}] {size:>3} абз. num_ctx={num_ctx:<6} "
+                          f"{row['wall_sec']:.2f}s load={row['load_sec']:.2f}s rss={row['rss_mb']:.0f}MB")
+
+    report = {policy: summarize(rows) for policy, rows in results.items()}
+    print("\n📊 Итог:")
+    for policy, summary in report.items():
+        print(f"  {policy:<12} {summary}")
+
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    path = os.path.join(REPORTS_DIR, f"num_ctx_benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"model": args.model, "safe_cap": safe_cap, "summary": report, "runs": results},
+                  f, ensure_ascii=False, indent=2)
+    print(f"💾 Отчёт: {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+"""
+Бенчмарк разбора тела /v1/completions на документе ~5 MB: время и пиковая память
+трёх форматов (services/completion_request.py):
+  - prompt   — старый: JSON-строка абзацев внутри prompt после маркера (двойное кодирование)
+  - array    — {"paragraphs": [...]} верхнего уровня, один json.loads
+  - ndjson   — строка параметров + по абзацу на строку, разбор по мере чтения тела
+
+Тело подаётся настоящему starlette.Request кусками по 64 KB, как из сокета.
+Заодно проверяется, что все три формата дают одинаковые абзацы.
+
+Запуск:
+  poetry run python tests/benchmark_request_parsing.py [--mb 5] [--repeat 5]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from starlette.requests import Request
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.completion_request import PROMPT_MARKER, read_completion_request
+
+CHUNK = 64 * 1024
+WORDS = ("договор", "стороны", "исполнитель", "заказчик", "обязуется", "оплатить", "услуги",
+         "в", "срок", "не", "позднее", "Agreement", "Services", "2024", "№", "пункт")
+
+
+def make_paragraphs(target_bytes: int) -> list[dict]:
+    rnd = random.Random(7)
+    paragraphs, size = [], 0
+    while size < target_bytes:
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 80))) + "."
+        paragraphs.append({"id": len(paragraphs), "text": text})
+        size += len(text.encode("utf-8")) + 20
+    return paragraphs
+
+
+def make_bodies(paragraphs: list[dict]) -> dict[str, tuple[str, bytes]]:
+    meta = {"model": "bench:1b", "session_id": "bench", "stream": False, "options": {}}
+    prompt = f"{PROMPT_MARKER}\n{json.dumps(paragraphs, ensure_ascii=False)}"
+    ndjson = "\n".join(json.dumps(r, ensure_ascii=False) for r in [meta, *paragraphs]) + "\n"
+    return {
+        "prompt": ("application/json", json.dumps({**meta, "prompt": prompt}).encode()),
+        "array": ("application/json", json.dumps({**meta, "paragraphs": paragraphs}, ensure_ascii=False).encode()),
+        "ndjson": ("application/x-ndjson", ndjson.encode()),
+    }
+
+
+def make_request(content_type: str, chunks: list[bytes]) -> Request:
+    scope = {
+        "type": "http", "method": "POST", "path": "/v1/completions", "query_string": b"",
+        "headers": [(b"content-type", content_type.encode())],
+    }
+    pending = iter(chunks)
+
+    async def receive():
+        chunk = next(pending, b"")
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunk)}
+
+    return Request(scope, receive)
+
+
+async def parse(content_type: str, chunks: list[bytes]) -> dict:
+    return await read_completion_request(make_request(content_type, chunks))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="/v1/completions body parsing benchmark")
+    parser.add_argument("--mb", type=float, default=5.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    paragraphs = make_paragraphs(int(args.mb * 1024 * 1024))
+    bodies = make_bodies(paragraphs)
+    print(f"📄 {len(paragraphs)} абзацев, тела: " + ", ".join(
+        f"{name}={len(body) / 1024 / 1024:.1f} MB" for name, (_, body) in bodies.items()))
+
+    results = {}
+    for name, (content_type, body) in bodies.items():
+        chunks = [body[i:i + CHUNK] for i in range(0, len(body), CHUNK)]
+
+        data = await parse(content_type, chunks)
+        assert data["paragraphs"] == paragraphs, f"{name}: абзацы не совпадают"
+
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            await parse(content_type, chunks)
+            best = min(best, time.perf_counter() - start)
+
+        # Пик памяти сверх уже полученного из «сокета» тела: копии тела, str, промежуточные объекты
+        tracemalloc.start()
+        data = await parse(content_type, chunks)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del data
+        results[name] = {"parse_ms": round(best * 1000, 1), "peak_mb": round(peak / 1024 / 1024, 1)}
+
+    for name, r in results.items():
+        print(f"  {name:<7} parse={r['parse_ms']:>7} ms  peak={r['peak_mb']:>6} MB")
+    base = results["prompt"]
+    for name in ("array", "ndjson"):
+        r = results[name]
+        print(f"📊 {name} vs prompt: время x{base['parse_ms'] / r['parse_ms']:.2f}, "
+              f"пик памяти x{base['peak_mb'] / max(r['peak_mb'], 0.1):.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+Микро-бенчмарк text_features на 10k абзацев: старые раздельные проходы
+(_detect_lang посимвольно, эвристики Шага A, clean_query) против одного compute_batch.
+Заодно проверяет, что результаты совпадают со старой логикой.
+
+Запуск:
+  poetry run python tests/benchmark_text_features.py [--n 10000] [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.text_features import compute_batch
+
+SAMPLES = [
+    "ГЛАВА 1. ОБЩИЕ ПОЛОЖЕНИЯ",
+    "1. Настоящий договор определяет порядок оказания услуг и ответственность сторон.",
+    "2) Исполнитель обязуется выполнить работы в срок, указанный в приложении № 2:",
+    "• Стоимость работ составляет 1 250 000 (один миллион двести пятьдесят тысяч) рублей;",
+    "- Terms and Conditions apply to all Services provided under this Agreement.",
+    "Table 3 | Q1 2024 | 15,3% | 2 150 | n/a",
+    "Стороны договорились о нижеследующем, руководствуясь ст. 421 ГК РФ (Civil Code).",
+    "   ",
+    "SECTION 4 — LIABILITY",
+]
+
+
+# --- Старая логика (как было до text_features) ---
+
+def old_detect_lang(sample: str) -> str:
+    if not sample:
+        return "other"
+    cyrillic = sum(1 for c in sample if 'Ѐ' <= c <= 'ӿ')
+    if cyrillic / len(sample) > 0.25:
+        return "ru"
+    latin = sum(1 for c in sample if 'a' <= c.lower() <= 'z')
+    if latin / len(sample) > 0.3:
+        return "en"
+    return "other"
+
+
+def old_pass(paragraphs: list[dict]):
+    langs, heuristics, cleans = {}, {}, {}
+    for p in paragraphs:
+        langs[p["id"]] = old_detect_lang(p["text"].strip())
+    for p in paragraphs:
+        text = str(p.get("text", "")).strip()
+        if not text:
+            continue
+        if len(text) <= 80 and text.isupper():
+            heuristics[p["id"]] = "heading"
+        elif re.match(r'^\d+[\.\)]\s+', text):
+            heuristics[p["id"]] = "num"
+        elif re.match(r'^[-•\*]\s+', text):
+            heuristics[p["id"]] = "bullet"
+    for p in paragraphs:
+        cleans[p["id"]] = re.sub(r'[^\w\sа-яА-Яa-zA-Z0-9]', ' ', p["text"]).strip()
+    return langs, heuristics, cleans
+
+
+def new_pass(paragraphs: list[dict]):
+    features = compute_batch(paragraphs)
+    langs, heuristics, cleans = {}, {}, {}
+    for pid, f in features.items():
+        langs[pid] = f.lang
+        if f.length:
+            if f.length <= 80 and f.is_upper:
+                heuristics[pid] = "heading"
+            elif f.list_prefix:
+                heuristics[pid] = f.list_prefix
+        cleans[pid] = f.clean
+    return langs, heuristics, cleans
+
+
+def best_of(fn, paragraphs, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(paragraphs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="text_features micro-benchmark")
+    parser.add_argument("--n", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    paragraphs = [
+        {"id": i, "text": rnd.choice(SAMPLES) * rnd.randint(1, 4)}
+        for i in range(1, args.n + 1)
+    ]
+
+    assert old_pass(paragraphs) == new_pass(paragraphs), "text_features расходится со старой логикой"
+    print(f"✅ Результаты совпадают на {args.n} абзацах")
+
+    t_old = best_of(old_pass, paragraphs, args.repeat)
+    t_new = best_of(new_pass, paragraphs, args.repeat)
+    print(f"📊 Раздельные проходы: {t_old * 1000:.1f} ms")
+    print(f"📊 compute_batch:      {t_new * 1000:.1f} ms  (x{t_old / t_new:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Тест аудита стилей без LLM (/api/audit, services/style_audit.py):
+эвристики Шага A и ближайшие эталоны RAG одним запросом на весь документ,
+расхождения с текущими стилями — с confidence; 500 абзацев — меньше секунды.
+
+Запуск:
+  poetry run python tests/test_audit.py
+"""
+
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from unittest.mock import MagicMock
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.style_audit import audit_stats, expected_styles, find_deviations
+
+STYLE_MAP = {"Normal": {}, "Body Text": {}, "Heading 1": {}, "List Number": {}}
+
+
+class MockRequest:
+    def __init__(self, json_data):
+        self._json = json_data
+
+    async def json(self):
+        return self._json
+
+
+def make_document(n: int) -> list[dict]:
+    """Каждые 5 абзацев: заголовок, пункт списка и три абзаца текста (один — не тем стилем)."""
+    paragraphs = []
+    for i in range(n):
+        kind = i % 5
+        if kind == 0:
+            p = {"text": f"РАЗДЕЛ {i}", "style_name": "Heading 1" if i % 10 else "Normal"}
+        elif kind == 1:
+            p = {"text": f"1. Пункт {i} перечня обязанностей сторон", "style_name": "List Number"}
+        else:
+            p = {"text": f"Текст {i} условий договора поставки", "style_name": "Normal" if kind == 4 else "Body Text"}
+        paragraphs.append({"id": i, **p})
+    return paragraphs
+
+
+def fake_nearest(texts: list[str]) -> dict:
+    """Текст с id % 5 == 3 — далеко от эталонов (судить не по чему), остальное — "Body Text"."""
+    hits = {}
+    for batch_idx, text in enumerate(texts):
+        pid = int(re.findall(r"\d+", text)[-1])
+        hits[batch_idx] = ("Body Text", 0.9 if pid % 5 == 3 else (0.1 if pid % 2 else 0.3))
+    return hits
+
+
+async def call(audit_styles, payload) -> tuple[int, dict]:
+    response = await audit_styles(MockRequest(payload))
+    return response.status_code, json.loads(response.body)
+
+
+def check_rules():
+    print("=== TEST 1: ожидаемые стили и расхождения ===")
+    expected = expected_styles(
+        {1: "Heading 1"},
+        {1: ("Body Text", 0.05), 2: ("Body Text", 0.1), 3: ("Quote", 0.35), 4: ("Body Text", 0.8)},
+    )
+    # Эвристика важнее эталона; дальше AUDIT_MAX_DISTANCE — не судим
+    assert expected == {
+        1: ("Heading 1", "heuristic", 1.0),
+        2: ("Body Text", "fast_track", 0.9),
+        3: ("Quote", "nearest", 0.65),
+    }
+    paragraphs = [
+        {"id": 1, "style_name": "heading 1 "},
+        {"id": 2, "style_name": "Normal"},
+        {"id": 3, "style_name": "Normal"},
+        {"id": 4, "style_name": "Normal"},
+    ]
+    assert find_deviations(paragraphs, expected, 0.0) == [
+        {"id": 2, "current": "Normal", "expected": "Body Text", "stage": "fast_track", "confidence": 0.9},
+        {"id": 3, "current": "Normal", "expected": "Quote", "stage": "nearest", "confidence": 0.65},
+    ]
+    assert [d["id"] for d in find_deviations(paragraphs, expected, 0.7)] == [2]
+    print("✅ PASSED\n")
+
+
+async def check_document(audit_styles, rag_engine):
+    print("=== TEST 2: 500 абзацев — один запрос к Chroma, без LLM ===")
+    paragraphs = make_document(500)
+    started = time.perf_counter()
+    status, body = await call(audit_styles, {"paragraphs": paragraphs, "min_confidence": 0.0})
+    elapsed = time.perf_counter() - started
+    print(f"  {elapsed * 1000:.0f} ms, checked={body['checked']}, deviations={len(body['deviations'])}")
+    assert status == 200 and body["template_id"] == "corp_template"
+
+    # Заголовки и пункты списка решили эвристики — в Chroma ушли только три абзаца текста из пяти
+    assert rag_engine.search_batch_nearest.call_count == 1
+    assert len(rag_engine.search_batch_nearest.call_args[0][0]) == 300
+    assert body["checked"] == 400 and body["unchecked"] == 100
+
+    by_id = {d["id"]: d for d in body["deviations"]}
+    # Заголовок со стилем "Normal" — каждый десятый абзац
+    assert by_id[10] == {"id": 10, "current": "Normal", "expected": "Heading 1", "stage": "heuristic", "confidence": 1.0}
+    assert by_id[4]["expected"] == "Body Text" and by_id[4]["stage"] in ("fast_track", "nearest")
+    assert set(by_id) == {i for i in range(500) if i % 10 == 0 or i % 5 == 4}
+    assert elapsed < 1.0
+    print("✅ PASSED\n")
+
+
+async def check_min_confidence(audit_styles):
+    print("=== TEST 3: min_confidence по умолчанию отсекает неуверенные ===")
+    settings.AUDIT_MIN_CONFIDENCE = 0.8
+    _, body = await call(audit_styles, {"paragraphs": make_document(50)})
+    # Абзацы с distance 0.3 (confidence 0.7) не проходят
+    assert all(d["confidence"] >= 0.8 for d in body["deviations"])
+    assert {d["id"] for d in body["deviations"]} == {0, 10, 20, 30, 40, 9, 19, 29, 39, 49}
+    settings.AUDIT_MIN_CONFIDENCE = 0.5
+    print("✅ PASSED\n")
+
+
+async def check_bad_request(audit_styles, rag_engine):
+    print("=== TEST 4: кривой запрос — 400, без шаблона — только эталоны ===")
+    status, body = await call(audit_styles, {"paragraphs": [{"text": "без id"}]})
+    assert status == 400 and "error" in body
+
+    rag_engine.search_style_reference = MagicMock(return_value=None)
+    status, body = await call(audit_styles, {"paragraphs": make_document(5), "min_confidence": 0})
+    assert status == 200 and body["template_id"] is None
+    # Без шаблона эвристикам не из чего выбирать: РАЗДЕЛ 0 судит только эталон
+    assert body["deviations"][0]["id"] == 0 and body["deviations"][0]["stage"] != "heuristic"
+    print(f"  audit: {audit_stats.snapshot()}")
+    print("✅ PASSED\n")
+
+
+async def main():
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import audit_styles
+    from app.services.rag_engine import rag_engine
+
+    rag_engine.search_style_reference = MagicMock(return_value={
+        "source_id": "corp_template",
+        "style_map": STYLE_MAP,
+    })
+    rag_engine.search_batch_nearest = MagicMock(side_effect=fake_nearest)
+    settings.AUDIT_MAX_DISTANCE = 0.5
+
+    check_rules()
+    await check_document(audit_styles, rag_engine)
+    await check_min_confidence(audit_styles)
+    await check_bad_request(audit_styles, rag_engine)
+    print("🎉 Audit тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,184 @@
+"""
+Тест каскада моделей в Шаге C: маленькая модель отвечает за уверенные абзацы
+(self-consistency по нескольким выборкам с enum стилей шаблона), к большой
+эскалируются только неуверенные. Mock-Ollama отвечает по имени модели.
+
+Запуск:
+  poetry run python tests/test_cascade.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.cascade import cascade_stats, split, vote
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+
+SMALL, LARGE = "tiny:0.5b", "large:14b"
+STYLE_MAP = {"Normal": {}, "Quote": {}, "Heading 1": {"bold": True}}
+
+chat_log: list[dict] = []
+small_calls = 0
+small_broken = False
+_lock = threading.Lock()
+
+
+class CascadeOllamaHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, code: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        global small_calls
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/show":
+            self._send_json(200, {"model_info": {"llama.context_length": 8192}})
+            return
+        if self.path != "/api/chat":
+            self._send_json(404, {})
+            return
+
+        with _lock:
+            chat_log.append(body)
+        if body["model"] == SMALL:
+            if small_broken:
+                self._send_json(500, {"error": "model not found"})
+                return
+            with _lock:
+                small_calls += 1
+                n = small_calls
+            # 1 — всегда одинаково (уверенно), 2 — выборки расходятся, 3 — стиль не из шаблона
+            answer = {"1": "Quote", "2": "Normal" if n % 2 else "Heading 1", "3": "Bogus"}
+        else:
+            # Большая модель пытается ответить и за 1 — это не должно перебить маленькую
+            answer = {"1": "Normal", "2": "Heading 1", "3": "Normal"}
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        self.wfile.write((json.dumps({"message": {"content": json.dumps(answer)}}) + "\n").encode())
+        self.wfile.write((json.dumps({"done": True}) + "\n").encode())
+
+
+class MockRequest:
+    def __init__(self, json_data):
+        self._json = json_data
+
+    async def json(self):
+        return self._json
+
+    async def is_disconnected(self):
+        return False
+
+
+def make_request() -> MockRequest:
+    paragraphs = [{"id": i, "text": f"обычный текст параграфа номер {i}"} for i in (1, 2, 3)]
+    return MockRequest({
+        "prompt": "=== USER CONTENT (CONTENT SOURCE) ===\n" + json.dumps(paragraphs, ensure_ascii=False),
+        "model": LARGE,
+        "cascade_model": SMALL,
+    })
+
+
+async def collect(response) -> list[dict]:
+    records = [json.loads(chunk) async for chunk in response.body_iterator if chunk.strip()]
+    return [r for r in records if "meta" not in r]
+
+
+def check_vote():
+    print("=== TEST 1: голосование выборок ===")
+    samples = [{1: "Quote", 2: "Normal"}, {1: "Quote", 2: "Heading 1"}, {1: "Quote", 2: "Normal", 3: "Bogus"}]
+    votes = vote(samples, [1, 2, 3], set(STYLE_MAP))
+    assert votes[1] == ("Quote", 1.0)
+    assert votes[2][0] == "Normal" and abs(votes[2][1] - 2 / 3) < 1e-9
+    assert votes[3] == (None, 0.0)
+    assert split(votes, 1.0) == ({1: "Quote"}, [2, 3])
+    assert split(votes, 0.6) == ({1: "Quote", 2: "Normal"}, [3])
+    print("✅ PASSED\n")
+
+
+async def check_escalation(proxy_completions):
+    print("=== TEST 2: к большой модели уходят только неуверенные абзацы ===")
+    records = await collect(await proxy_completions(make_request()))
+    by_id = {r["id"]: (r["style_name"], r.get("cascade")) for r in records}
+    print(f"  {by_id}")
+    assert by_id == {1: ("Quote", "small"), 2: ("Heading 1", "escalated"), 3: ("Normal", "escalated")}, by_id
+
+    small_reqs = [c for c in chat_log if c["model"] == SMALL]
+    large_reqs = [c for c in chat_log if c["model"] == LARGE]
+    assert len(small_reqs) == settings.CASCADE_SAMPLES
+    assert small_reqs[0]["format"]["additionalProperties"]["enum"] == sorted(STYLE_MAP)
+    assert small_reqs[0]["options"]["temperature"] == settings.CASCADE_TEMPERATURE
+    assert len(large_reqs) == 1
+    large_prompt = large_reqs[0]["messages"][-1]["content"]
+    assert "[1]" not in large_prompt and "[2]" in large_prompt and "[3]" in large_prompt
+
+    snap = cascade_stats.snapshot()
+    print(f"  cascade metrics: {snap}")
+    assert snap["items"] == 3 and snap["escalated"] == 2
+    print("✅ PASSED\n")
+
+
+async def check_small_failure(proxy_completions):
+    global small_broken
+    print("=== TEST 3: маленькая модель недоступна — эскалируется весь батч ===")
+    chat_log.clear()
+    small_broken = True
+    try:
+        records = await collect(await proxy_completions(make_request()))
+    finally:
+        small_broken = False
+    assert not any("error" in r for r in records), records
+    assert {r["id"]: r.get("cascade") for r in records} == {1: "escalated", 2: "escalated", 3: "escalated"}
+    assert cascade_stats.snapshot()["small_failures"] == 1
+    print("✅ PASSED\n")
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    check_vote()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CascadeOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import proxy_completions
+    from app.services.rag_engine import rag_engine
+
+    rag_engine.search_style_reference = MagicMock(return_value={"source_id": "test_uuid", "style_map": STYLE_MAP})
+    rag_engine.search_batch_fast_track = MagicMock(return_value={})
+
+    ollama_pool.configure([f"http://127.0.0.1:{server.server_address[1]}"])
+    # Тест повторяет одинаковые запросы при разном поведении mock-Ollama — без single-flight
+    settings.SINGLE_FLIGHT = False
+    settings.CASCADE_SAMPLES = 3
+    settings.CASCADE_MIN_CONFIDENCE = 1.0
+    try:
+        await check_escalation(proxy_completions)
+        await check_small_failure(proxy_completions)
+    finally:
+        server.shutdown()
+    print("🎉 Cascade тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
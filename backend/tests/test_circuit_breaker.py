@@ -0,0 +1,227 @@
+"""
+Тест circuit breaker Шага C (services/circuit_breaker.py) на stand-in Ollama:
+ошибки и медленные ответы открывают breaker, открытый breaker не зовёт LLM,
+абзацы получают стиль без LLM с пометкой в потоке, half-open проба закрывает его,
+а узел с открытым breaker'ом пул обходит.
+
+Запуск:
+  poetry run python tests/test_circuit_breaker.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, Breaker, circuit_breakers
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+
+MODEL = "breaker-model:1b"
+state = {"down": True, "chat_calls": 0}
+
+
+class StandInOllama(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, code, obj):
+        payload = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._send_json(200, {"models": []})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/show":
+            self._send_json(200, {"model_info": {"llama.context_length": 8192}})
+            return
+        if self.path == "/api/chat":
+            state["chat_calls"] += 1
+            if state["down"]:
+                self._send_json(500, {"error": "llama runner process has terminated"})
+                return
+            user = body["messages"][-1]["content"]
+            ids = [line.split("]")[0].strip("[") for line in user.splitlines()]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            answer = json.dumps({pid: "Body Text" for pid in ids})
+            self.wfile.write((json.dumps({"message": {"content": answer}}) + "\n").encode())
+            self.wfile.write((json.dumps({"done": True}) + "\n").encode())
+            return
+        self._send_json(404, {})
+
+
+class MockRequest:
+    def __init__(self, json_data):
+        self._json = json_data
+
+    async def json(self):
+        return self._json
+
+    async def is_disconnected(self):
+        return False
+
+
+def make_request() -> MockRequest:
+    return MockRequest({"model": MODEL, "paragraphs": [
+        {"id": 1, "text": "Подрядчик выполняет работы своими силами"},
+        {"id": 2, "text": "Стороны договорились о нижеследующем"},
+    ]})
+
+
+async def collect(response) -> list[dict]:
+    return [json.loads(chunk) async for chunk in response.body_iterator if chunk.strip()]
+
+
+def check_state_machine():
+    print("=== TEST 1: closed → open (ошибки / медленные) → half_open → closed ===")
+    b = Breaker()
+    b.record(True, 0.01)
+    b.record(False)
+    assert b.state == CLOSED
+    assert b.record(False) and b.state == OPEN
+    assert not b.allow() and b.rejected == 1
+
+    time.sleep(settings.BREAKER_OPEN_SEC)
+    # Half-open: пропускается ровно одна проба
+    assert b.allow() and b.state == HALF_OPEN
+    assert not b.allow()
+    b.record(False)
+    assert b.state == OPEN and b.trips == 2
+
+    time.sleep(settings.BREAKER_OPEN_SEC)
+    assert b.allow()
+    b.record(True, 0.01)
+    assert b.state == CLOSED and b.allow()
+
+    slow = Breaker()
+    for _ in range(3):
+        slow.record(True, settings.BREAKER_SLOW_CALL_SEC + 0.01)
+    assert slow.state == OPEN
+    print("✅ PASSED\n")
+
+
+async def check_degradation(proxy_completions):
+    print("=== TEST 2: Ollama падает — документ оформляется без LLM ===")
+    state.update(down=True, chat_calls=0)
+    for attempt in range(settings.BREAKER_MIN_CALLS):
+        records = await collect(await proxy_completions(make_request()))
+        assert not any("error" in r for r in records), records
+        assert records[0]["meta"]["llm_unavailable"] is False
+        assert {"meta": {"llm_unavailable": True}} in records
+        styles = {r["id"]: (r["style_name"], r["fallback"]) for r in records if "id" in r}
+        # Ближе BREAKER_FALLBACK_DISTANCE — стиль эталона, дальше — основной стиль шаблона
+        assert styles == {1: ("Body Text", "vector"), 2: ("Normal", "default")}, styles
+    assert state["chat_calls"] == settings.BREAKER_MIN_CALLS
+    print("✅ PASSED\n")
+
+
+async def check_open_skips_llm(proxy_completions, url: str):
+    print("=== TEST 3: breaker открыт — LLM не вызывается вовсе ===")
+    assert circuit_breakers.is_open(url, MODEL)
+    started = time.perf_counter()
+    records = await collect(await proxy_completions(make_request()))
+    elapsed = time.perf_counter() - started
+    print(f"  degraded batch: {elapsed * 1000:.0f} ms, chat_calls={state['chat_calls']}")
+    assert records[0]["meta"]["llm_unavailable"] is True
+    assert state["chat_calls"] == settings.BREAKER_MIN_CALLS
+    assert {r["id"] for r in records if r.get("fallback")} == {1, 2}
+    print("✅ PASSED\n")
+
+
+async def check_half_open_recovery(proxy_completions, url: str):
+    print("=== TEST 4: Ollama вернулась — half-open проба закрывает breaker ===")
+    state["down"] = False
+    await asyncio.sleep(settings.BREAKER_OPEN_SEC)
+    records = await collect(await proxy_completions(make_request()))
+    assert records[0]["meta"]["llm_unavailable"] is False
+    assert {r["id"]: r["style_name"] for r in records if "id" in r} == {1: "Body Text", 2: "Body Text"}
+    assert not any(r.get("fallback") for r in records)
+    snap = circuit_breakers.snapshot()
+    print(f"  circuit_breaker: {snap}")
+    assert snap["breakers"][f"{MODEL} @ {url}"]["state"] == CLOSED
+    assert snap["degraded_paragraphs"] == 2 * (settings.BREAKER_MIN_CALLS + 1)
+    print("✅ PASSED\n")
+
+
+def check_pool_avoids_open_node(url: str):
+    print("=== TEST 5: пул обходит узел с открытым breaker'ом модели ===")
+    other = "http://127.0.0.1:9"
+    ollama_pool.configure([url, other])
+    breaker = circuit_breakers._get(url, MODEL)
+    for _ in range(settings.BREAKER_MIN_CALLS):
+        breaker.record(False)
+    assert ollama_pool.pick(MODEL).url == other
+    # Другой модели на том же узле breaker не мешает
+    assert url in [n.url for n in ollama_pool.candidates("another:1b")]
+    ollama_pool.configure([url])
+    print("✅ PASSED\n")
+
+
+async def check_disabled(proxy_completions):
+    print("=== TEST 6: CIRCUIT_BREAKER=false — по-старому, ошибка в потоке ===")
+    settings.CIRCUIT_BREAKER = False
+    state["down"] = True
+    records = await collect(await proxy_completions(make_request()))
+    assert records[0]["meta"]["llm_unavailable"] is False and "error" in records[-1]
+    settings.CIRCUIT_BREAKER = True
+    print("✅ PASSED\n")
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import proxy_completions
+    from app.services.rag_engine import rag_engine
+
+    rag_engine.search_style_reference = MagicMock(return_value={
+        "source_id": "test_uuid",
+        "style_map": {"Normal": {}, "Body Text": {}},
+    })
+    rag_engine.search_batch_fast_track = MagicMock(return_value={})
+    rag_engine.search_batch_nearest = MagicMock(return_value={0: ("Body Text", 0.35), 1: ("Body Text", 0.8)})
+
+    ollama_pool.configure([url])
+    settings.SINGLE_FLIGHT = False
+    settings.CIRCUIT_BREAKER = True
+    settings.BREAKER_MIN_CALLS = 3
+    settings.BREAKER_ERROR_RATE = 0.5
+    settings.BREAKER_OPEN_SEC = 0.3
+    settings.BREAKER_SLOW_CALL_SEC = 5.0
+    settings.BREAKER_FALLBACK_DISTANCE = 0.5
+    try:
+        check_state_machine()
+        await check_degradation(proxy_completions)
+        await check_open_skips_llm(proxy_completions, url)
+        await check_half_open_recovery(proxy_completions, url)
+        check_pool_avoids_open_node(url)
+        await check_disabled(proxy_completions)
+    finally:
+        server.shutdown()
+    print("🎉 Circuit breaker тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""
+Тест форматов тела /v1/completions: "paragraphs" верхнего уровня, NDJSON и старый
+prompt с маркером дают одинаковый результат конвейера; битое тело или абзац не {id, text} — 400.
+Батч целиком закрывается Шагом B (mock Fast Track), Ollama не нужна.
+
+Запуск:
+  poetry run python tests/test_completion_request.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from unittest.mock import MagicMock
+
+import httpx
+from fastapi import FastAPI
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.completion_request import PROMPT_MARKER
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+from app.services.single_flight import single_flight
+
+PARAGRAPHS = [{"id": i, "text": f"обычный текст параграфа «{i}»\nс переносом"} for i in range(5)]
+META = {"model": "fmt:1b", "session_id": "fmt"}
+
+
+def bodies() -> dict[str, dict]:
+    ndjson = "\n".join(json.dumps(r, ensure_ascii=False) for r in [META, *PARAGRAPHS]) + "\n"
+    return {
+        "paragraphs": {"json": {**META, "paragraphs": PARAGRAPHS}},
+        "ndjson": {"content": ndjson.encode(), "headers": {"Content-Type": "application/x-ndjson"}},
+        "prompt": {"json": {**META, "prompt": f"{PROMPT_MARKER}\n{json.dumps(PARAGRAPHS)}"}},
+    }
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import router
+    from app.services.rag_engine import rag_engine
+
+    rag_engine.search_style_reference = MagicMock(return_value={"source_id": "tpl", "style_map": {"Normal": {}}})
+    rag_engine.search_batch_fast_track = MagicMock(
+        side_effect=lambda texts, fast_track_distance=0.20: {i: "Normal" for i in range(len(texts))}
+    )
+    ollama_pool.configure(["http://127.0.0.1:9"])
+    # Каждый формат должен пройти конвейер сам, а не повтором предыдущего
+    settings.SINGLE_FLIGHT = False
+
+    app = FastAPI()
+    app.include_router(router)
+    transport = httpx.ASGITransport(app=app)
+
+    print("=== TEST 1: три формата тела — одинаковые абзацы и результат ===")
+    async with httpx.AsyncClient(transport=transport, base_url="http://fmt") as client:
+        results = {}
+        for name, kwargs in bodies().items():
+            rag_engine.search_batch_fast_track.reset_mock()
+            resp = await client.post("/v1/completions", **kwargs)
+            assert resp.status_code == 200, (name, resp.text)
+            texts = rag_engine.search_batch_fast_track.call_args.args[0]
+            assert texts == [p["text"] for p in PARAGRAPHS], (name, texts)
+            results[name] = [json.loads(line) for line in resp.text.splitlines() if line.strip()]
+            print(f"  {name:<10} → {len(results[name])} records")
+        assert results["paragraphs"] == results["ndjson"] == results["prompt"]
+        print("✅ PASSED\n")
+
+        print("=== TEST 2: битое NDJSON-тело — 400 ===")
+        bad = await client.post("/v1/completions", content=b'{"model": "x"}\n{"id": 1, "te',
+                                headers={"Content-Type": "application/x-ndjson"})
+        assert bad.status_code == 400 and "error" in bad.json()
+        empty = await client.post("/v1/completions", content=b"", headers={"Content-Type": "application/x-ndjson"})
+        assert empty.status_code == 400
+        print("✅ PASSED\n")
+
+        print("=== TEST 3: абзац не {id, text} или тело не объект — 400, а не сломанный стрим ===")
+        for kwargs in (
+            {"json": {"model": "x", "paragraphs": ["просто строка"]}},
+            {"json": {"model": "x", "paragraphs": [{"id": 1}]}},
+            {"json": {"model": "x", "paragraphs": [{"id": "1", "text": "a"}]}},
+            {"json": ["не объект"]},
+            {"json": {"model": "x", "prompt": 42}},
+            {"content": b"{broken", "headers": {"Content-Type": "application/json"}},
+            {"content": b'{"model": "x"}\n{"text": "a"}\n', "headers": {"Content-Type": "application/x-ndjson"}},
+        ):
+            resp = await client.post("/v1/completions", **kwargs)
+            assert resp.status_code == 400 and "error" in resp.json(), (kwargs, resp.text)
+        print("✅ PASSED\n")
+
+    print("=== TEST 4: отпечаток single-flight не зависит от формата ===")
+    prints = {single_flight.fingerprint({**META, "paragraphs": PARAGRAPHS}),
+              single_flight.fingerprint({**META, "prompt": "legacy", "paragraphs": PARAGRAPHS})}
+    assert len(prints) == 1
+    assert single_flight.fingerprint({**META, "paragraphs": PARAGRAPHS[:-1]}) not in prints
+    print("✅ PASSED\n")
+
+    print("🎉 Completion request format тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+"""
+Тест подбора num_ctx: ступени, потолок safe_cap и переиспользование уже загруженного контекста.
+
+Запуск:
+  poetry run python tests/test_context_sizing.py
+"""
+
+import os
+import sys
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.context_sizing import ContextSizer, estimate_request_tokens
+
+
+def main():
+    print("🧪 Context sizing")
+    settings.NUM_CTX_BUCKETS = [2048, 4096, 8192, 16384, 32768]
+    sizer = ContextSizer()
+    system = "x" * 400
+
+    small = estimate_request_tokens(system, 20, 3)
+    big = estimate_request_tokens(system, 11000, 60)
+    print(f"  estimate: small={small} big={big}")
+    assert small < 2048 < big
+
+    # Маленький батч — нижняя ступень, а не весь бюджет
+    assert sizer.choose(small, safe_cap=30720) == 2048
+    # Округление вверх до ступени
+    assert sizer.choose(5000, safe_cap=30720) == 8192
+    # Ступень выше потолка → потолок (запрос не влез — capped)
+    assert sizer.choose(20000, safe_cap=14000) == 14000
+    # Не влезает даже в потолок → потолок (и счётчик capped)
+    assert sizer.choose(50000, safe_cap=30720) == 30720
+    # Модель уже загружена с 8192: запросу на 3000 хватает — без перезагрузки
+    assert sizer.choose(3000, safe_cap=30720, loaded_ctx=8192) == 8192
+    # Загруженный контекст больше потолка (RAM просела) — не используем
+    assert sizer.choose(3000, safe_cap=6144, loaded_ctx=8192) == 4096
+
+    snap = sizer.snapshot()
+    print(f"  snapshot: {snap}")
+    assert snap["reused_loaded"] == 1 and snap["capped"] == 2
+
+    print("🎉 Context sizing test passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Тест планирования под дедлайн клиента (services/deadline.py, X-Deadline-Ms):
+в LLM уходят самые неоднозначные абзацы, сколько модель успеет по своей скорости,
+остальные — сразу без LLM; если LLM не уложилась, её ответ на дедлайне не ждём.
+
+Запуск:
+  poetry run python tests/test_deadline.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.batch_planner import batch_planner
+from app.services.circuit_breaker import circuit_breakers
+from app.services.deadline import by_ambiguity, deadline_stats, parse_deadline_ms
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+
+MODEL = "deadline-model:4b"
+state = {"delay": 0.0}
+chat_ids: list[list[int]] = []
+
+PARAGRAPHS = [{"id": i, "text": f"Абзац номер {i} с обычным текстом договора"} for i in range(6)]
+# batch_idx → (стиль ближайшего эталона, расстояние): 4 и 1 — самые неоднозначные
+NEAREST = {
+    0: ("Body Text", 0.30), 1: ("Body Text", 0.70), 2: ("Body Text", 0.25),
+    3: ("Body Text", 0.45), 4: ("Body Text", 0.90), 5: ("Body Text", 0.35),
+}
+
+
+class StandInOllama(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        payload = json.dumps({"models": []}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/show":
+            payload = json.dumps({"model_info": {"llama.context_length": 8192}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        if self.path == "/api/chat":
+            user = body["messages"][-1]["content"]
+            ids = [int(line.split("]")[0].strip("[")) for line in user.splitlines()]
+            chat_ids.append(ids)
+            time.sleep(state["delay"])
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                answer = json.dumps({str(pid): "Heading 2" for pid in ids})
+                self.wfile.write((json.dumps({"message": {"content": answer}}) + "\n").encode())
+                self.wfile.write((json.dumps({"done": True}) + "\n").encode())
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # бэкенд бросил запрос на дедлайне
+            return
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class MockRequest:
+    def __init__(self, json_data, headers=None):
+        self._json = json_data
+        self.headers = headers or {}
+
+    async def json(self):
+        return self._json
+
+    async def is_disconnected(self):
+        return False
+
+
+async def collect(response) -> list[dict]:
+    return [json.loads(chunk) async for chunk in response.body_iterator if chunk.strip()]
+
+
+def check_helpers():
+    print("=== TEST 1: X-Deadline-Ms и порядок по неоднозначности ===")
+    assert parse_deadline_ms(MockRequest({}, {"X-Deadline-Ms": "2500"}), {}) == 2500
+    assert parse_deadline_ms(MockRequest({}), {"deadline_ms": 800}) == 800
+    assert parse_deadline_ms(MockRequest({}, {"X-Deadline-Ms": "soon"}), {}) is None
+    assert parse_deadline_ms(MockRequest({}), {}) is None
+    nearest = {pid: NEAREST[pid] for pid in (0, 1, 2)}
+    ranked = by_ambiguity(PARAGRAPHS[:4], nearest)
+    # Без эталона — самый неоднозначный
+    assert [p["id"] for p in ranked] == [3, 1, 0, 2]
+    print("✅ PASSED\n")
+
+
+async def check_partial_llm(proxy_completions):
+    print("=== TEST 2: в LLM — только то, что модель успеет, самые неоднозначные ===")
+    state["delay"] = 0.0
+    chat_ids.clear()
+    # По наблюдениям модель тратит 0.4 с на абзац: в 1.5 с бюджета (минус резерв) влезают два
+    batch_planner.sec_per_paragraph[MODEL] = 0.4
+    started = time.perf_counter()
+    records = await collect(await proxy_completions(
+        MockRequest({"model": MODEL, "paragraphs": PARAGRAPHS}, {"X-Deadline-Ms": "1500"})
+    ))
+    elapsed = time.perf_counter() - started
+    plan = next(r["meta"]["deadline_plan"] for r in records if "deadline_plan" in r.get("meta", {}))
+    print(f"  plan: {plan}, LLM ids: {chat_ids}, {elapsed * 1000:.0f} ms")
+    assert plan == {"deadline_ms": 1500, "llm": 2, "deferred": 4}
+    assert chat_ids == [[1, 4]]
+
+    results = [r for r in records if "id" in r]
+    assert sorted(r["id"] for r in results) == list(range(6))
+    by_id = {r["id"]: r for r in results}
+    assert by_id[4]["style_name"] == "Heading 2" and "fallback" not in by_id[4]
+    # Отложенные: ближе BREAKER_FALLBACK_DISTANCE — стиль эталона, иначе "Normal"
+    assert by_id[0] == {"id": 0, "style_name": "Body Text", "fallback": "deadline"}
+    assert by_id[3]["fallback"] == "deadline"
+    assert elapsed < 1.5
+    print("✅ PASSED\n")
+
+
+async def check_overrun(proxy_completions):
+    print("=== TEST 3: LLM не уложилась — на дедлайне её не ждём ===")
+    state["delay"] = 3.0
+    chat_ids.clear()
+    batch_planner.sec_per_paragraph[MODEL] = 0.01
+    started = time.perf_counter()
+    records = await collect(await proxy_completions(
+        MockRequest({"model": MODEL, "paragraphs": PARAGRAPHS[:3]}, {"X-Deadline-Ms": "1000"})
+    ))
+    elapsed = time.perf_counter() - started
+    print(f"  {elapsed * 1000:.0f} ms, records: {[r for r in records if 'id' in r]}")
+    assert elapsed < 1.0
+    assert len(chat_ids) == 1
+    assert {r["id"]: r.get("fallback") for r in records if "id" in r} == {0: "deadline", 1: "deadline", 2: "deadline"}
+    # Брошенный на дедлайне вызов — не вина Ollama
+    assert not circuit_breakers.is_open(ollama_pool.primary.url, MODEL)
+    assert len(circuit_breakers.breakers[(ollama_pool.primary.url, MODEL)].calls) == 1
+    snap = deadline_stats.snapshot()
+    print(f"  deadline: {snap}")
+    assert snap["llm_overruns"] == 1 and snap["missed"] == 0 and snap["requests"] == 2
+    print("✅ PASSED\n")
+
+
+async def check_deadline_between_heartbeats(proxy_completions):
+    print("=== TEST 4: дедлайн длиннее HEARTBEAT_INTERVAL — срабатывает вовремя, а не на следующем тике ===")
+    state["delay"] = 4.0
+    chat_ids.clear()
+    settings.HEARTBEAT_INTERVAL = 1.0
+    batch_planner.sec_per_paragraph[MODEL] = 0.01
+    started = time.perf_counter()
+    # Дедлайн LLM — 2.5 с минус резерв = 2.2 с: между тиками 2 и 3 с
+    records = await collect(await proxy_completions(
+        MockRequest({"model": MODEL, "paragraphs": PARAGRAPHS[:3]}, {"X-Deadline-Ms": "2500"})
+    ))
+    elapsed = time.perf_counter() - started
+    settings.HEARTBEAT_INTERVAL = 5.0
+    print(f"  {elapsed * 1000:.0f} ms")
+    assert 2.2 <= elapsed < 2.5
+    assert {r["id"]: r.get("fallback") for r in records if "id" in r} == {0: "deadline", 1: "deadline", 2: "deadline"}
+    print("✅ PASSED\n")
+
+
+async def check_without_deadline(proxy_completions):
+    print("=== TEST 5: без дедлайна — всё в LLM, как раньше ===")
+    state["delay"] = 0.0
+    chat_ids.clear()
+    records = await collect(await proxy_completions(MockRequest({"model": MODEL, "paragraphs": PARAGRAPHS})))
+    assert chat_ids == [list(range(6))]
+    assert all("fallback" not in r for r in records)
+    assert not any("deadline_plan" in r.get("meta", {}) for r in records)
+    print("✅ PASSED\n")
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import proxy_completions
+    from app.services.rag_engine import rag_engine
+
+    rag_engine.search_style_reference = MagicMock(return_value={
+        "source_id": "test_uuid",
+        "style_map": {"Normal": {}, "Body Text": {}, "Heading 2": {}},
+    })
+    rag_engine.search_batch_fast_track = MagicMock(return_value={})
+    rag_engine.search_batch_nearest = MagicMock(side_effect=lambda texts: {
+        idx: NEAREST[int(t.split()[2])] for idx, t in enumerate(texts)
+    })
+
+    ollama_pool.configure([f"http://127.0.0.1:{server.server_address[1]}"])
+    settings.SINGLE_FLIGHT = False
+    settings.DEADLINE_RESERVE_MS = 300
+    settings.BREAKER_FALLBACK_DISTANCE = 0.5
+    settings.NUM_CTX_SIZING = False
+    try:
+        check_helpers()
+        await check_partial_llm(proxy_completions)
+        await check_overrun(proxy_completions)
+        await check_deadline_between_heartbeats(proxy_completions)
+        await check_without_deadline(proxy_completions)
+    finally:
+        server.shutdown()
+    print("🎉 Deadline тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
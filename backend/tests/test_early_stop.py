@@ -0,0 +1,222 @@
+"""
+Тест ранней остановки Шага C (services/early_stop.py) на stand-in Ollama:
+reasoning-модель после готового JSON продолжает «рассуждать» — запрос закрывается,
+как только у всех id есть стиль; thinking-модели уходит "think": false,
+ответ ограничен num_predict по числу id, а проба меряет сэкономленный хвост.
+
+Запуск:
+  poetry run python tests/test_early_stop.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.early_stop import AnswerTracker, chat_limits, early_stop_stats
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+from app.services.prompt_compaction import compaction_stats
+
+MODEL = "reasoner:8b"
+TAIL_TOKENS = 120
+TOKEN_SEC = 0.01
+state = {"payloads": [], "aborted": 0}
+
+
+class StandInOllama(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, obj):
+        payload = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._send_json({"models": []})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/show":
+            self._send_json({
+                "model_info": {"llama.context_length": 8192},
+                "capabilities": ["completion", "thinking"],
+            })
+            return
+        if self.path == "/api/tokenize":
+            # Старая Ollama без /api/tokenize: токены промпта — CPT-оценка token_counter
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.path != "/api/chat":
+            self._send_json({})
+            return
+        state["payloads"].append(body)
+        user = body["messages"][-1]["content"]
+        ids = [line.split("]")[0].strip("[") for line in user.splitlines()]
+        answer = json.dumps({pid: "Body Text" for pid in ids})
+        # Ответ по 4 символа, затем «рассуждения» после JSON — хвост, который не нужен
+        tokens = [answer[i:i + 4] for i in range(0, len(answer), 4)] + [" ok"] * TAIL_TOKENS
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        started = time.perf_counter()
+        try:
+            for token in tokens:
+                self.wfile.write((json.dumps({"message": {"content": token}}) + "\n").encode())
+                self.wfile.flush()
+                time.sleep(TOKEN_SEC)
+            done = {
+                "done": True, "eval_count": len(tokens),
+                "eval_duration": int((time.perf_counter() - started) * 1e9),
+            }
+            self.wfile.write((json.dumps(done) + "\n").encode())
+        except (BrokenPipeError, ConnectionResetError):
+            state["aborted"] += 1   # бэкенд закрыл запрос досрочно
+
+
+class MockRequest:
+    def __init__(self, json_data):
+        self._json = json_data
+
+    async def json(self):
+        return self._json
+
+    async def is_disconnected(self):
+        return False
+
+
+def make_request() -> MockRequest:
+    return MockRequest({"model": MODEL, "paragraphs": [
+        {"id": 1, "text": "Подрядчик выполняет работы своими силами"},
+        {"id": 2, "text": "Стороны договорились о нижеследующем"},
+        {"id": 3, "text": "Настоящий договор вступает в силу с момента подписания"},
+    ]})
+
+
+async def run(proxy_completions) -> tuple[list[dict], float]:
+    started = time.perf_counter()
+    response = await proxy_completions(make_request())
+    records = [json.loads(chunk) async for chunk in response.body_iterator if chunk.strip()]
+    return records, time.perf_counter() - started
+
+
+def check_tracker():
+    print("=== TEST 1: AnswerTracker — ответы для всех id ===")
+    tracker = AnswerTracker([1, 2])
+    assert not tracker.feed('{"1": "Body')
+    assert not tracker.feed('{"1": "Body Text", "2": "Head')
+    assert tracker.feed('{"1": "Body Text", "2": "Heading \\"A\\""')
+    assert tracker.answered_at == 3
+
+    # Пары внутри <think> — не ответ
+    thinking = AnswerTracker([1])
+    assert not thinking.feed('<think>maybe {"1": "Title"}')
+    assert thinking.feed('<think>maybe {"1": "Title"}</think>{"1": "Body Text"')
+
+    assert chat_limits({"capabilities": ["completion", "thinking"]}, 3) == (False, 64 + 32 * 3)
+    assert chat_limits({"capabilities": ["completion"]}, 1) == (None, 96)
+
+    # Модель без хвоста после JSON не обрываем: финальный чанк несёт prompt_eval_count
+    assert early_stop_stats.start("tidy:1b", False) is False   # первый вызов — проба
+    early_stop_stats.record_done("tidy:1b", tracker, {"done": True, "eval_count": 4, "eval_duration": 10**8})
+    assert early_stop_stats.start("tidy:1b", False) is False
+    print("✅ PASSED\n")
+
+
+async def check_probe_then_stop(proxy_completions):
+    print("=== TEST 2: проба меряет хвост, следующий вызов обрывается после JSON ===")
+    probe_records, probe_sec = await run(proxy_completions)
+    snap = early_stop_stats.snapshot()["models"][MODEL]
+    print(f"  probe: {probe_sec * 1000:.0f} ms, {snap}")
+    assert snap["probes"] == 1 and snap["tail_tokens"] >= TAIL_TOKENS
+    assert state["aborted"] == 0
+
+    samples = model_profiles.get(MODEL)["samples"]
+    prompt_tokens = compaction_stats.snapshot()["full"]["prompt_tokens"]
+    records, elapsed = await run(proxy_completions)
+    await asyncio.sleep(0.2)   # stand-in замечает закрытое соединение на следующей записи
+    snap = early_stop_stats.snapshot()["models"][MODEL]
+    print(f"  early stop: {elapsed * 1000:.0f} ms, {snap}")
+    # Финального чанка не было, но скорость генерации и токены промпта учтены
+    assert model_profiles.get(MODEL)["samples"] == samples + 1
+    assert compaction_stats.snapshot()["full"]["prompt_tokens"] > prompt_tokens
+    assert {r["id"]: r["style_name"] for r in records if "id" in r} == {1: "Body Text", 2: "Body Text", 3: "Body Text"}
+    assert {r["id"]: r["style_name"] for r in probe_records if "id" in r} == {1: "Body Text", 2: "Body Text", 3: "Body Text"}
+    assert elapsed < probe_sec - TAIL_TOKENS * TOKEN_SEC / 2
+    assert state["aborted"] == 1
+    assert snap["early_stops"] == 1 and snap["saved_tokens"] >= TAIL_TOKENS and snap["saved_sec"] > 0
+    print("✅ PASSED\n")
+
+
+def check_payload():
+    print("=== TEST 3: thinking-модели — think=false и num_predict по числу id ===")
+    payload = state["payloads"][-1]
+    assert payload["think"] is False
+    assert payload["options"]["num_predict"] == settings.NUM_PREDICT_BASE + settings.NUM_PREDICT_PER_ID * 3
+    print("✅ PASSED\n")
+
+
+async def check_disabled(proxy_completions):
+    print("=== TEST 4: EARLY_STOP=false, LLM_THINK=true — как раньше ===")
+    settings.EARLY_STOP = False
+    settings.LLM_THINK = True
+    aborted = state["aborted"]
+    records, elapsed = await run(proxy_completions)
+    payload = state["payloads"][-1]
+    assert "think" not in payload and "num_predict" not in payload["options"]
+    assert state["aborted"] == aborted and elapsed >= TAIL_TOKENS * TOKEN_SEC
+    assert len([r for r in records if "id" in r]) == 3
+    settings.EARLY_STOP = True
+    settings.LLM_THINK = False
+    print("✅ PASSED\n")
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import proxy_completions
+    from app.services.rag_engine import rag_engine
+
+    rag_engine.search_style_reference = MagicMock(return_value={
+        "source_id": "test_uuid",
+        "style_map": {"Normal": {}, "Body Text": {}},
+    })
+    rag_engine.search_batch_fast_track = MagicMock(return_value={})
+
+    ollama_pool.configure([f"http://127.0.0.1:{server.server_address[1]}"])
+    settings.SINGLE_FLIGHT = False
+    settings.NUM_CTX_SIZING = False
+    settings.EARLY_STOP = True
+    settings.EARLY_STOP_PROBE_EVERY = 20
+    settings.LLM_THINK = False
+    try:
+        check_tracker()
+        await check_probe_then_stop(proxy_completions)
+        check_payload()
+        await check_disabled(proxy_completions)
+    finally:
+        server.shutdown()
+    print("🎉 Early stop тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
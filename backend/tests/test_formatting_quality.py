@@ -15,6 +15,7 @@
   poetry run python tests/test_formatting_quality.py --server http://localhost:8323 --ollama http://192.168.0.107:11434
   poetry run python tests/test_formatting_quality.py --file one_specific.docx   # только один файл
   poetry run python tests/test_formatting_quality.py --model gemma3:12b         # только одна модель
+  poetry run python tests/test_formatting_quality.py --publish                  # leaderboard → роутер "auto"
 """
 
 import sys
@@ -88,13 +89,56 @@ def discover_models(server_url: str) -> list[str]:
         req = urllib.request.Request(url, headers={"User-Agent": "LocalWriter-Test"})
         with urllib.request.urlopen(req, timeout=10) as resp:
             data = json.loads(resp.read().decode())
-            models = [m["name"] for m in data.get("models", [])]
+            # "auto" — алиас роутера бэкенда, а не модель: его точность и так в leaderboard
+            models = [m["name"] for m in data.get("models", []) if m["name"] != "auto"]
             return models
     except Exception as e:
         print(f"❌ Не удалось получить модели: {e}")
         return []
 
 
+def fetch_prompt_tokens(server_url: str) -> int | None:
+    """Сколько входных токенов Шага C Ollama обработала с запуска бэкенда (/api/metrics, prompt_compaction)."""
+    url = f"{server_url.rstrip('/')}/api/metrics"
+    try:
+        with urllib.request.urlopen(url, timeout=10) as resp:
+            modes = json.loads(resp.read().decode()).get("prompt_compaction", {})
+        return sum(m.get("prompt_tokens", 0) for m in modes.values())
+    except Exception:
+        return None
+
+
+def fetch_early_stop(server_url: str) -> dict | None:
+    """Сэкономлено ранней остановкой Шага C с запуска бэкенда (/api/metrics, early_stop): токены и секунды."""
+    url = f"{server_url.rstrip('/')}/api/metrics"
+    try:
+        with urllib.request.urlopen(url, timeout=10) as resp:
+            models = json.loads(resp.read().decode()).get("early_stop", {}).get("models", {})
+        return {
+            "saved_tokens": sum(m.get("saved_tokens", 0) for m in models.values()),
+            "saved_sec": sum(m.get("saved_sec", 0) for m in models.values()),
+        }
+    except Exception:
+        return None
+
+
+def publish_leaderboard(server_url: str, report: dict) -> bool:
+    """Отдаёт leaderboard бэкенду (POST /api/models/leaderboard): по нему выбирает модель алиас "auto"."""
+    url = f"{server_url.rstrip('/')}/api/models/leaderboard"
+    try:
+        req = urllib.request.Request(
+            url, data=json.dumps(report, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            answer = json.loads(resp.read().decode())
+        print(f"🧭 Leaderboard опубликован: {len(answer.get('accepted', {}))} моделей → {url}")
+        return True
+    except Exception as e:
+        print(f"⚠️ Не удалось опубликовать leaderboard: {e}")
+        return False
+
+
 def discover_docx_files(extra_dirs: list[str] | None = None) -> list[str]:
     """Находит все .docx файлы в известных директориях."""
     search_dirs = [TEST_DOCS_DIR]
@@ -394,23 +438,30 @@ def _run_single(
     gt_cache: dict[str, dict],
     server_url: str,
     timeout: int,
+    batch_size: int | None = None,
+    max_chars_per_batch: int | None = None,
+    cascade_model: str | None = None,
+    prompt_compaction: bool = False,
 ) -> dict:
     """
-    Один прогон: модель × файл.
+    Один прогон: модель × файл (cascade_model — маленькая модель каскада перед model,
+    prompt_compaction — в LLM голова абзаца + признаки вместо полного текста).
     Вызывает extension/client.call_apply_template() — точно как расширение LibreOffice.
     GT берётся из кэша (уже предвычислен).
     """
     fname = os.path.basename(file_path)
     cached = gt_cache.get(file_path, {})
+    # В отчёте каскад — отдельный участник: «маленькая→большая»
+    label = _run_label(model, cascade_model, prompt_compaction)
 
     if cached.get("error"):
-        return _error_result(model, fname, f"GT error: {cached['error']}")
+        return _error_result(label, fname, f"GT error: {cached['error']}")
 
     gt = cached.get("gt", [])
     text = cached.get("text", "")
 
     if not gt:
-        return _error_result(model, fname, "Empty GT")
+        return _error_result(label, fname, "Empty GT")
 
     # В новой архитектуре мы передаем список текстов параграфов, чтобы ID совпадали 1к1 с GT
     paragraphs_texts = [r.get("text", "") for r in gt]
@@ -421,6 +472,9 @@ def _run_single(
     result_queue = queue.Queue()
     stop_event = threading.Event()
     
+    # Прогоны последовательные: разница счётчика сервера — входные токены этого прогона
+    prompt_tokens_before = fetch_prompt_tokens(server_url)
+    early_stop_before = fetch_early_stop(server_url)
     start_time = time.time()
 
     # Вызов /v1/completions через NDJSON-бачтер (гибридный клиент)
@@ -432,9 +486,15 @@ def _run_single(
             result_queue=result_queue,
             stop_event=stop_event,
             timeout_per_line=timeout,
+            batch_size=batch_size,
+            max_chars_per_batch=max_chars_per_batch,
+            # Одиночный прогон — явно без каскада, даже если он включён на сервере
+            cascade_model=cascade_model or "",
+            # И явно с/без сжатия промпта: сравнение не зависит от PROMPT_COMPACTION сервера
+            prompt_compaction=prompt_compaction,
         )
     except Exception as e:
-        return _error_result(model, fname, f"API Exception: {e}", time.time() - start_time)
+        return _error_result(label, fname, f"API Exception: {e}", time.time() - start_time)
 
     llm_records = []
     has_error = False
@@ -450,7 +510,7 @@ def _run_single(
                 has_error = True
                 error_msg = item["error"]
                 break
-            if "heartbeat" in item:
+            if "heartbeat" in item or "llm_unavailable" in item:
                 continue
             
             llm_records.append(item)
@@ -464,30 +524,47 @@ def _run_single(
     elapsed = time.time() - start_time
 
     if has_error:
-        return _error_result(model, fname, f"Stream Error: {error_msg}", elapsed)
+        return _error_result(label, fname, f"Stream Error: {error_msg}", elapsed)
 
     if not llm_records:
-        return _error_result(model, fname, "No JSON generated", elapsed)
+        return _error_result(label, fname, "No JSON generated", elapsed)
 
     # Оценка качества форматирования
     metrics = evaluate(gt, llm_records)
     
     # Если результат нулевой, выводим сырой ответ для отладки
     if metrics.get("overall_score", 0) == 0:
-        print(f"\n⚠️  [DEBUG] Model {model} failed on {fname}. RAW response from /tmp/localwriter_raw.log:")
+        print(f"\n⚠️  [DEBUG] Model {label} failed on {fname}. RAW response from /tmp/localwriter_raw.log:")
         try:
             if os.path.exists('/tmp/localwriter_raw.log'):
                 with open('/tmp/localwriter_raw.log', 'r') as f:
                     log_tail = f.readlines()[-20:] # Последние 20 строк
                     print("".join(log_tail))
         except: pass
-    metrics["model"] = model
+    metrics["model"] = label
     metrics["file"] = fname
     metrics["elapsed_sec"] = round(elapsed, 1)
     metrics["status"] = "OK"
     metrics["rag_found"] = bool(rag_template_id)
     metrics["rag_template_id"] = rag_template_id or ""
 
+    # Каскад: какая доля ответов LLM потребовала большой модели
+    tiers = [r.get("cascade") for r in llm_records if r.get("cascade")]
+    metrics["escalated_pct"] = round(tiers.count("escalated") / len(tiers) * 100, 1) if tiers else None
+
+    prompt_tokens_after = fetch_prompt_tokens(server_url)
+    metrics["prompt_tokens"] = (
+        prompt_tokens_after - prompt_tokens_before
+        if prompt_tokens_before is not None and prompt_tokens_after is not None else None
+    )
+    # Ранняя остановка: сколько токенов/секунд генерации не потратили (оценка бэкенда по пробам)
+    early_stop_after = fetch_early_stop(server_url)
+    for key in ("saved_tokens", "saved_sec"):
+        metrics[key] = (
+            round(early_stop_after[key] - early_stop_before[key], 1)
+            if early_stop_before is not None and early_stop_after is not None else None
+        )
+
     # Проверка UNO-совместимости (поля, которые ожидает uno_formatter.apply_structure)
     uno_info = validate_uno_fields(llm_records)
     metrics["uno_compat_pct"] = uno_info["compat_pct"]
@@ -499,6 +576,11 @@ def _run_single(
 
 
 
+def _run_label(model: str, cascade_model: str | None = None, prompt_compaction: bool = False) -> str:
+    label = f"{cascade_model}→{model}" if cascade_model else model
+    return f"{label} [compact]" if prompt_compaction else label
+
+
 def _append_model_section(
     report_path: str,
     model_results: list[dict],
@@ -508,16 +590,20 @@ def _append_model_section(
     Дописывает в Markdown-отчёт секцию с результатами для одной модели.
     """
     lines = [f"## 🤖 Модель: `{model_name}`", ""]
-    lines.append("| Файл | Status | RAG | Coverage | Score | UNO% | Time |")
-    lines.append("|---|---|---|---|---|---|---|")
+    lines.append("| Файл | Status | RAG | Coverage | Score | UNO% | Escalated | Prompt tok | Time |")
+    lines.append("|---|---|---|---|---|---|---|---|---|")
     for r in model_results:
         icon = "✅" if r["status"] == "OK" else "❌"
         rag_icon = "✅" if r.get("rag_found") else "✖️"
+        escalated = f"{r['escalated_pct']:.1f}%" if r.get("escalated_pct") is not None else "—"
+        prompt_tokens = r["prompt_tokens"] if r.get("prompt_tokens") is not None else "—"
         lines.append(
             f"| `{r['file']}` | {icon} {r['status']} | {rag_icon} | "
             f"{r.get('text_coverage_pct', 0):.1f}% | "
             f"{r.get('overall_score', 0):.1f}% | "
             f"{r.get('uno_compat_pct', 0):.0f}% | "
+            f"{escalated} | "
+            f"{prompt_tokens} | "
             f"{r.get('elapsed_sec', 0):.1f}s |"
         )
     lines.append("")
@@ -533,6 +619,10 @@ def run_contest(
     timeout: int,
     workers: int = 4,
     report_path: str | None = None,
+    batch_size: int | None = None,
+    max_chars_per_batch: int | None = None,
+    cascade_model: str | None = None,
+    prompt_compaction: bool = False,
 ) -> list[dict]:
     """
     Прогон контеста в 3 фазы:
@@ -540,6 +630,10 @@ def run_contest(
       2. [GT]     параллельное извлечение ground truth (/api/extract_ground_truth)
       3. [LLM]   последовательные вызовы /v1/completions
     Все HTTP-вызовы через extension/client.py.
+    cascade_model: каждая модель прогоняется ещё и как «cascade_model→модель»
+    (сравнение латентности и качества каскада с одиночной моделью).
+    prompt_compaction: каждая модель прогоняется ещё и как «модель [compact]»
+    (входные токены, время и качество со сжатым промптом Шага C).
     """
     # Фаза 1: INGEST (наполняем RAG-индекс)
     ingest_documents(files, server_url, workers=workers)
@@ -548,7 +642,12 @@ def run_contest(
     gt_cache = precompute_all_gt(files, server_url, workers=workers)
 
     # Фаза 3: ПОСЛЕДОВАТЕЛЬНЫЕ LLM вызовы
-    total_runs = len(models) * len(files)
+    runs = [(m, None, False) for m in models]
+    if cascade_model:
+        runs += [(m, cascade_model, False) for m in models if m != cascade_model]
+    if prompt_compaction:
+        runs += [(m, None, True) for m in models]
+    total_runs = len(runs) * len(files)
     results: list[dict] = []
     start_time = time.time()
 
@@ -564,7 +663,8 @@ def run_contest(
         colour="green",
     )
 
-    for model in models:
+    for requested_model, run_cascade, run_compact in runs:
+        model = _run_label(requested_model, run_cascade, run_compact)
         pbar.set_postfix_str(f"🤖 {model}")
         model_results: list[dict] = []
 
@@ -573,8 +673,12 @@ def run_contest(
             pbar.set_postfix_str(f"📄 {fname[:25]} × {model}")
 
             result = _run_single(
-                model, file_path, gt_cache,
+                requested_model, file_path, gt_cache,
                 server_url, timeout,
+                batch_size=batch_size,
+                max_chars_per_batch=max_chars_per_batch,
+                cascade_model=run_cascade,
+                prompt_compaction=run_compact,
             )
             results.append(result)
             model_results.append(result)
@@ -586,9 +690,13 @@ def run_contest(
                 score = result.get('overall_score', 0)
                 uno = result.get('uno_compat_pct', 0)
                 rag = "✅" if result.get('rag_found') else "✖️"
+                esc = f" Esc={result['escalated_pct']:.1f}%" if result.get('escalated_pct') is not None else ""
+                tok = f" PromptTok={result['prompt_tokens']}" if result.get('prompt_tokens') is not None else ""
+                tok += f" Saved={result['saved_tokens']:.0f}tok/{result['saved_sec']:.1f}s" if result.get('saved_tokens') else ""
                 tqdm.write(
                     f"  ✅ {model} × {fname} | "
-                    f"RAG={rag} Cov={cov:.1f}% Score={score:.1f}% UNO={uno:.0f}%"
+                    f"RAG={rag} Cov={cov:.1f}% Score={score:.1f}% UNO={uno:.0f}%{esc}{tok} "
+                    f"Time={result.get('elapsed_sec', 0):.1f}s"
                 )
             else:
                 tqdm.write(f"  ❌ {model} × {fname} | {status}")
@@ -727,14 +835,56 @@ def _infographic_summary(leaderboard: list[dict], results: list[dict]) -> list[s
     return lines
 
 
+def _compaction_comparison(leaderboard: list[dict]) -> list[str]:
+    """Модель с полным промптом против «модель [compact]»: входные токены, время, Score."""
+    by_model = {lb["model"]: lb for lb in leaderboard}
+    pairs = [(by_model[m[:-len(" [compact]")]], lb) for m, lb in by_model.items()
+             if m.endswith(" [compact]") and m[:-len(" [compact]")] in by_model]
+    if not pairs:
+        return []
+
+    def _delta_pct(new, old) -> str:
+        return f"{(new - old) / old * 100:+.1f}%" if new is not None and old else "—"
+
+    lines = ["### ✂️ Сжатие промпта Шага C (полный → compact)", "", "```"]
+    lines.append(f"{'Модель':<32} {'Prompt tok':>16} {'Time':>16} {'Score':>16}")
+    lines.append("-" * 84)
+    for full, compact in pairs:
+        tokens = f"{full['avg_prompt_tokens'] or 0}→{compact['avg_prompt_tokens'] or 0}"
+        lines.append(
+            f"{full['model'][:31]:<32} "
+            f"{tokens:>9} {_delta_pct(compact['avg_prompt_tokens'], full['avg_prompt_tokens']):>6} "
+            f"{full['avg_time_sec']:>5.1f}→{compact['avg_time_sec']:<5.1f} {_delta_pct(compact['avg_time_sec'], full['avg_time_sec']):>4} "
+            f"{full['avg_overall']:>5.1f}→{compact['avg_overall']:<5.1f} {compact['avg_overall'] - full['avg_overall']:+.1f}"
+        )
+    lines += ["```", ""]
+    return lines
+
+
+def _early_stop_summary(leaderboard: list[dict]) -> list[str]:
+    """Сколько генерации сэкономила ранняя остановка Шага C — по моделям."""
+    rows = [lb for lb in leaderboard if lb.get("saved_tokens")]
+    if not rows:
+        return []
+    lines = ["### ⏹️ Ранняя остановка Шага C (сэкономлено за контест)", "", "```"]
+    lines.append(f"{'Модель':<32} {'Tokens':>10} {'Seconds':>10}")
+    lines.append("-" * 54)
+    for lb in rows:
+        lines.append(f"{lb['model'][:31]:<32} {lb['saved_tokens']:>10} {lb['saved_sec']:>10.1f}")
+    lines += ["```", ""]
+    return lines
+
+
 def save_contest_report(
     results: list[dict],
     output_dir: str,
     realtime_path: str | None = None,
+    publish_to: str | None = None,
 ) -> str:
     """
     Генерирует итоговый Markdown leaderboard, инфографику и JSON дамп.
     Если realtime_path указан — добавляет сводку поверх уже записанного файла.
+    publish_to — URL бэкенда, которому отдать leaderboard для алиаса "auto".
     """
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     md_path = realtime_path or os.path.join(output_dir, f"contest_{ts}.md")
@@ -766,6 +916,9 @@ def save_contest_report(
             sum(r["elapsed_sec"] for r in ok_runs) / len(ok_runs)
             if ok_runs else 0
         )
+        token_runs = [r["prompt_tokens"] for r in ok_runs if r.get("prompt_tokens") is not None]
+        avg_prompt_tokens = sum(token_runs) / len(token_runs) if token_runs else None
+        saved_runs = [r for r in ok_runs if r.get("saved_tokens") is not None]
 
         leaderboard.append({
             "model": model,
@@ -776,6 +929,9 @@ def save_contest_report(
             "avg_overall": round(avg_overall, 1),
             "avg_elements": round(avg_elements, 1),
             "avg_time_sec": round(avg_time, 1),
+            "avg_prompt_tokens": round(avg_prompt_tokens) if avg_prompt_tokens is not None else None,
+            "saved_tokens": round(sum(r["saved_tokens"] for r in saved_runs)) if saved_runs else None,
+            "saved_sec": round(sum(r["saved_sec"] for r in saved_runs), 1) if saved_runs else None,
         })
 
     # Сортировка: лучшие сверху (coverage * overall)
@@ -805,6 +961,8 @@ def save_contest_report(
 
     # --- Инфографика (сводка) ---
     infographic_lines = _infographic_summary(leaderboard, results)
+    compaction_lines = _compaction_comparison(leaderboard) + _early_stop_summary(leaderboard)
+    infographic_lines += compaction_lines
 
     # --- Разделитель перед детальными прогонами ---
     detail_lines = ["", "## Детали по прогонам", ""]
@@ -887,6 +1045,8 @@ def save_contest_report(
 
     print(f"\n📊 Отчёт: {md_path}")
     print(f"📦 JSON:  {json_path}")
+    if publish_to:
+        publish_leaderboard(publish_to, json_data)
 
     # --- Консольный leaderboard с инфографикой ---
     W = 70
@@ -905,6 +1065,9 @@ def save_contest_report(
             f"{bar_score} {lb['avg_overall']:5.1f}%"
         )
     print(f"{'='*W}")
+    for line in compaction_lines:
+        if not line.startswith("```"):
+            print(f"  {line}")
 
     return md_path
 
@@ -927,6 +1090,12 @@ def main():
                         help="Лимит файлов (0 = без лимита)")
     parser.add_argument("--workers", "-w", type=int, default=4,
                         help="Количество параллельных потоков (ingest/GT)")
+    parser.add_argument("--cascade", default=None,
+                        help="Маленькая модель каскада: каждая модель прогоняется ещё и как 'cascade→модель'")
+    parser.add_argument("--compact", action="store_true",
+                        help="Каждая модель прогоняется ещё и со сжатым промптом Шага C ('модель [compact]')")
+    parser.add_argument("--publish", action="store_true",
+                        help="Отдать leaderboard бэкенду: по нему модель 'auto' выбирает самую быструю точную модель")
     args = parser.parse_args()
 
     print("🏁 FORMATTING QUALITY CONTEST")
@@ -934,12 +1103,19 @@ def main():
 
     config_path = os.path.join(os.path.dirname(__file__), "test_config.json")
     excluded_models = ["translategemma:12b", "translategemma:latest"]
+    # Верхние границы батча для клиента (иначе — только совет бэкенда /api/batch_plan)
+    batch_size = None
+    max_chars_per_batch = None
     try:
         if os.path.exists(config_path):
             with open(config_path, "r", encoding="utf-8") as f:
                 cfg = json.load(f)
                 excluded_models = cfg.get("excluded_models", excluded_models)
                 args.server = cfg.get("server_url", args.server)
+                batch_size = cfg.get("batch_size_paragraphs")
+                max_chars_per_batch = cfg.get("max_chars_per_batch")
+                args.cascade = args.cascade or cfg.get("cascade_model")
+                args.compact = args.compact or bool(cfg.get("prompt_compaction"))
                 print(f"   🔧 Config loaded (excluded: {len(excluded_models)})")
     except Exception:
         pass
@@ -984,7 +1160,13 @@ def main():
     for f in files:
         print(f"   - {os.path.basename(f)}")
 
-    print(f"\n📐 Всего прогонов: {len(models)} × {len(files)} = {len(models) * len(files)}")
+    n_runs = len(models) + (len([m for m in models if m != args.cascade]) if args.cascade else 0)
+    n_runs += len(models) if args.compact else 0
+    if args.cascade:
+        print(f"\n🪜 Каскад: {args.cascade} → каждая модель (сравнение с одиночными прогонами)")
+    if args.compact:
+        print("\n✂️ Сжатие промпта: каждая модель ещё и как 'модель [compact]'")
+    print(f"\n📐 Всего прогонов: {n_runs} × {len(files)} = {n_runs * len(files)}")
     print(f"   Timeout: {args.timeout}s | Workers: {args.workers}")
     print(f"   Extension client: {EXTENSION_DIR}/client.py")
 
@@ -1003,11 +1185,16 @@ def main():
         timeout=args.timeout,
         workers=args.workers,
         report_path=realtime_report_path,
+        batch_size=batch_size,
+        max_chars_per_batch=max_chars_per_batch,
+        cascade_model=args.cascade,
+        prompt_compaction=args.compact,
     )
 
     # --- Итоговый отчёт (перезапишет файл, добавив шапку + инфографику) ---
     if results:
-        save_contest_report(results, REPORTS_DIR, realtime_path=realtime_report_path)
+        save_contest_report(results, REPORTS_DIR, realtime_path=realtime_report_path,
+                            publish_to=args.server if args.publish else None)
     else:
         print("❌ Нет результатов — выходим с ошибкой")
         sys.exit(1)
@@ -0,0 +1,280 @@
+"""
+Тест независимого heartbeat: медленная mock-Ollama молчит дольше, чем интервал heartbeat
+(эмуляция prefill на CPU), а бэкенд всё равно шлёт клиенту " \\n" по расписанию.
+Плюс: поток отдаётся до медленного RAG, а результаты стадий идут по мере готовности.
+
+Запуск:
+  poetry run python tests/test_heartbeat.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+from app.services.ollama_client import stream_chat
+from app.services.streaming import with_heartbeats, HEARTBEAT
+
+PREFILL_DELAY = 1.5      # сколько mock-Ollama молчит перед первым чанком
+HEARTBEAT_INTERVAL = 0.2
+RAG_DELAY = 0.6          # сколько «думают» поиск шаблона и Vector Fast Track в TEST 5
+
+
+class SlowOllamaHandler(BaseHTTPRequestHandler):
+    """Mock Ollama: /api/show отвечает сразу, /api/chat — после долгого 'prefill'."""
+
+    def log_message(self, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        body = self._read_json()
+        if self.path == "/api/show":
+            payload = json.dumps({"model_info": {"llama.context_length": 8192}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        if self.path == "/api/chat":
+            # Ollama не отдаёт даже заголовки, пока модель не прожуёт промпт
+            time.sleep(PREFILL_DELAY)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            ids = [line.split("]")[0].strip("[") for line in body["messages"][-1]["content"].splitlines()]
+            answer = json.dumps({pid: "Normal" for pid in ids})
+            for piece in (answer[: len(answer) // 2], answer[len(answer) // 2 :]):
+                self.wfile.write((json.dumps({"message": {"content": piece}}) + "\n").encode())
+                self.wfile.flush()
+            self.wfile.write((json.dumps({"done": True}) + "\n").encode())
+            return
+
+        self.send_response(404)
+        self.end_headers()
+
+
+def start_mock_ollama() -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+async def check_stream_chat_heartbeats(ollama_url: str):
+    print("=== TEST 1: with_heartbeats поверх stream_chat ===")
+    payload = {"model": "slow", "messages": [{"role": "user", "content": "[1] text"}], "stream": True}
+
+    heartbeats_before_first_chunk = 0
+    chunks = []
+    async for item in with_heartbeats(stream_chat(ollama_url, payload), HEARTBEAT_INTERVAL):
+        if item is HEARTBEAT:
+            if not chunks:
+                heartbeats_before_first_chunk += 1
+            continue
+        chunks.append(item)
+
+    print(f"  heartbeats до первого чанка: {heartbeats_before_first_chunk}, чанков: {len(chunks)}")
+    expected = int(PREFILL_DELAY / HEARTBEAT_INTERVAL) - 2
+    assert heartbeats_before_first_chunk >= expected, "Heartbeat не шёл во время prefill"
+    assert chunks and chunks[-1].get("done"), "Поток Ollama должен дойти до done"
+    print("✅ PASSED\n")
+
+
+async def check_upstream_error_propagates():
+    print("=== TEST 2: ошибка upstream пробрасывается потребителю ===")
+
+    async def broken():
+        await asyncio.sleep(0.3)
+        raise RuntimeError("boom")
+        yield  # pragma: no cover
+
+    got_heartbeat = False
+    try:
+        async for item in with_heartbeats(broken(), 0.1):
+            got_heartbeat = got_heartbeat or item is HEARTBEAT
+        raise AssertionError("Ожидалось исключение")
+    except RuntimeError as e:
+        assert str(e) == "boom"
+    assert got_heartbeat
+    print("✅ PASSED\n")
+
+
+async def check_outer_cancel_propagates():
+    print("=== TEST 3: отмена потребителя во время закрытия upstream не теряется ===")
+
+    async def slow_close():
+        try:
+            yield 1
+            await asyncio.sleep(10)
+        finally:
+            await asyncio.sleep(0.3)   # закрытие соединения с Ollama тоже не мгновенное
+
+    continued = []
+
+    async def consumer():
+        ticks = with_heartbeats(slow_close(), 5)
+        async for _ in ticks:
+            break
+        await ticks.aclose()   # ждёт насос ~0.3 с — тут нас и отменяют
+        continued.append(True)
+        await asyncio.sleep(10)
+
+    task = asyncio.create_task(consumer())
+    await asyncio.sleep(0.1)
+    task.cancel()
+    await asyncio.wait({task}, timeout=2)
+    assert task.cancelled() and not continued, "Отмена снаружи проглочена в finally with_heartbeats"
+    print("✅ PASSED\n")
+
+
+async def check_proxy_completions(ollama_url: str):
+    print("=== TEST 4: proxy_completions не молчит во время prefill ===")
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import proxy_completions
+    from app.services.rag_engine import rag_engine
+
+    class MockRequest:
+        def __init__(self, json_data):
+            self._json = json_data
+
+        async def json(self):
+            return self._json
+
+        async def is_disconnected(self):
+            return False
+
+    paragraphs = [{"id": i, "text": f"Обычный текст параграфа номер {i}"} for i in range(3)]
+    req = MockRequest({
+        "prompt": "=== USER CONTENT (CONTENT SOURCE) ===\n" + json.dumps(paragraphs),
+        "model": "slow-model",
+    })
+
+    rag_engine.search_style_reference = MagicMock(return_value={
+        "source_id": "test_uuid",
+        "style_map": {"Normal": {"type": "paragraph"}},
+    })
+    rag_engine.search_batch_fast_track = MagicMock(return_value={})
+
+    ollama_pool.configure([ollama_url])
+    settings.HEARTBEAT_INTERVAL = HEARTBEAT_INTERVAL
+
+    response = await proxy_completions(req)
+
+    heartbeats = 0
+    ids = set()
+    first_id_at = None
+    start = time.time()
+    async for chunk in response.body_iterator:
+        if not chunk.strip():
+            heartbeats += 1
+            continue
+        data = json.loads(chunk)
+        assert "error" not in data, data
+        if "meta" in data:
+            continue
+        ids.add(data["id"])
+        first_id_at = first_id_at or time.time() - start
+
+    print(f"  heartbeats: {heartbeats}, ids: {sorted(ids)}, первый результат через {first_id_at:.1f}s")
+    assert ids == {0, 1, 2}
+    assert heartbeats >= int(PREFILL_DELAY / HEARTBEAT_INTERVAL) - 2
+    print("✅ PASSED\n")
+
+
+async def check_stream_before_rag(ollama_url: str):
+    print("=== TEST 5: поток отдаётся до RAG, стадии — по готовности, X-Degraded-Mode — сразу ===")
+    from app.api.endpoints import proxy_completions
+    from app.services.rag_engine import rag_engine
+
+    class MockRequest:
+        def __init__(self, json_data):
+            self._json = json_data
+
+        async def json(self):
+            return self._json
+
+        async def is_disconnected(self):
+            return False
+
+    def slow_template(query):
+        time.sleep(RAG_DELAY)
+        return {"source_id": "slow_uuid", "style_map": {"Normal": {}, "Heading 1": {}}}
+
+    def slow_fast_track(texts, fast_track_distance=0.20):
+        time.sleep(RAG_DELAY)
+        return {i: "Normal" for i in range(len(texts))}
+
+    rag_engine.search_style_reference = MagicMock(side_effect=slow_template)
+    rag_engine.search_batch_fast_track = MagicMock(side_effect=slow_fast_track)
+    ollama_pool.configure([ollama_url])
+    settings.HEARTBEAT_INTERVAL = HEARTBEAT_INTERVAL
+
+    paragraphs = [{"id": 0, "text": "ЗАГОЛОВОК ДОГОВОРА"}] + [
+        {"id": i, "text": f"Обычный текст параграфа номер {i}"} for i in range(1, 3)
+    ]
+    start = time.time()
+    response = await proxy_completions(MockRequest({"model": "slow-model", "paragraphs": paragraphs}))
+    returned_after = time.time() - start
+
+    first_byte_at = None
+    arrivals = []   # (секунда, запись)
+    async for chunk in response.body_iterator:
+        first_byte_at = first_byte_at if first_byte_at is not None else time.time() - start
+        if chunk.strip():
+            arrivals.append((time.time() - start, json.loads(chunk)))
+
+    print(f"  ответ через {returned_after * 1000:.0f} ms, первый байт через {first_byte_at * 1000:.0f} ms")
+    for at, record in arrivals:
+        print(f"    {at:.2f}s {record}")
+    assert returned_after < 0.1 and first_byte_at < 0.1
+    assert arrivals[0][1]["meta"]["template_id"] == "slow_uuid"
+    heading_at = next(at for at, r in arrivals if r.get("id") == 0)
+    vector_at = max(at for at, r in arrivals if r.get("id") in (1, 2))
+    # Эвристика Шага A ушла сразу после шаблона, не дожидаясь Vector Fast Track
+    assert heading_at < RAG_DELAY * 1.5 < vector_at, (heading_at, vector_at)
+    assert "x-degraded-mode" not in response.headers
+
+    # Давление на память известно до RAG — заголовок X-Degraded-Mode есть сразу
+    settings.memory_pressure = True
+    try:
+        response = await proxy_completions(MockRequest({"model": "slow-model", "paragraphs": paragraphs[1:]}))
+        assert response.headers["x-degraded-mode"] == "true"
+        await response.body_iterator.aclose()
+    finally:
+        settings.memory_pressure = False
+    print("✅ PASSED\n")
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    server, ollama_url = start_mock_ollama()
+    try:
+        await check_stream_chat_heartbeats(ollama_url)
+        await check_upstream_error_propagates()
+        await check_outer_cancel_propagates()
+        await check_proxy_completions(ollama_url)
+        await check_stream_before_rag(ollama_url)
+    finally:
+        server.shutdown()
+    print("🎉 Heartbeat тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
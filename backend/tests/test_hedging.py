@@ -0,0 +1,196 @@
+"""
+Тест hedged requests Шага C (services/hedging.py) на двух stand-in Ollama:
+основной узел «залип» до первого токена — дубль на другом узле проходит тот же путь,
+что и основной запрос (резидентность, num_ctx узла, circuit breaker), а ответ стримится
+от того, кто первым прислал токен, не дожидаясь конца его генерации.
+
+Запуск:
+  poetry run python tests/test_hedging.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.circuit_breaker import circuit_breakers
+from app.services.hedging import hedge_policy, hedged_chat
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+
+MODEL = "hedge-model:4b"
+STALL_SEC = 1.5     # основной узел молчит столько до первого токена
+TAIL_SEC = 0.6      # узел хеджа после первого токена дописывает ответ столько
+
+
+def make_handler(first_token_sec: float, tail_sec: float, payloads: list):
+    class StandInOllama(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, obj):
+            payload = json.dumps(obj).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._send_json({"models": []})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/api/show":
+                self._send_json({"model_info": {"llama.context_length": 8192}})
+                return
+            if self.path != "/api/chat":
+                self._send_json({})
+                return
+            payloads.append(body)
+            user = body["messages"][-1]["content"]
+            ids = [line.split("]")[0].strip("[") for line in user.splitlines()]
+            answer = json.dumps({pid: "Body Text" for pid in ids})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            try:
+                time.sleep(first_token_sec)
+                self.wfile.write((json.dumps({"message": {"content": answer[:2]}}) + "\n").encode())
+                self.wfile.flush()
+                time.sleep(tail_sec)
+                self.wfile.write((json.dumps({"message": {"content": answer[2:]}}) + "\n").encode())
+                self.wfile.write((json.dumps({"done": True}) + "\n").encode())
+            except (BrokenPipeError, ConnectionResetError):
+                pass   # проигравший запрос закрыт бэкендом
+
+    return StandInOllama
+
+
+def start_server(first_token_sec: float, tail_sec: float) -> tuple[ThreadingHTTPServer, str, list]:
+    payloads = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(first_token_sec, tail_sec, payloads))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", payloads
+
+
+class MockRequest:
+    def __init__(self, json_data):
+        self._json = json_data
+
+    async def json(self):
+        return self._json
+
+    async def is_disconnected(self):
+        return False
+
+
+def make_request() -> MockRequest:
+    return MockRequest({"model": MODEL, "paragraphs": [
+        {"id": 1, "text": "Подрядчик выполняет работы своими силами"},
+        {"id": 2, "text": "Стороны договорились о нижеследующем"},
+    ]})
+
+
+async def check_streams_first_token(stalled_url: str, fast_url: str):
+    print("=== TEST 1: стрим идёт от первого ответившего, не после конца гонки ===")
+    stalled, fast = ollama_pool.get(stalled_url), ollama_pool.get(fast_url)
+    opened = []
+
+    @asynccontextmanager
+    async def open_node(node):
+        opened.append(node.url)
+        yield {"model": MODEL, "messages": [{"role": "user", "content": "[1] Текст"}], "stream": True, "options": {}}
+
+    payload = {"model": MODEL, "messages": [{"role": "user", "content": "[1] Текст"}], "stream": True, "options": {}}
+    wins = hedge_policy.hedge_wins
+    hedge_policy.record_request()   # как /v1/completions перед Шагом C
+    started = time.perf_counter()
+    arrivals = []
+    async for chunk in hedged_chat(MODEL, payload, stalled, 100, open_node=open_node):
+        arrivals.append((time.perf_counter() - started, chunk))
+    first_at, total = arrivals[0][0], arrivals[-1][0]
+    print(f"  first chunk {first_at * 1000:.0f} ms, last {total * 1000:.0f} ms")
+    assert opened == [fast.url]
+    assert hedge_policy.hedge_wins == wins + 1
+    # Первый чанк — вскоре после хеджа, а не через TAIL_SEC, когда хедж досчитает
+    assert first_at < settings.HEDGE_MIN_DELAY + TAIL_SEC / 2 < total
+    assert arrivals[-1][1].get("done")
+    print("✅ PASSED\n")
+
+
+async def check_same_path(proxy_completions, fast_url: str, fast_payloads: list):
+    print("=== TEST 2: хедж через /v1/completions — резидентность, num_ctx и breaker узла ===")
+    from app.services.llm_checker import get_safe_context
+
+    fast = ollama_pool.get(fast_url)
+    fast_payloads.clear()
+    requests = hedge_policy.requests
+    response = await proxy_completions(make_request())
+    records = [json.loads(chunk) async for chunk in response.body_iterator if chunk.strip()]
+    assert {r["id"]: r["style_name"] for r in records if "id" in r} == {1: "Body Text", 2: "Body Text"}
+    assert hedge_policy.requests == requests + 1
+
+    # Резидентность: запрос регистрировался на узле хеджа и отпущен
+    assert fast.residency.in_flight.get(MODEL) == 0
+    # num_ctx — бюджет узла хеджа, keep_alive — его же
+    budget, _ = await get_safe_context(MODEL, fast_url)
+    assert fast_payloads[-1]["options"]["num_ctx"] == budget
+    assert fast_payloads[-1]["keep_alive"] == fast.residency.keep_alive_for(MODEL)
+    # Breaker (узел хеджа, модель) учёл успешный вызов
+    breaker = circuit_breakers.snapshot()["breakers"][f"{MODEL} @ {fast_url}"]
+    print(f"  hedging: {hedge_policy.snapshot()}")
+    print(f"  breaker: {breaker}")
+    assert breaker["window_calls"] == 1 and breaker["window_errors"] == 0
+    print("✅ PASSED\n")
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    stalled_server, stalled_url, _ = start_server(STALL_SEC, 0.0)
+    fast_server, fast_url, fast_payloads = start_server(0.0, TAIL_SEC)
+
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import proxy_completions
+    from app.services.rag_engine import rag_engine
+
+    rag_engine.search_style_reference = MagicMock(return_value={
+        "source_id": "test_uuid",
+        "style_map": {"Normal": {}, "Body Text": {}},
+    })
+    rag_engine.search_batch_fast_track = MagicMock(return_value={})
+
+    # Основной — первый узел (пул пуст, нагрузка равная)
+    ollama_pool.configure([stalled_url, fast_url])
+    settings.SINGLE_FLIGHT = False
+    settings.NUM_CTX_SIZING = False
+    settings.EARLY_STOP = False
+    settings.HEDGE_ENABLED = True
+    settings.HEDGE_MIN_SAMPLES = 3
+    settings.HEDGE_MIN_DELAY = 0.2
+    settings.HEDGE_MAX_FRACTION = 1.0
+    for _ in range(settings.HEDGE_MIN_SAMPLES):
+        hedge_policy.record_first_token(MODEL, 0.05)
+    try:
+        await check_streams_first_token(stalled_url, fast_url)
+        await check_same_path(proxy_completions, fast_url, fast_payloads)
+    finally:
+        stalled_server.shutdown()
+        fast_server.shutdown()
+    print("🎉 Hedging тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,11 +5,13 @@ from unittest.mock import patch, MagicMock
 
 import sys
 import os
+import tempfile
 
 # Добавляем путь, чтобы импортировать app
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from app.api.endpoints import proxy_completions
+from app.services.model_profiles import model_profiles
 from app.services.rag_engine import rag_engine
 
 class MockRequest:
@@ -23,6 +25,8 @@ class MockRequest:
         return False
 
 async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
     print("🚀 Starting Hybrid Pipeline Merge Test...")
 
     # Генерируем тестовый батч из 15 параграфов
@@ -0,0 +1,54 @@
+"""
+Тест монитора лагов event loop: намеренно блокируем loop синхронным вызовом
+и проверяем гистограмму и стек виновника.
+
+Запуск:
+  poetry run python tests/test_loop_monitor.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.loop_monitor import LoopLagMonitor
+
+
+def blocking_chroma_like_call():
+    """Имитация синхронной работы в async-коде."""
+    time.sleep(0.4)
+
+
+async def main():
+    print("🧪 Loop lag monitor")
+    monitor = LoopLagMonitor()
+    monitor.start(interval=0.02, threshold=0.1)
+
+    # Спокойный loop: лаги маленькие, стеков нет
+    await asyncio.sleep(0.3)
+    assert monitor.samples > 5 and not monitor.stacks
+    assert monitor.max_lag < 0.1
+
+    # Блокируем дважды одним и тем же кодом — один стек, count = 2
+    for _ in range(2):
+        blocking_chroma_like_call()
+        await asyncio.sleep(0.1)
+
+    report = monitor.report()
+    monitor.stop()
+    print(f"  samples={report['samples']} max_lag_ms={report['max_lag_ms']} stalls={report['stalls']}")
+    print(f"  histogram={report['histogram']}")
+    assert report["max_lag_ms"] >= 300
+    assert report["stalls"] == 2
+    top = report["top_stacks"][0]
+    assert top["count"] == 2 and "blocking_chroma_like_call" in top["stack"]
+    assert sum(report["histogram"].values()) == report["samples"]
+
+    print("🎉 Loop lag monitor test passed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""
+Тест онлайн-профилей моделей: EWMA decode/prefill/load по ответам Ollama,
+сохранение на диск (из event loop — в потоке) и использование профиля в estimate_timeout
+и batch_planner; LOW POWER — по модели, а не на весь процесс.
+
+Запуск:
+  poetry run python tests/test_model_profiles.py
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services import model_profiles as profiles_module
+from app.services.model_profiles import ModelProfileStore
+
+
+def done_chunk(eval_tps: float, prefill_tps: float, load_sec: float = 0.0) -> dict:
+    """Финальный чанк /api/chat: 100 токенов ответа, 1000 токенов промпта."""
+    return {
+        "done": True,
+        "eval_count": 100,
+        "eval_duration": int(100 / eval_tps * 1e9),
+        "prompt_eval_count": 1000,
+        "prompt_eval_duration": int(1000 / prefill_tps * 1e9),
+        "load_duration": int(load_sec * 1e9),
+    }
+
+
+async def check_save_off_loop(path: str):
+    """record() посреди стрима Шага C: json.dump и os.replace — не в потоке event loop."""
+    store = ModelProfileStore(path)
+    real_save = store.save
+    threads = []
+
+    def save(profiles=None):
+        threads.append(threading.current_thread())
+        real_save(profiles)
+
+    store.save = save
+    store._saved_at = 0.0
+    store.record("big:14b", done_chunk(eval_tps=5.0, prefill_tps=40.0))
+    assert threads == []
+    await store._save_task
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
+    assert ModelProfileStore(path).get("big:14b")["samples"] == store.get("big:14b")["samples"]
+
+
+def main():
+    print("🧪 Model profiles")
+    path = os.path.join(tempfile.mkdtemp(), "data", "model_profiles.json")
+
+    # --- EWMA по моделям раздельно ---
+    store = ModelProfileStore(path)
+    store.record("big:14b", done_chunk(eval_tps=4.0, prefill_tps=40.0, load_sec=20.0))
+    store.record("big:14b", done_chunk(eval_tps=6.0, prefill_tps=40.0))   # модель уже в памяти
+    store.record("small:2b", done_chunk(eval_tps=50.0, prefill_tps=500.0))
+    store.record("small:2b", {"done": True})                              # без метрик — не сэмпл
+    big, small = store.get("big:14b"), store.get("small:2b")
+    print(f"  big: {big}")
+    print(f"  small: {small}")
+    assert 4.0 < big["decode_tps"] < 6.0 and big["samples"] == 2
+    assert abs(big["load_sec"] - 20.0) < 0.01
+    assert abs(small["prefill_tps"] - 500.0) < 0.01 and small["samples"] == 1
+    assert store.is_low_power("big:14b") and not store.is_low_power("small:2b")
+    assert not store.is_low_power("unknown:1b")
+
+    # --- Переживает рестарт ---
+    store.save()
+    reloaded = ModelProfileStore(path)
+    assert reloaded.get("big:14b")["decode_tps"] == big["decode_tps"]
+    asyncio.run(check_save_off_loop(path))
+
+    # --- Таймаут по профилю конкретной модели, а не по глобальному current_tps ---
+    settings.current_tps = 20.0
+    chars = 30000
+    t_big = reloaded.estimate_timeout("big:14b", chars)
+    t_small = reloaded.estimate_timeout("small:2b", chars)
+    t_unknown = reloaded.estimate_timeout("unknown:1b", chars)
+    print(f"  timeout big={t_big:.0f}s small={t_small:.0f}s unknown={t_unknown:.0f}s")
+    assert t_big > t_unknown > t_small
+    assert t_unknown == settings.estimate_timeout(chars)
+
+    # --- batch_planner берёт скорости из профиля ---
+    profiles_module.model_profiles.profiles = reloaded.profiles
+    from app.services.batch_planner import batch_planner
+    plan_big = batch_planner.plan("big:14b", tps=20.0, user_budget_tokens=100000)
+    plan_small = batch_planner.plan("small:2b", tps=20.0, user_budget_tokens=100000)
+    print(f"  plan big={plan_big}")
+    print(f"  plan small={plan_small}")
+    assert plan_big["max_paragraphs"] < plan_small["max_paragraphs"]
+    assert plan_big["max_chars"] < plan_small["max_chars"]
+
+    print("🎉 Model profiles test passed")
+
+
+if __name__ == "__main__":
+    main()
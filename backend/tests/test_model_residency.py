@@ -0,0 +1,144 @@
+"""
+Тест менеджера резидентности моделей (services/model_residency.py) на stand-in Ollama
+с /api/ps и /api/tags: бюджет RAM, fits/loadable, отказ модели больше бюджета,
+очередь acquire, пока загрузка вытеснит занятую модель, и пробуждение по release.
+
+Запуск:
+  poetry run python tests/test_model_residency.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.model_residency import ModelResidencyError, ModelResidencyManager
+
+GB = 1024 ** 3
+# Загружена только "busy:8b"; остальные — на диске
+LOADED = {"busy:8b": 8 * GB}
+ON_DISK = {"busy:8b": 8 * GB, "small:4b": 6 * GB, "big:12b": 12 * GB, "huge:70b": 40 * GB}
+
+
+class StandInOllama(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, obj):
+        payload = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            self._send_json({"models": [{"name": m, "size": s} for m, s in LOADED.items()]})
+        elif self.path == "/api/tags":
+            self._send_json({"models": [{"name": m, "size": s} for m, s in ON_DISK.items()]})
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+
+async def check_budget(residency: ModelResidencyManager):
+    print("=== TEST 1: бюджет RAM, fits и loadable ===")
+    await residency.refresh(force=True)
+    # 10 GB свободно + 8 GB уже загруженной модели, доля 1.0
+    assert residency.ram_budget_bytes() == 18 * GB
+    assert residency.fits("busy:8b", 8 * GB)
+    assert residency.fits("small:4b", 6 * GB)           # 8 + 6 <= 18
+    assert not residency.fits("big:12b", 12 * GB)       # 8 + 12 > 18 — вытеснит busy:8b
+    # Вытеснить можно: busy:8b сейчас никто не использует
+    assert await residency.loadable("big:12b")
+    assert not await residency.loadable("huge:70b")
+    print(f"  snapshot: { {k: v for k, v in residency.snapshot().items() if k != 'events'} }")
+    print("✅ PASSED\n")
+
+
+async def check_refused(residency: ModelResidencyManager):
+    print("=== TEST 2: модель больше бюджета RAM — отказ сразу ===")
+    started = time.perf_counter()
+    try:
+        await residency.acquire("huge:70b")
+        raise AssertionError("huge:70b не должна загружаться")
+    except ModelResidencyError as e:
+        print(f"  {e}")
+    assert time.perf_counter() - started < 1.0
+    assert residency.events[-1]["event"] == "refused"
+    assert residency.in_flight.get("huge:70b", 0) == 0
+    print("✅ PASSED\n")
+
+
+async def check_queue_and_wake(residency: ModelResidencyManager):
+    print("=== TEST 3: big:12b ждёт, пока busy:8b отвечает; release будит очередь ===")
+    await residency.acquire("busy:8b")
+    # Влезает рядом с занятой моделью — без очереди
+    await residency.acquire("small:4b")
+    await residency.release("small:4b")
+
+    waiter = asyncio.create_task(residency.acquire("big:12b"))
+    await asyncio.sleep(0.3)
+    assert not waiter.done()
+    assert not await residency.loadable("big:12b")
+    assert any(e["event"] == "queued" and e["model"] == "big:12b" for e in residency.events)
+
+    released_at = time.perf_counter()
+    await residency.release("busy:8b")
+    await asyncio.wait_for(waiter, timeout=1.0)
+    woke_after = time.perf_counter() - released_at
+    print(f"  woke {woke_after * 1000:.0f} ms after release")
+    # Будит notify_all, а не опрос /api/ps раз в META_TTL_PS
+    assert woke_after < settings.META_TTL_PS / 2
+    assert residency.in_flight["big:12b"] == 1
+    await residency.release("big:12b")
+    print("✅ PASSED\n")
+
+
+async def check_queue_timeout(residency: ModelResidencyManager):
+    print("=== TEST 4: очередь не рассосалась за RESIDENCY_QUEUE_TIMEOUT — отказ ===")
+    settings.RESIDENCY_QUEUE_TIMEOUT = 0.3
+    await residency.acquire("busy:8b")
+    started = time.perf_counter()
+    try:
+        await residency.acquire("big:12b")
+        raise AssertionError("big:12b не должна вытеснять занятую busy:8b")
+    except ModelResidencyError as e:
+        print(f"  {e}")
+    elapsed = time.perf_counter() - started
+    assert 0.3 <= elapsed < 1.0
+    assert residency.in_flight.get("big:12b", 0) == 0
+    await residency.release("busy:8b")
+    print("✅ PASSED\n")
+
+
+async def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    settings.available_ram_gb = 10.0
+    settings.RESIDENCY_RAM_FRACTION = 1.0
+    settings.RESIDENCY_QUEUE_TIMEOUT = 10.0
+    settings.META_TTL_PS = 5.0
+    residency = ModelResidencyManager(url)
+    try:
+        await check_budget(residency)
+        await check_refused(residency)
+        await check_queue_and_wake(residency)
+        await check_queue_timeout(residency)
+    finally:
+        server.shutdown()
+    print("🎉 Model residency тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,216 @@
+"""
+Тест алиаса модели "auto" (services/model_router.py) на stand-in Ollama:
+leaderboard контеста → самая быстрая модель с точностью не ниже порога,
+онлайн-латентность перебивает оффлайн-замер, модель, которая не влезает в RAM,
+пропускается, без кандидатов — самая точная, потом ROUTER_FALLBACK_MODEL.
+
+Запуск:
+  poetry run python tests/test_model_router.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.batch_planner import batch_planner
+from app.services.model_profiles import model_profiles
+from app.services.model_router import ModelRouter, model_router
+from app.services.ollama_meta import ollama_meta
+from app.services.ollama_pool import ollama_pool
+
+_GB = 1024 ** 3
+# Размеры моделей на диске, GB
+SIZES = {"big:27b": 17, "mid:12b": 8, "small:1b": 1}
+state = {"resident": []}
+chat_models: list[str] = []
+
+CONTEST = {
+    "leaderboard": [
+        {"model": "big:27b", "files_ok": 5, "avg_overall": 93.0, "avg_time_sec": 240.0, "avg_elements": 60},
+        {"model": "mid:12b", "files_ok": 5, "avg_overall": 86.0, "avg_time_sec": 90.0, "avg_elements": 60},
+        {"model": "small:1b", "files_ok": 5, "avg_overall": 61.0, "avg_time_sec": 12.0, "avg_elements": 60},
+        # Каскад и сжатый промпт — не отдельные модели
+        {"model": "small:1b→big:27b", "files_ok": 5, "avg_overall": 95.0, "avg_time_sec": 30.0, "avg_elements": 60},
+        {"model": "mid:12b [compact]", "files_ok": 5, "avg_overall": 85.0, "avg_time_sec": 50.0, "avg_elements": 60},
+        {"model": "gone:7b", "files_ok": 0, "avg_overall": 0, "avg_time_sec": 0, "avg_elements": 0},
+    ]
+}
+
+
+class StandInOllama(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, obj):
+        payload = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": m, "size": gb * _GB, "digest": m} for m, gb in SIZES.items()]})
+        elif self.path == "/api/ps":
+            self._send_json({"models": [{"name": m, "size": SIZES[m] * _GB} for m in state["resident"]]})
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/show":
+            self._send_json({"model_info": {"llama.context_length": 8192}})
+            return
+        if self.path == "/api/chat":
+            chat_models.append(body["model"])
+            user = body["messages"][-1]["content"]
+            ids = [line.split("]")[0].strip("[") for line in user.splitlines()]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            answer = json.dumps({pid: "Normal" for pid in ids})
+            self.wfile.write((json.dumps({"message": {"content": answer}}) + "\n").encode())
+            self.wfile.write((json.dumps({"done": True}) + "\n").encode())
+            return
+        self.send_response(404)
+        self.end_headers()
+
+
+class MockRequest:
+    def __init__(self, json_data):
+        self._json = json_data
+
+    async def json(self):
+        return self._json
+
+    async def is_disconnected(self):
+        return False
+
+
+async def collect(response) -> list[dict]:
+    return [json.loads(chunk) async for chunk in response.body_iterator if chunk.strip()]
+
+
+def check_ingest(path: str):
+    print("=== TEST 1: leaderboard контеста → роутер, переживает рестарт ===")
+    accepted = model_router.ingest(CONTEST)
+    assert set(accepted) == {"big:27b", "mid:12b", "small:1b"}
+    assert accepted["mid:12b"] == {"accuracy": 86.0, "sec_per_paragraph": 1.5, "files_ok": 5}
+    reloaded = ModelRouter(path)
+    assert reloaded.leaderboard == model_router.leaderboard
+    print("✅ PASSED\n")
+
+
+async def check_auto_completion(proxy_completions, proxy_tags):
+    print("=== TEST 2: model=auto → самая быстрая модель с точностью >= порога ===")
+    resp = await proxy_tags()
+    names = [m["name"] for m in json.loads(resp.body)["models"]]
+    assert names[0] == "auto" and "mid:12b" in names
+
+    records = await collect(await proxy_completions(MockRequest({
+        "model": "auto",
+        "paragraphs": [{"id": 1, "text": "Обычный абзац текста"}, {"id": 2, "text": "Ещё один абзац"}],
+    })))
+    meta = records[0]["meta"]
+    print(f"  meta: model={meta['model']} reason={meta['route_reason']}")
+    # small:1b быстрее всех, но ниже порога 80%; big:27b точнее, но втрое медленнее
+    assert meta["model"] == "mid:12b" and meta["batch_plan"]["model"] == "mid:12b"
+    assert chat_models == ["mid:12b"]
+    assert {r["id"] for r in records if "id" in r} == {1, 2}
+    print("✅ PASSED\n")
+
+
+async def check_online_latency():
+    print("=== TEST 3: онлайн-латентность Шага C перебивает замер контеста ===")
+    # На этой машине mid:12b оказалась медленной: 30 с на абзац
+    batch_planner.sec_per_paragraph.pop("mid:12b", None)
+    batch_planner.observe("mid:12b", 4, 120.0)
+    model, reason = await model_router.route()
+    print(f"  auto → {model} ({reason})")
+    assert model == "big:27b"
+    batch_planner.sec_per_paragraph.pop("mid:12b")
+    print("✅ PASSED\n")
+
+
+async def check_not_loaded():
+    print("=== TEST 4: модель не загружена и вытеснила бы занятую — берём загруженную ===")
+    settings.ROUTER_ACCURACY_FLOOR = 90
+    node = ollama_pool.primary
+    # Загружена и занята mid:12b (8 GB), свободно ещё 17 GB: бюджет вместе с ней — 20 GB.
+    # big:27b (17 GB) вытеснила бы mid:12b — ждать нельзя
+    settings.available_ram_gb = 20 / settings.RESIDENCY_RAM_FRACTION - 8
+    state["resident"] = ["mid:12b"]
+    ollama_meta.invalidate()
+    node.residency.in_flight["mid:12b"] = 1
+    model, reason = await model_router.route()
+    print(f"  auto → {model} ({reason})")
+    assert model == "mid:12b" and "most accurate available" in reason
+
+    # Освободилась — big:27b можно загрузить, её load_sec входит в стоимость
+    node.residency.in_flight["mid:12b"] = 0
+    model, reason = await model_router.route()
+    print(f"  auto → {model} ({reason})")
+    assert model == "big:27b" and "incl. load" in reason
+    print("✅ PASSED\n")
+
+
+async def check_fallback():
+    print("=== TEST 5: пустой leaderboard — ROUTER_FALLBACK_MODEL ===")
+    saved = dict(model_router.leaderboard)
+    model_router.leaderboard.clear()
+    settings.ROUTER_FALLBACK_MODEL = "small:1b"
+    model, reason = await model_router.route()
+    assert model == "small:1b" and "fallback" in reason
+    model_router.leaderboard.update(saved)
+    print(f"  model_router: {model_router.snapshot()['decisions']}")
+    print("✅ PASSED\n")
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import proxy_completions, proxy_tags
+    from app.services.rag_engine import rag_engine
+
+    rag_engine.search_style_reference = MagicMock(return_value={
+        "source_id": "test_uuid",
+        "style_map": {"Normal": {}, "Body Text": {}},
+    })
+    rag_engine.search_batch_fast_track = MagicMock(return_value={})
+
+    path = os.path.join(tempfile.mkdtemp(), "model_leaderboard.json")
+    model_router.path = path
+    model_router.leaderboard.clear()
+    ollama_pool.configure([f"http://127.0.0.1:{server.server_address[1]}"])
+    settings.SINGLE_FLIGHT = False
+    settings.ROUTER_ACCURACY_FLOOR = 80
+    settings.available_ram_gb = 64.0
+    try:
+        check_ingest(path)
+        await check_auto_completion(proxy_completions, proxy_tags)
+        await check_online_latency()
+        await check_not_loaded()
+        await check_fallback()
+    finally:
+        server.shutdown()
+    print("🎉 Model router тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
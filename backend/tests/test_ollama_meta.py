@@ -0,0 +1,161 @@
+"""
+Тест кэша метаданных Ollama (services/ollama_meta.py) на stand-in сервере:
+одновременные промахи — один запрос, TTL и stale-while-revalidate, смена digest
+модели сбрасывает /api/show и бюджет контекста, мёртвый узел не отдаётся из кэша.
+
+Запуск:
+  poetry run python tests/test_ollama_meta.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services import llm_checker
+from app.services.ollama_meta import ollama_meta
+from app.services.ollama_pool import ollama_pool
+from app.services.token_counter import token_counter
+
+MODEL = "meta-model:1b"
+OTHER_URL = "http://127.0.0.1:9"   # узел без /api/show → declared = DEFAULT_CTX
+hits: Counter = Counter()
+state = {"digest": "sha-1", "context_length": 8192}
+
+
+class StandInOllama(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, obj):
+        payload = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        hits[self.path] += 1
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": MODEL, "size": 1, "digest": state["digest"]}]})
+        elif self.path == "/api/ps":
+            self._send_json({"models": []})
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def do_POST(self):
+        hits[self.path] += 1
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path == "/api/show":
+            self._send_json({"model_info": {"llama.context_length": state["context_length"]}})
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+
+async def check_dedup_and_ttl(url: str, proxy_tags):
+    print("=== TEST 1: 20 одновременных промахов — один запрос, дальше — из кэша ===")
+    answers = await asyncio.gather(*(ollama_meta.tags(url) for _ in range(20)))
+    assert all(a["models"][0]["name"] == MODEL for a in answers)
+    for _ in range(10):
+        resp = await proxy_tags()
+        assert resp.status_code == 200
+    print(f"  /api/tags hits: {hits['/api/tags']}")
+    assert hits["/api/tags"] == 1
+    print("✅ PASSED\n")
+
+
+async def check_stale_while_revalidate(url: str):
+    print("=== TEST 2: stale-while-revalidate ===")
+    settings.META_TTL_TAGS = 0.2
+    await asyncio.sleep(0.25)
+    before = hits["/api/tags"]
+    # Устаревшее, но в пределах второго TTL: ответ сразу, обновление — в фоне
+    answer = await ollama_meta.tags(url)
+    assert answer["models"][0]["name"] == MODEL
+    # Фоновое обновление — HTTP-запрос к stand-in; под нагрузкой ему нужно больше пары десятков мс
+    for _ in range(40):
+        if hits["/api/tags"] > before:
+            break
+        await asyncio.sleep(0.025)
+    assert hits["/api/tags"] == before + 1
+    assert ollama_meta.snapshot()["stale_hits"] == 1
+
+    # Старше двух TTL — синхронный запрос
+    await asyncio.sleep(0.45)
+    await ollama_meta.tags(url)
+    assert hits["/api/tags"] == before + 2
+    settings.META_TTL_TAGS = 30
+    print("✅ PASSED\n")
+
+
+async def check_digest_change(url: str):
+    print("=== TEST 3: модель перекачана с другим context_length ===")
+    settings.ctx_ram_gb = 64.0
+    settings.memory_pressure = False
+    budget, _ = await llm_checker.get_safe_context(MODEL, url)
+    assert budget == 8192 - llm_checker.SAFETY_BUFFER
+    await llm_checker.get_safe_context(MODEL, url)
+    assert hits["/api/show"] == 1
+    # Та же модель на другом узле — свой бюджет (там /api/show недоступен → DEFAULT_CTX)
+    other, _ = await llm_checker.get_safe_context(MODEL, OTHER_URL)
+    assert other == llm_checker.DEFAULT_CTX - llm_checker.SAFETY_BUFFER
+    token_counter._remember((MODEL, "sha"), 7)
+
+    state.update(digest="sha-2", context_length=16384)
+    # Digest ловит health-проба пула (всегда мимо TTL)
+    await ollama_pool.health_check()
+    budget, _ = await llm_checker.get_safe_context(MODEL, url)
+    print(f"  budget after re-pull: {budget}, digest_changes={ollama_meta.digest_changes}")
+    assert budget == 16384 - llm_checker.SAFETY_BUFFER
+    assert hits["/api/show"] == 2 and ollama_meta.digest_changes == 1
+    assert (MODEL, "sha") not in token_counter.cache
+    # Перекачали модель на url — бюджет другого узла остаётся в кэше
+    assert (OTHER_URL, MODEL) in llm_checker._ctx_cache
+    print("✅ PASSED\n")
+
+
+async def check_dead_node(server, url: str, proxy_tags):
+    print("=== TEST 4: узел умер — кэш не выдаёт его за живой ===")
+    server.shutdown()
+    server.server_close()
+    await ollama_pool.health_check()
+    assert not ollama_pool.primary.healthy
+    resp = await proxy_tags()
+    assert resp.status_code == 500
+    assert ("tags", url, "") not in ollama_meta.entries
+    print(f"  ollama_meta: {ollama_meta.snapshot()}")
+    print("✅ PASSED\n")
+
+
+async def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import proxy_tags
+
+    ollama_pool.configure([url])
+    settings.META_TTL_TAGS = 30
+    try:
+        await check_dedup_and_ttl(url, proxy_tags)
+        await check_stale_while_revalidate(url)
+        await check_digest_change(url)
+    finally:
+        await check_dead_node(server, url, proxy_tags)
+    print("🎉 Ollama metadata cache тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
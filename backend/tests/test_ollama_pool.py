@@ -0,0 +1,140 @@
+"""
+Тест пула Ollama на нескольких локальных stand-in серверах:
+health-пробы, калибровка tokens/sec по узлам, least_tokens / least_latency и sticky-сессии.
+
+Запуск:
+  poetry run python tests/test_ollama_pool.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.ollama_pool import OllamaPool
+from app.services.model_profiles import model_profiles
+
+
+def make_handler(models: list[str], tokens_per_sec: float):
+    """Stand-in Ollama: /api/tags со списком моделей, /api/generate с заданной скоростью."""
+
+    class StandInOllama(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, obj):
+            payload = json.dumps(obj).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json({"models": [{"name": m, "size": 1} for m in models]})
+            else:
+                self.send_response(404)
+                self.end_headers()
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            if self.path == "/api/generate":
+                # 20 токенов за 20 / tps секунд (в наносекундах, как у Ollama)
+                self._send_json({"response": "ok", "eval_count": 20,
+                                 "eval_duration": int(20 / tokens_per_sec * 1e9)})
+            else:
+                self.send_response(404)
+                self.end_headers()
+
+    return StandInOllama
+
+
+def start_server(models: list[str], tps: float) -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(models, tps))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+async def main():
+    print("🚀 Ollama pool test on 3 stand-in servers...")
+    # Калибровка пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    fast, fast_url = start_server(["gemma3:4b", "qwen3:8b"], tps=40.0)
+    slow, slow_url = start_server(["gemma3:4b"], tps=10.0)
+    dead, dead_url = start_server(["gemma3:4b"], tps=20.0)
+    dead.shutdown()
+    dead.server_close()
+
+    pool = OllamaPool([fast_url, slow_url, dead_url])
+
+    # --- Health ---
+    await pool.health_check()
+    health = {n.url: n.healthy for n in pool.nodes}
+    print(f"  health: {health}")
+    assert health == {fast_url: True, slow_url: True, dead_url: False}
+
+    # --- Калибровка по узлам ---
+    settings.is_low_power = False
+    await pool.calibrate_all(model="gemma3:4b")
+    tps = {n.url: round(n.tps_for("gemma3:4b")) for n in pool.nodes if n.healthy}
+    print(f"  tps: {tps}")
+    assert tps == {fast_url: 40, slow_url: 10}
+    # Медленный узел (10 < 15 tokens/sec) не переводит весь процесс в LOW POWER
+    assert not settings.is_low_power and round(settings.current_tps) == 40
+
+    # --- Модель есть только на одном узле ---
+    assert pool.pick("qwen3:8b").url == fast_url
+
+    # --- least_tokens: нагрузка нормируется на скорость узла ---
+    settings.OLLAMA_ROUTING = "least_tokens"
+    picks = []
+    async with pool.track(pool.get(fast_url), 2000):
+        picks.append(pool.pick("gemma3:4b").url)        # fast: 2000/40=50 > slow: 0 -> slow
+        async with pool.track(pool.get(slow_url), 1000):
+            picks.append(pool.pick("gemma3:4b").url)    # fast: 50 < slow: 100 -> fast
+    print(f"  least_tokens picks: {picks}")
+    assert picks == [slow_url, fast_url]
+    assert all(n.outstanding_tokens == 0 for n in pool.nodes)
+
+    # --- least_latency ---
+    settings.OLLAMA_ROUTING = "least_latency"
+    pool.get(fast_url).latency_ewma = 3.0
+    pool.get(slow_url).latency_ewma = 1.0
+    assert pool.pick("gemma3:4b").url == slow_url
+
+    # --- Sticky: сессия остаётся на узле, даже если другой стал «лучше» ---
+    first = pool.pick("gemma3:4b", session_id="doc-1").url
+    pool.get(first).latency_ewma = 100.0
+    again = pool.pick("gemma3:4b", session_id="doc-1").url
+    other = pool.pick("gemma3:4b", session_id="doc-2").url
+    print(f"  sticky: doc-1 {first} -> {again}, doc-2 -> {other}")
+    assert again == first and other != first
+
+    # --- Узел упал: sticky-сессия переезжает на живой ---
+    slow.shutdown()
+    slow.server_close()
+    await pool.health_check()
+    moved = pool.pick("gemma3:4b", session_id="doc-1").url
+    print(f"  после падения {slow_url}: doc-1 -> {moved}")
+    assert moved == fast_url
+
+    # --- Скорость из финального чанка /api/chat (eval_count / eval_duration) ---
+    node = pool.get(fast_url)
+    pool.record_eval(node, "gemma3:4b", {"done": True, "eval_count": 100, "eval_duration": int(2e9)})
+    assert 40.0 < node.tps_for("gemma3:4b") < 50.0
+
+    fast.shutdown()
+    print("🎉 Ollama pool test passed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
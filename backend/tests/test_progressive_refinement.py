@@ -0,0 +1,174 @@
+"""
+Тест progressive refinement: с "progressive": true proxy_completions сразу отдаёт
+предварительный стиль для каждого абзаца, а ответ LLM — записями "revision"
+только там, где он расходится с предварительным. Сбой LLM при этом не фатален.
+
+Запуск:
+  poetry run python tests/test_progressive_refinement.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+
+# Ответ mock-LLM: 1 совпадает с предварительным, 2 — поправка, 3 LLM «потеряла»
+LLM_ANSWER = {"1": "Quote", "2": "Heading 1"}
+CHAT_FAILS = False
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path == "/api/show":
+            payload = json.dumps({"model_info": {"llama.context_length": 8192}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        if self.path == "/api/chat":
+            if CHAT_FAILS:
+                self.send_response(500)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            self.wfile.write((json.dumps({"message": {"content": json.dumps(LLM_ANSWER)}}) + "\n").encode())
+            self.wfile.write((json.dumps({"done": True}) + "\n").encode())
+            return
+
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class MockRequest:
+    def __init__(self, json_data):
+        self._json = json_data
+
+    async def json(self):
+        return self._json
+
+    async def is_disconnected(self):
+        return False
+
+
+def make_request(progressive: bool) -> MockRequest:
+    paragraphs = [{"id": i, "text": f"обычный текст параграфа номер {i}"} for i in range(4)]
+    return MockRequest({
+        "prompt": "=== USER CONTENT (CONTENT SOURCE) ===\n" + json.dumps(paragraphs, ensure_ascii=False),
+        "model": "progressive-model",
+        "progressive": progressive,
+    })
+
+
+async def collect(response) -> list[dict]:
+    records = []
+    async for chunk in response.body_iterator:
+        if chunk.strip():
+            records.append(json.loads(chunk))
+    return [r for r in records if "meta" not in r]
+
+
+async def check_provisional_then_revisions(proxy_completions):
+    print("=== TEST 1: предварительные стили сразу, поправки — только расхождения ===")
+    records = await collect(await proxy_completions(make_request(progressive=True)))
+    for r in records:
+        print(f"  {r}")
+
+    final = [r for r in records if not r.get("provisional") and not r.get("revision")]
+    provisional = {r["id"]: r["style_name"] for r in records if r.get("provisional")}
+    revisions = {r["id"]: r["style_name"] for r in records if r.get("revision")}
+
+    # 0 — уверенный Fast Track (0.10), 1 — расслабленный порог (0.40), 2 и 3 — основной стиль
+    assert [(r["id"], r["style_name"]) for r in final] == [(0, "Body Text")]
+    assert provisional == {1: "Quote", 2: "Normal", 3: "Normal"}, provisional
+    # 1 подтверждена LLM, 3 потеряна — обе без записей; 2 исправлена
+    assert revisions == {2: "Heading 1"}, revisions
+    assert "error" not in json.dumps(records)
+
+    last_provisional = max(i for i, r in enumerate(records) if r.get("provisional"))
+    first_revision = min(i for i, r in enumerate(records) if r.get("revision"))
+    assert last_provisional < first_revision, "Поправки должны идти после всех предварительных стилей"
+    print("✅ PASSED\n")
+
+
+async def check_refinement_error_not_fatal(proxy_completions):
+    global CHAT_FAILS
+    print("=== TEST 2: сбой LLM оставляет предварительные стили ===")
+    CHAT_FAILS = True
+    try:
+        records = await collect(await proxy_completions(make_request(progressive=True)))
+    finally:
+        CHAT_FAILS = False
+
+    assert not any("error" in r for r in records), records
+    assert any("refinement_error" in r for r in records), records
+    assert {r["id"] for r in records if "id" in r} == {0, 1, 2, 3}
+    print("✅ PASSED\n")
+
+
+async def check_classic_mode_unchanged(proxy_completions):
+    print("=== TEST 3: без progressive — прежний поток без флагов ===")
+    records = await collect(await proxy_completions(make_request(progressive=False)))
+    by_id = {r["id"]: r["style_name"] for r in records}
+    assert not any(r.get("provisional") or r.get("revision") for r in records)
+    # Fast Track 0.20 через search_batch_fast_track, остальное — LLM и catch-all "Normal"
+    assert by_id == {0: "Body Text", 1: "Quote", 2: "Heading 1", 3: "Normal"}, by_id
+    print("✅ PASSED\n")
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import proxy_completions
+    from app.services.rag_engine import rag_engine
+
+    rag_engine.search_style_reference = MagicMock(return_value={
+        "source_id": "test_uuid",
+        "style_map": {"Normal": {}, "Body Text": {}, "Quote": {}, "Heading 1": {"bold": True}},
+    })
+    rag_engine.search_batch_nearest = MagicMock(return_value={
+        0: ("Body Text", 0.10), 1: ("Quote", 0.40), 2: ("Heading 1", 0.90),
+    })
+    rag_engine.search_batch_fast_track = MagicMock(return_value={0: "Body Text"})
+
+    ollama_pool.configure([f"http://127.0.0.1:{server.server_address[1]}"])
+    # Тест повторяет одинаковые запросы при разном поведении mock-Ollama — без single-flight
+    settings.SINGLE_FLIGHT = False
+    settings.PROGRESSIVE_DISTANCE = 0.5
+    try:
+        await check_provisional_then_revisions(proxy_completions)
+        await check_refinement_error_not_fatal(proxy_completions)
+        await check_classic_mode_unchanged(proxy_completions)
+    finally:
+        server.shutdown()
+    print("🎉 Progressive refinement тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,169 @@
+"""
+Тест сжатия промпта Шага C (services/prompt_compaction.py): с "prompt_compaction": true
+в LLM уходит голова абзаца + сводка признаков, лимит головы — свой у модели,
+а /api/metrics показывает символы до/после и prompt_eval_count обоих режимов.
+
+Запуск:
+  poetry run python tests/test_prompt_compaction.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+from app.services.prompt_compaction import SYSTEM_HINT, casing, compaction_stats, truncate
+from app.services.text_features import TextFeatures
+
+LONG_TEXT = ("Исполнитель обязуется оказать услуги в срок, установленный настоящим договором. " * 12).strip()
+chat_log: list[dict] = []
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/show":
+            payload = json.dumps({"model_info": {"llama.context_length": 8192}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        if self.path == "/api/chat":
+            chat_log.append(body)
+            user = body["messages"][-1]["content"]
+            ids = [line.split("]")[0].strip("[") for line in user.splitlines()]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            answer = json.dumps({pid: "Normal" for pid in ids})
+            self.wfile.write((json.dumps({"message": {"content": answer}}) + "\n").encode())
+            # Как у Ollama: входные токены — в финальном чанке
+            self.wfile.write((json.dumps({"done": True, "prompt_eval_count": len(user) // 3}) + "\n").encode())
+            return
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class MockRequest:
+    def __init__(self, json_data):
+        self._json = json_data
+
+    async def json(self):
+        return self._json
+
+    async def is_disconnected(self):
+        return False
+
+
+def make_request(model: str, compact: bool) -> MockRequest:
+    paragraphs = [
+        {"id": 0, "text": "ДОГОВОР ОКАЗАНИЯ УСЛУГ"},
+        {"id": 7, "text": "1. Предмет договора"},
+        {"id": 8, "text": LONG_TEXT},
+    ]
+    return MockRequest({"model": model, "paragraphs": paragraphs, "document_size": 40,
+                        "prompt_compaction": compact})
+
+
+async def collect(response) -> list[dict]:
+    return [json.loads(chunk) async for chunk in response.body_iterator if chunk.strip()]
+
+
+def check_helpers():
+    print("=== TEST 1: обрезка по границе слова и регистр ===")
+    head = truncate(LONG_TEXT, 60)
+    assert head.endswith("…") and len(head) <= 61 and LONG_TEXT.startswith(head[:-1])
+    assert truncate("короткий текст", 60) == "короткий текст"
+    assert truncate(LONG_TEXT, 0) == LONG_TEXT
+    assert [casing(TextFeatures(t)) for t in ("ГЛАВА 1", "Обычный текст", "мелко", "iPhone и Android")] == \
+        ["upper", "title", "lower", "mixed"]
+    print("✅ PASSED\n")
+
+
+async def check_compact_prompt(proxy_completions):
+    print("=== TEST 2: сжатый промпт и лимит по модели ===")
+    settings.PROMPT_COMPACT_CHARS = 80
+    settings.PROMPT_COMPACT_CHARS_MODELS = {"tiny:1b": 40}
+
+    for model, limit in (("big:12b", 80), ("tiny:1b", 40)):
+        chat_log.clear()
+        records = await collect(await proxy_completions(make_request(model, compact=True)))
+        assert {r["id"] for r in records if "id" in r} == {0, 7, 8}
+        system = chat_log[0]["messages"][0]["content"]
+        user_lines = chat_log[0]["messages"][-1]["content"].splitlines()
+        print(f"  {model}: {user_lines[-1]}")
+        assert system.endswith(SYSTEM_HINT)
+        assert user_lines[0] == "[0] ДОГОВОР ОКАЗАНИЯ УСЛУГ {len=short case=upper list=none pos=0/40}"
+        assert user_lines[1].endswith("{len=short case=title list=num pos=7/40}")
+        head = user_lines[2].split(" {")[0][len("[8] "):]
+        assert head.endswith("…") and len(head) <= limit + 1
+        assert user_lines[2].endswith("{len=long case=mixed list=none pos=8/40}")
+    print("✅ PASSED\n")
+
+
+async def check_metrics(proxy_completions):
+    print("=== TEST 3: полный промпт против сжатого в /api/metrics ===")
+    chat_log.clear()
+    await collect(await proxy_completions(make_request("big:12b", compact=False)))
+    assert LONG_TEXT in chat_log[0]["messages"][-1]["content"]
+    assert SYSTEM_HINT not in chat_log[0]["messages"][0]["content"]
+
+    snap = compaction_stats.snapshot()
+    print(f"  prompt_compaction: {snap}")
+    full, compact = snap["full"], snap["compact"]
+    assert full["requests"] == 1 and compact["requests"] == 2
+    assert compact["truncated"] == 2 and full["truncated"] == 0
+    # На абзац: полный промпт дороже сжатого и по символам, и по prompt_eval_count
+    assert compact["chars_sent"] / compact["lines"] < full["chars_sent"] / full["lines"]
+    assert compact["prompt_tokens"] / compact["requests"] < full["prompt_tokens"]
+    assert compact["chars_saved_pct"] > 50
+    print("✅ PASSED\n")
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import proxy_completions
+    from app.services.rag_engine import rag_engine
+
+    # Без стилей заголовков/списков в шаблоне эвристики Шага A молчат — всё идёт в LLM
+    rag_engine.search_style_reference = MagicMock(return_value={
+        "source_id": "test_uuid",
+        "style_map": {"Normal": {}, "Body Text": {}},
+    })
+    rag_engine.search_batch_fast_track = MagicMock(return_value={})
+
+    ollama_pool.configure([f"http://127.0.0.1:{server.server_address[1]}"])
+    settings.SINGLE_FLIGHT = False
+    try:
+        check_helpers()
+        await check_compact_prompt(proxy_completions)
+        await check_metrics(proxy_completions)
+    finally:
+        server.shutdown()
+    print("🎉 Prompt compaction тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
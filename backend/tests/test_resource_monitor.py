@@ -0,0 +1,88 @@
+"""
+Тест монитора ресурсов: гистерезис режима давления, ступени RAM для бюджета контекста
+и сброс кэша get_safe_context. Замеры подаются вручную через observe(), psutil не нужен.
+
+Запуск:
+  poetry run python tests/test_resource_monitor.py
+"""
+
+import asyncio
+import os
+import sys
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services import llm_checker
+from app.services.resource_monitor import ResourceMonitor
+
+DEAD_URL = "http://127.0.0.1:9"   # /api/show недоступен → declared = DEFAULT_CTX
+
+
+async def main():
+    print("🧪 Resource monitor")
+    settings.PRESSURE_RAM_GB = 4.0
+    settings.PRESSURE_HYSTERESIS_GB = 1.5
+    settings.PRESSURE_CPU_PERCENT = 95.0
+    settings.PRESSURE_SAMPLES = 3
+    settings.RECOVERY_SAMPLES = 2
+    settings.is_low_power = False
+    settings.set_memory_pressure(False)
+    settings._apply_settings()
+    settings.ctx_ram_gb = 64.0
+    llm_checker.DEFAULT_CTX = 32768
+    llm_checker.invalidate_context_cache()
+    monitor = ResourceMonitor()
+
+    # --- Много RAM: контекст не режется ---
+    monitor.observe(64.0, 10.0)
+    budget, degraded = await llm_checker.get_safe_context("m", DEAD_URL)
+    print(f"  64 GB: budget={budget} degraded={degraded}")
+    assert budget == 32768 - llm_checker.SAFETY_BUFFER and not degraded
+
+    # --- RAM упала ниже 32 GB: ступень вниз сразу, кэш сброшен ---
+    monitor.observe(20.0, 10.0)
+    assert settings.ctx_ram_gb == 20.0 and (DEAD_URL, "m") not in llm_checker._ctx_cache
+    budget, degraded = await llm_checker.get_safe_context("m", DEAD_URL)
+    print(f"  20 GB: budget={budget} degraded={degraded}")
+    assert budget == 8192 - llm_checker.SAFETY_BUFFER and degraded
+
+    # --- Чуть выше порога 32 GB — без запаса гистерезиса ступень не меняется ---
+    monitor.observe(32.5, 10.0)
+    assert settings.ctx_ram_gb == 20.0 and (DEAD_URL, "m") in llm_checker._ctx_cache
+    monitor.observe(34.0, 10.0)
+    assert settings.ctx_ram_gb == 34.0 and (DEAD_URL, "m") not in llm_checker._ctx_cache
+
+    # --- Давление: не с первого замера, а после PRESSURE_SAMPLES подряд ---
+    monitor.observe(3.0, 10.0)
+    monitor.observe(3.0, 10.0)
+    assert not settings.memory_pressure
+    monitor.observe(3.0, 10.0)
+    assert settings.memory_pressure
+    assert settings.OLLAMA_CTX == 4096 and settings.RAG_CHUNK_LIMIT == 3
+    budget, degraded = await llm_checker.get_safe_context("m", DEAD_URL)
+    print(f"  pressure: budget={budget} degraded={degraded} snapshot={monitor.snapshot()['mode']}")
+    assert degraded and budget <= 4096
+
+    # --- Выход: 4.5 GB ещё в зоне гистерезиса; нужно >= 5.5 GB RECOVERY_SAMPLES раз подряд ---
+    monitor.observe(4.5, 10.0)
+    monitor.observe(4.5, 10.0)
+    assert settings.memory_pressure
+    monitor.observe(6.0, 10.0)
+    monitor.observe(6.0, 99.0)     # CPU-пик обнуляет серию восстановления
+    monitor.observe(6.0, 10.0)
+    assert settings.memory_pressure
+    monitor.observe(6.0, 10.0)
+    assert not settings.memory_pressure
+    assert settings.OLLAMA_CTX == 8192 and settings.RAG_CHUNK_LIMIT == 10
+
+    events = [e["event"] for e in monitor.snapshot()["events"]]
+    print(f"  events: {events}")
+    assert events.count("pressure_on") == 1 and events.count("pressure_off") == 1
+
+    print("🎉 Resource monitor test passed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
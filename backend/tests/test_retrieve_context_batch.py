@@ -0,0 +1,79 @@
+"""
+Тест батчевого /api/retrieve_context_batch (rag_engine.search_style_reference_batch):
+много запросов — один вызов эмбеддера и один запрос к Chroma на кусок,
+контексты в порядке запросов и такие же, как у одиночного /api/retrieve_context.
+
+Запуск:
+  poetry run python tests/test_retrieve_context_batch.py
+"""
+
+import asyncio
+import os
+import sys
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+
+
+class FakeCollection:
+    """Коллекция Chroma: эталон — "template_<n>.docx" по числу в тексте запроса, "мимо" — дальше порога."""
+
+    def __init__(self):
+        self.queries: list[list[str]] = []
+
+    def query(self, query_texts, n_results):
+        self.queries.append(list(query_texts))
+        metadatas, distances = [], []
+        for text in query_texts:
+            n = text.split()[-1]
+            metadatas.append([{
+                "source": f"template_{n}.docx",
+                "style_name": "Body Text",
+                "section_type": "paragraph",
+                "rich_content": f"[F: Arial] [P: 12]\nCONTENT: абзац {n}",
+            }])
+            distances.append([9.0 if text.startswith("мимо") else 0.3])
+        return {"metadatas": metadatas, "distances": distances}
+
+
+async def main():
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import ContextBatchRequest, ContextRequest, retrieve_context, retrieve_context_batch
+    from app.services.rag_engine import rag_engine
+
+    collection = FakeCollection()
+    rag_engine.collection = collection
+    settings.RETRIEVE_BATCH_CHUNK = 64
+
+    print("=== TEST 1: батч — один запрос к Chroma, порядок сохранён ===")
+    texts = [f"Запрос номер {i}" for i in range(10)] + ["мимо всех эталонов 10"]
+    answer = await retrieve_context_batch(ContextBatchRequest(texts=texts))
+    assert collection.queries == [texts]
+    results = answer["results"]
+    assert [r["source_id"] for r in results] == [f"template_{i}.docx" for i in range(10)] + [None]
+    assert results[-1]["context"] == "No reference found."
+    print("✅ PASSED\n")
+
+    print("=== TEST 2: тот же контекст, что у одиночного /api/retrieve_context ===")
+    for i in (0, 7, 10):
+        single = await retrieve_context(ContextRequest(text=texts[i]))
+        assert single == results[i], (single, results[i])
+    print("✅ PASSED\n")
+
+    print("=== TEST 3: большой батч режется на куски RETRIEVE_BATCH_CHUNK ===")
+    collection.queries.clear()
+    settings.RETRIEVE_BATCH_CHUNK = 4
+    texts = [f"Запрос номер {i}" for i in range(10)]
+    answer = await retrieve_context_batch(ContextBatchRequest(texts=texts))
+    assert [len(q) for q in collection.queries] == [4, 4, 2]
+    assert [r["source_id"] for r in answer["results"]] == [f"template_{i}.docx" for i in range(10)]
+    assert (await retrieve_context_batch(ContextBatchRequest(texts=[]))) == {"results": []}
+    print("✅ PASSED\n")
+
+    print("🎉 Retrieve context batch тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,246 @@
+"""
+Тест single-flight для /v1/completions: одинаковые запросы в полёте делят один
+конвейер (один вызов Ollama), завершённый ответ повторяется в grace-окне,
+/api/ingest сбрасывает повторы. Отдельно — файловый спул между «воркерами».
+
+Запуск:
+  poetry run python tests/test_single_flight.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import settings
+from app.services.model_profiles import model_profiles
+from app.services.ollama_pool import ollama_pool
+from app.services.single_flight import SingleFlight, single_flight
+
+LLM_DELAY = 0.5
+chat_calls = 0
+
+
+class SlowOllamaHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        global chat_calls
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/show":
+            payload = json.dumps({"model_info": {"llama.context_length": 8192}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        if self.path == "/api/chat":
+            chat_calls += 1
+            time.sleep(LLM_DELAY)
+            ids = [line.split("]")[0].strip("[") for line in body["messages"][-1]["content"].splitlines()]
+            answer = json.dumps({pid: "Normal" for pid in ids})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            self.wfile.write((json.dumps({"message": {"content": answer}}) + "\n").encode())
+            self.wfile.write((json.dumps({"done": True}) + "\n").encode())
+            return
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class MockRequest:
+    def __init__(self, json_data):
+        self._json = json_data
+
+    async def json(self):
+        return self._json
+
+    async def is_disconnected(self):
+        return False
+
+
+def make_request(session_id: str, text: str = "обычный текст параграфа") -> MockRequest:
+    paragraphs = [{"id": i, "text": f"{text} {i}"} for i in range(3)]
+    return MockRequest({
+        "prompt": "=== USER CONTENT (CONTENT SOURCE) ===\n" + json.dumps(paragraphs, ensure_ascii=False),
+        "model": "sf-model",
+        "session_id": session_id,
+    })
+
+
+async def collect(response) -> list[dict]:
+    return [json.loads(chunk) async for chunk in response.body_iterator if chunk.strip()]
+
+
+async def check_concurrent_dedup(proxy_completions):
+    global chat_calls
+    print("=== TEST 1: два одинаковых запроса в полёте — один вызов Ollama ===")
+    chat_calls = 0
+    # Двойной клик: у каждого клика свой session_id, отпечаток всё равно общий
+    first, second = await asyncio.gather(
+        proxy_completions(make_request("click-1")),
+        proxy_completions(make_request("click-2")),
+    )
+    a, b = await asyncio.gather(collect(first), collect(second))
+    print(f"  chat calls: {chat_calls}, records: {len(a)} / {len(b)}")
+    assert chat_calls == 1, chat_calls
+    assert a == b and {r["id"] for r in a if "id" in r} == {0, 1, 2}
+    # Шаблон RAG — в первой записи потока, у ведомого такая же
+    assert a[0]["meta"]["template_id"] == "test_uuid"
+    print("✅ PASSED\n")
+
+
+async def check_grace_replay(proxy_completions):
+    global chat_calls
+    print("=== TEST 2: повтор в grace-окне, сброс после ingest, другой текст — новый запрос ===")
+    chat_calls = 0
+    started = time.perf_counter()
+    replay = await collect(await proxy_completions(make_request("retry")))
+    replay_ms = (time.perf_counter() - started) * 1000
+    assert chat_calls == 0 and {r["id"] for r in replay if "id" in r} == {0, 1, 2}
+    print(f"  replay без Ollama за {replay_ms:.1f} ms")
+
+    await collect(await proxy_completions(make_request("other", text="совсем другой абзац")))
+    assert chat_calls == 1
+
+    single_flight.invalidate()
+    await collect(await proxy_completions(make_request("after-ingest")))
+    assert chat_calls == 2
+    snap = single_flight.snapshot()
+    print(f"  single_flight metrics: {snap}")
+    assert snap["joined"] == 1 and snap["replayed"] == 1
+    print("✅ PASSED\n")
+
+
+async def check_shared_spool():
+    print("=== TEST 3: файловый спул между воркерами ===")
+    with tempfile.TemporaryDirectory() as shared_dir:
+        worker_a = SingleFlight(grace_sec=10, shared_dir=shared_dir)
+        worker_b = SingleFlight(grace_sec=10, shared_dir=shared_dir)
+        data = {"model": "m", "prompt": "p"}
+        assert worker_a.fingerprint(data) == worker_b.fingerprint(data)
+        key = worker_a.fingerprint(data)
+
+        leader_flight, leader = worker_a.join(key)
+        follower_flight, follows = worker_b.join(key)
+        assert leader and not follows
+
+        async def body():
+            for i in range(3):
+                await asyncio.sleep(0.1)
+                yield f"{json.dumps({'id': i, 'style_name': 'Normal'})}\n"
+
+        worker_a.publish(leader_flight, {"x-best-template-id": "tpl"}, body())
+        headers = await follower_flight.wait_published()
+        assert headers == {"x-best-template-id": "tpl"}
+        leader_lines, follower_lines = await asyncio.gather(
+            collect_stream(leader_flight), collect_stream(follower_flight)
+        )
+        assert leader_lines == follower_lines and len(follower_lines) == 3
+
+        # Завершённый ответ другого воркера повторяется в grace-окне
+        replay_flight, leads = SingleFlight(grace_sec=10, shared_dir=shared_dir).join(key)
+        assert not leads and len(await collect_stream(replay_flight)) == 3
+
+        # Ingest в одном воркере меняет отпечаток во всех
+        worker_a.invalidate()
+        assert worker_b.fingerprint(data) != key
+    print("✅ PASSED\n")
+
+
+async def check_expiry():
+    print("=== TEST 4: завершённый ответ удаляется по grace сам, без новых запросов ===")
+    flights = SingleFlight(grace_sec=0.2)
+
+    async def body(fail: bool):
+        yield f"{json.dumps({'id': 0, 'style_name': 'Normal'})}\n"
+        if fail:
+            yield f"{json.dumps({'error': 'boom'})}\n"
+
+    for key, fail in (("ok", False), ("failed", True)):
+        flight, leader = flights.join(key)
+        assert leader
+        flights.publish(flight, {}, body(fail))
+        await collect_stream(flight)
+    await asyncio.sleep(0.05)
+    # Упавший не повторяется и не ждёт grace, удачный — ждёт
+    assert list(flights.flights) == ["ok"]
+    await asyncio.sleep(0.3)
+    assert flights.flights == {}
+    print("✅ PASSED\n")
+
+
+async def check_spool_cleanup():
+    print("=== TEST 5: файлы спула удаляются по grace, брошенный спул — сразу ===")
+    with tempfile.TemporaryDirectory() as shared_dir:
+        worker = SingleFlight(grace_sec=0.2, shared_dir=shared_dir)
+
+        async def body():
+            yield f"{json.dumps({'id': 0, 'style_name': 'Normal'})}\n"
+
+        flight, leader = worker.join("done-key")
+        assert leader
+        worker.publish(flight, {}, body())
+        await collect_stream(flight)
+        await asyncio.sleep(0.05)
+        assert {"done-key.ndjson", "done-key.headers.json", "done-key.done"} <= set(os.listdir(shared_dir))
+        await asyncio.sleep(0.4)
+        assert os.listdir(shared_dir) == []
+
+        flight, leader = worker.join("aborted-key")
+        assert leader and os.listdir(shared_dir)
+        worker.abort(flight)
+        await asyncio.sleep(0.1)
+        assert os.listdir(shared_dir) == []
+    print("✅ PASSED\n")
+
+
+async def collect_stream(flight) -> list[str]:
+    return [chunk async for chunk in flight.stream() if chunk.strip()]
+
+
+async def main():
+    # Шаг C пишет профили моделей — не трогаем data/ рабочей копии
+    model_profiles.path = os.path.join(tempfile.mkdtemp(), "model_profiles.json")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Импорт здесь: endpoints тянет RagEngine (ChromaDB + SentenceTransformer)
+    from app.api.endpoints import proxy_completions
+    from app.services.rag_engine import rag_engine
+
+    rag_engine.search_style_reference = MagicMock(return_value={
+        "source_id": "test_uuid",
+        "style_map": {"Normal": {}},
+    })
+    rag_engine.search_batch_fast_track = MagicMock(return_value={})
+
+    ollama_pool.configure([f"http://127.0.0.1:{server.server_address[1]}"])
+    settings.SINGLE_FLIGHT = True
+    single_flight.grace_sec = 10
+    try:
+        await check_concurrent_dedup(proxy_completions)
+        await check_grace_replay(proxy_completions)
+        await check_shared_spool()
+        await check_expiry()
+        await check_spool_cleanup()
+    finally:
+        server.shutdown()
+    print("🎉 Single-flight тесты пройдены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""
+Тест сервиса подсчёта токенов на stand-in /api/tokenize:
+батч одним запросом, кэш по хэшу, поштучный фоллбэк при слипшемся разделителе
+и CPT-оценка, когда Ollama недоступна.
+
+Запуск:
+  poetry run python tests/test_token_counter.py
+"""
+
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Добавляем путь, чтобы импортировать app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.token_counter import TokenCounter, SEPARATOR, heuristic_count
+
+CALLS = []
+
+
+def fake_tokenize(content: str) -> list[int]:
+    """Игрушечный токенайзер: слова, числа, знаки; '⁂⁂⁂' — отдельный токен 999."""
+    return [999 if t == "⁂⁂⁂" else abs(hash(t)) % 997 for t in re.findall(r"⁂⁂⁂|\w+|[^\w\s]", content)]
+
+
+class StandInTokenize(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        CALLS.append(body["content"])
+        if body["model"] == "no-tokenize":
+            # Сборка Ollama без /api/tokenize
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        tokens = fake_tokenize(body["content"])
+        if "СЛИПНЕТСЯ" in body["content"] and "⁂⁂⁂" in body["content"]:
+            tokens = [t for t in tokens if t != 999]   # имитация слияния разделителя с соседом
+        payload = json.dumps({"tokens": tokens}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+async def main():
+    print("🧪 Token counter")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInTokenize)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    counter = TokenCounter()
+
+    texts = ["[1] Глава 1. Общие положения", "[2] Сумма: 1 250 000 руб.", "[3] Table | A | B", "[1] Глава 1. Общие положения"]
+    expected = [len(fake_tokenize(t)) for t in texts]
+
+    # --- Один батч: разделитель + склейка = 2 запроса, дубликат считается один раз ---
+    counts = await counter.count_many("m", texts, url)
+    print(f"  counts={counts} calls={len(CALLS)}")
+    assert counts == expected
+    assert len(CALLS) == 2 and CALLS[0] == SEPARATOR
+
+    # --- Повтор: всё из кэша, в Ollama не ходим ---
+    CALLS.clear()
+    assert await counter.count_many("m", texts, url) == expected
+    assert not CALLS and counter.snapshot()["hit_rate"] > 0.5
+
+    # --- Разделитель «слипся» → поштучно ---
+    CALLS.clear()
+    tricky = ["СЛИПНЕТСЯ раз", "СЛИПНЕТСЯ два три"]
+    counts = await counter.count_many("m", tricky, url)
+    print(f"  split fallback: counts={counts} calls={len(CALLS)}")
+    assert counts == [len(fake_tokenize(t)) for t in tricky]
+    assert counter.split_fallbacks == 1
+
+    # --- Нет /api/tokenize → отметка на (узел, модель): дальше сразу CPT, до смены digest ---
+    CALLS.clear()
+    first = await counter.count_many("no-tokenize", ["Первый батч"], url)
+    second = await counter.count_many("no-tokenize", ["Второй батч", "и ещё"], url)
+    print(f"  no tokenize: calls={len(CALLS)} snapshot={counter.snapshot()}")
+    assert first == [heuristic_count("no-tokenize", "Первый батч")] and len(second) == 2
+    assert len(CALLS) == 1 and counter.snapshot()["tokenize_unsupported"] == 1
+    counter.forget_model("no-tokenize", url)
+    await counter.count_many("no-tokenize", ["Третий батч"], url)
+    assert len(CALLS) == 2
+    heuristic_before = counter.snapshot()["heuristic_counts"]
+
+    # --- Ollama недоступна → CPT-оценка, без кэширования ---
+    server.shutdown()
+    server.server_close()
+    offline = ["Новый абзац, которого нет в кэше"]
+    counts = await counter.count_many("m", offline, url)
+    print(f"  offline: counts={counts}")
+    assert counts == [heuristic_count("m", offline[0])]
+    assert counter.snapshot()["heuristic_counts"] == heuristic_before + 1
+
+    print(f"  snapshot: {counter.snapshot()}")
+    print("🎉 Token counter test passed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
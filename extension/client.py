@@ -14,6 +14,7 @@ import urllib.request
 import urllib.error
 import urllib.parse
 import os
+import uuid
 
 
 # ============================================================================
@@ -139,12 +140,7 @@ def call_apply_template(
     
     try:
         with urllib.request.urlopen(req, timeout=timeout) as response:
-            # Читаем заголовки
-            rag_template_id = response.headers.get('X-Best-Template-ID')
-            if rag_template_id:
-                rag_template_id = urllib.parse.unquote(rag_template_id)
-                
-            # Читаем NDJSON построчно
+            # Читаем NDJSON построчно (первая запись — {"meta": {...}} с шаблоном RAG)
             for line in response:
                 line_str = line.decode('utf-8').strip()
                 if not line_str: continue # Heartbeat
@@ -156,6 +152,9 @@ def call_apply_template(
                     if "error" in obj:
                         print(f"Backend Error: {obj['error']}")
                         break
+                    if "meta" in obj:
+                        rag_template_id = obj["meta"].get("template_id")
+                        continue
                     structure.append(obj)
                 except json.JSONDecodeError:
                     pass
@@ -179,6 +178,102 @@ def call_apply_template(
 import threading
 import queue
 
+
+# ============================================================================
+# Адаптивный размер батча (совет бэкенда /api/batch_plan + замеры времени)
+# ============================================================================
+
+# Если бэкенд не дал совета (старая версия / недоступен) — прежнее поведение
+DEFAULT_BATCH_SIZE = 15
+DEFAULT_MAX_CHARS = 6000
+DEFAULT_TARGET_SEC = 20.0
+# При X-Deadline-Ms батч ждём бюджет + этот запас на сеть, сек
+DEADLINE_SLACK_SEC = 5.0
+
+
+def fetch_batch_plan(middleware_url: str, model: str, timeout: int = 5) -> dict | None:
+    """GET /api/batch_plan?model=... — совет бэкенда по размеру батча. None при ошибке."""
+    url = f"{middleware_url.rstrip('/')}/api/batch_plan?model={urllib.parse.quote(model)}"
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            return json.loads(resp.read().decode())
+    except Exception:
+        return None
+
+
+class AdaptiveBatchSizer:
+    """
+    Размер батча между батчами: стартует с совета бэкенда, затем растёт,
+    если батчи отвечают заметно быстрее target_batch_sec, и сжимается, если медленнее.
+    Совет бэкенда (запись "meta" ответа) — верхняя граница; batch_size/max_chars клиента — тоже.
+    """
+
+    def __init__(self, plan: dict | None, batch_size: int | None = None, max_chars: int | None = None):
+        plan = plan or {}
+        self.user_max_paragraphs = batch_size
+        self.user_max_chars = max_chars
+        self.server_max_paragraphs = int(plan.get("max_paragraphs", DEFAULT_BATCH_SIZE))
+        self.server_max_chars = int(plan.get("max_chars", DEFAULT_MAX_CHARS))
+        self.batch_timeout = float(plan.get("batch_timeout_sec", 300))
+        self.target_sec = float(plan.get("target_batch_sec", DEFAULT_TARGET_SEC))
+        self.max_paragraphs = self._cap_paragraphs(self.server_max_paragraphs)
+        self.max_chars = self._cap_chars(self.server_max_chars)
+
+    def _cap_paragraphs(self, value: float) -> int:
+        value = min(value, self.server_max_paragraphs)
+        if self.user_max_paragraphs:
+            value = min(value, self.user_max_paragraphs)
+        return max(1, int(value))
+
+    def _cap_chars(self, value: float) -> int:
+        value = min(value, self.server_max_chars)
+        if self.user_max_chars:
+            value = min(value, self.user_max_chars)
+        return max(200, int(value))
+
+    def next_batch(self, paragraphs: list, start: int) -> list:
+        """Жадно набирает абзацы с позиции start в пределах лимитов (минимум один абзац)."""
+        batch = []
+        chars = 0
+        for p in paragraphs[start:]:
+            if batch and (len(batch) >= self.max_paragraphs or chars + len(p["text"]) > self.max_chars):
+                break
+            batch.append(p)
+            chars += len(p["text"])
+        return batch
+
+    def update_from_plan(self, plan: dict):
+        """Совет бэкенда мог поменяться (модель прогрелась, RAM освободилась)."""
+        try:
+            if plan.get("max_paragraphs"):
+                self.server_max_paragraphs = int(plan["max_paragraphs"])
+            if plan.get("max_chars"):
+                self.server_max_chars = int(plan["max_chars"])
+            if plan.get("batch_timeout_sec"):
+                self.batch_timeout = float(plan["batch_timeout_sec"])
+        except (TypeError, ValueError):
+            return
+        self.max_paragraphs = self._cap_paragraphs(self.max_paragraphs)
+        self.max_chars = self._cap_chars(self.max_chars)
+
+    def record(self, elapsed: float):
+        """Подстраивает размер по фактической длительности батча."""
+        if elapsed <= 0:
+            return
+        ratio = self.target_sec / elapsed
+        if ratio > 2.0:
+            factor = 1.25           # батч «пролетел» — растём плавно
+        elif ratio < 1.0:
+            factor = max(0.5, ratio)  # дольше цели — сжимаемся пропорционально
+        else:
+            return
+        new_paragraphs = round(self.max_paragraphs * factor)
+        if factor > 1:
+            new_paragraphs = max(new_paragraphs, self.max_paragraphs + 1)  # иначе 3 * 1.25 застрянет на 3
+        self.max_paragraphs = self._cap_paragraphs(new_paragraphs)
+        self.max_chars = self._cap_chars(self.max_chars * factor)
+
+
 def call_apply_template_ndjson(
     content: str | list[str],
     model: str,
@@ -186,15 +281,30 @@ def call_apply_template_ndjson(
     result_queue: queue.Queue,
     stop_event: threading.Event,
     timeout_per_line: int = 20,
+    batch_size: int | None = None,
+    max_chars_per_batch: int | None = None,
+    progressive: bool = False,
+    cascade_model: str | None = None,
+    prompt_compaction: bool | None = None,
+    deadline_ms: int | None = None,
 ) -> tuple[bool, str]:
     """
     НОВАЯ АРХИТЕКТУРА (Шаг 4): Клиентский батчинг + NDJSON.
     
     1. Нарезает контент на параграфы и присваивает глобальные ID (1..N).
-    2. Разделяет на батчи (BATCH_SIZE = 15).
+    2. Разделяет на батчи адаптивного размера (AdaptiveBatchSizer: совет /api/batch_plan,
+       затем подстройка по времени ответа; batch_size/max_chars_per_batch — верхние границы).
     3. Шлет POST /v1/completions для каждого батча.
     4. Бэкенд возвращает каждую строчку как {"id": ID, "style_name": ...}.
     5. Клиент кладет результат в очередь, макрос в LivreOffice применяет стиль по ID.
+
+    progressive=True: бэкенд сразу отдает предварительные стили ("provisional": true),
+    а поправки LLM — позже, записями "revision": true для уже оформленных абзацев.
+    cascade_model: маленькая модель каскада Шага C ("" — выключить каскад сервера).
+    prompt_compaction: в LLM — голова абзаца + признаки вместо полного текста
+    (None — как настроено на сервере).
+    deadline_ms: бюджет латентности одного батча (заголовок X-Deadline-Ms): бэкенд отдаёт
+    в LLM только то, что успеет, остальное — без LLM; клиент ждёт батч не дольше бюджета.
     """
     
     # 1. Формирование глобального ID-массива параграфов
@@ -215,53 +325,74 @@ def call_apply_template_ndjson(
         result_queue.put({"DONE": True})
         return False, None
 
-    BATCH_SIZE = 15
+    sizer = AdaptiveBatchSizer(
+        fetch_batch_plan(middleware_url, model),
+        batch_size=batch_size,
+        max_chars=max_chars_per_batch,
+    )
+    # Один session_id на документ: бэкенд держит все батчи на одном узле Ollama (KV-cache reuse)
+    session_id = uuid.uuid4().hex
     is_degraded = False
     rag_template_id = None
     first_batch = True
+    llm_unavailable = False
 
     def _ndjson_reader():
-        nonlocal is_degraded, rag_template_id, first_batch
+        nonlocal is_degraded, rag_template_id, first_batch, llm_unavailable
         
         try:
-            for batch_start in range(0, len(paragraphs), BATCH_SIZE):
+            batch_start = 0
+            while batch_start < len(paragraphs):
                 if stop_event.is_set():
                     break
                     
-                batch = paragraphs[batch_start : batch_start + BATCH_SIZE]
+                batch = sizer.next_batch(paragraphs, batch_start)
+                batch_start += len(batch)
                 batch_raw_accumulated = ""
+                batch_started_at = time.time()
                 
                 # Формируем payload для нового гибридного API
-                # Отправляем JSON-массив параграфов внутри prompt
-                payload_prompt = f"=== USER CONTENT (CONTENT SOURCE) ===\n{json.dumps(batch, ensure_ascii=False)}"
-                
+                # Абзацы — массивом верхнего уровня: без JSON-строки внутри prompt и второго разбора
                 data = {
                     'model': model,
-                    'prompt': payload_prompt,
+                    'paragraphs': batch,
                     'stream': False, # Запускает NDJSON-стриминг на сервере (proxy_completions)
+                    'session_id': session_id,
+                    # Для признака позиции абзаца в сжатом промпте (pos=id/всего)
+                    'document_size': len(raw_paragraphs),
                     'options': {},
                 }
+                if progressive:
+                    data['progressive'] = True
+                if cascade_model is not None:
+                    data['cascade_model'] = cascade_model
+                if prompt_compaction is not None:
+                    data['prompt_compaction'] = prompt_compaction
 
                 url = f"{middleware_url.rstrip('/')}/v1/completions"
+                headers = {'Content-Type': 'application/json'}
+                batch_limit = sizer.batch_timeout
+                if deadline_ms:
+                    headers['X-Deadline-Ms'] = str(int(deadline_ms))
+                    # Бэкенд сам укладывается в дедлайн; запас — на сеть
+                    batch_limit = deadline_ms / 1000 + DEADLINE_SLACK_SEC
                 req = urllib.request.Request(
                     url,
                     data=json.dumps(data).encode(),
-                    headers={'Content-Type': 'application/json'},
+                    headers=headers,
                     method='POST',
                 )
                 
                 try:
                     response = urllib.request.urlopen(req, timeout=30)
-                    
-                    if first_batch:
-                        is_degraded = response.headers.get('X-Degraded-Mode') == 'true'
-                        rag_tid = response.headers.get('X-Best-Template-ID')
-                        if rag_tid:
-                            rag_template_id = urllib.parse.unquote(rag_tid)
-                        first_batch = False
-                        
+                    if response.headers.get('X-Degraded-Mode') == 'true':
+                        # Машина под давлением на память — известно ещё до meta-записи
+                        is_degraded = True
+
                     # Читаем этот батч
                     while not stop_event.is_set():
+                        if time.time() - batch_started_at > batch_limit:
+                            raise TimeoutError(f"batch exceeded {batch_limit:.0f}s")
                         line = response.readline()
                         if not line:
                             break # Конец потока/батча
@@ -279,6 +410,20 @@ def call_apply_template_ndjson(
                             if "error" in parsed_obj:
                                 result_queue.put({"error": parsed_obj["error"]})
                                 return # Фатальная ошибка, прерываем всё
+
+                            if "meta" in parsed_obj:
+                                # Шаблон RAG, деградация и совет по следующему батчу
+                                meta = parsed_obj["meta"]
+                                sizer.update_from_plan(meta.get("batch_plan") or {})
+                                if first_batch:
+                                    is_degraded = is_degraded or bool(meta.get("degraded"))
+                                    rag_template_id = meta.get("template_id")
+                                    first_batch = False
+                                if meta.get("llm_unavailable") and not llm_unavailable:
+                                    # Ollama недоступна: бэкенд оформляет без LLM, документ не бросаем
+                                    llm_unavailable = True
+                                    result_queue.put({"llm_unavailable": True})
+                                continue
                             
                             # Бэкенд возвращает {"id": N, "style_name": "..."}
                             # Передаем макросу LibreOffice
@@ -287,6 +432,7 @@ def call_apply_template_ndjson(
                             pass
                             
                     response.close()
+                    sizer.record(time.time() - batch_started_at)
                     
                     # Если батч не дал результатов, логируем сырой ответ
                     if not any(isinstance(item, dict) and "id" in item for item in list(result_queue.queue)):
@@ -218,6 +218,7 @@ class ApplyTemplateTimerListener(unohelper.Base):
         self.doc = doc
         self.formatter = formatter
         self.chunk_count = 0
+        self.revision_count = 0
         self.is_finished = False
         
         # Очищаем закладку при старте (первый чанк затирает выделение)
@@ -249,6 +250,21 @@ class ApplyTemplateTimerListener(unohelper.Base):
                     # Успех
                     self._finish()
                     return
+
+                if "llm_unavailable" in item:
+                    # Ollama недоступна: оставшиеся абзацы бэкенд оформляет эвристиками и Fast Track
+                    log_to_file("LLM unavailable: formatting continues without LLM")
+                    continue
+
+                if "refinement_error" in item:
+                    # Progressive: LLM не ответила, предварительные стили остаются как есть
+                    log_to_file(f"Refinement skipped: {item['refinement_error']}")
+                    continue
+
+                if item.get("revision"):
+                    # Поправка LLM к уже оформленному абзацу — только стиль, без вставки текста
+                    self._apply_revision(item)
+                    continue
                 
                 # Обработка готового параграфа JSON
                 self._process_chunk(item)
@@ -264,15 +280,12 @@ class ApplyTemplateTimerListener(unohelper.Base):
             self.main_job.msg_box(f"Error applying style: {str(e)}", "Error")
             self._finish()
 
-    def _process_chunk(self, block_data):
-        self.chunk_count += 1
-        self.dialog_handler.update_status(f"Applying AI styling...\nParagraphs processed: {self.chunk_count}")
-        
-        # Получаем закладку по ID параграфа из JSON
+    def _find_anchor(self, block_data):
+        """Диапазон абзаца по закладке {bookmark_name}_p{id}; None, если не найден."""
         p_id = block_data.get("id")
         if p_id is None:
             log_to_file(f"Warning: No ID in block_data: {block_data}")
-            return
+            return None
             
         target_bookmark = f"{self.bookmark_name}_p{p_id}"
         
@@ -280,11 +293,41 @@ class ApplyTemplateTimerListener(unohelper.Base):
             bookmarks = self.doc.getBookmarks()
             if not bookmarks.hasByName(target_bookmark):
                 log_to_file(f"Bookmark {target_bookmark} not found.")
-                return
+                return None
             bookmark = bookmarks.getByName(target_bookmark)
-            anchor = bookmark.getAnchor()
+            return bookmark.getAnchor()
         except Exception as e:
             log_to_file(f"Bookmark retrieval error: {e}")
+            return None
+
+    def _apply_revision(self, block_data):
+        """Progressive refinement: меняем стиль абзаца на месте (без PARAGRAPH_BREAK и текста)."""
+        self.revision_count += 1
+        self.dialog_handler.update_status(
+            f"Refining AI styling...\nParagraphs processed: {self.chunk_count}\nRevised: {self.revision_count}"
+        )
+        anchor = self._find_anchor(block_data)
+        if anchor is None:
+            return
+        try:
+            cursor = self.doc.Text.createTextCursorByRange(anchor)
+            style_name = block_data.get("style_name")
+            if style_name:
+                self.formatter.ensure_style_exists(style_name, block_data)
+                try: cursor.ParaStyleName = style_name
+                except: pass
+            # Пустые поля DNA стиля (None) не трогаем, иначе UNO отвергнет всё форматирование
+            self.formatter._apply_direct_formatting(cursor, {k: v for k, v in block_data.items() if v is not None})
+        except Exception as e:
+            log_to_file("Revision format error", e)
+
+    def _process_chunk(self, block_data):
+        self.chunk_count += 1
+        self.dialog_handler.update_status(f"Applying AI styling...\nParagraphs processed: {self.chunk_count}")
+        
+        # Получаем закладку по ID параграфа из JSON
+        anchor = self._find_anchor(block_data)
+        if anchor is None:
             return
 
         # Курсор на выделение всей закладки (абзаца), чтобы заменить его содержимым, если оно поменялось,
@@ -545,6 +588,9 @@ class MainJob(unohelper.Base, XJobExecutor):
                     middleware_url=middleware_url,
                     result_queue=result_queue,
                     stop_event=stop_event,
+                    progressive=bool(self.get_config("progressive_refinement", False)),
+                    prompt_compaction=self.get_config("prompt_compaction", None),
+                    deadline_ms=self.get_config("deadline_ms", None),
                 )
                 
                 if is_degraded: